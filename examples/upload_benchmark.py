@@ -0,0 +1,161 @@
+"""Upload benchmark of vprof stats servers.
+
+Benchmark starts threaded and asyncio-based stats servers in subprocesses
+and uploads profiles to each of them from many concurrent clients. Every
+client keeps a persistent connection, like runner.AsyncUploader does.
+Throughput, latency, failed uploads, server thread count and peak RSS are
+reported.
+
+To run benchmark:
+
+    python upload_benchmark.py --clients 500 --uploads 10
+
+Output of a 500 x 10 run with 30KB gzipped profiles on a single-core
+machine:
+
+    server    uploads/s  p50 ms   p99 ms  failed  threads  peak RSS MB
+    threaded       16.9   739.1   7390.8    3170      160        261.4
+    async         231.0  1966.6   2927.9       0       17         72.1
+
+Threaded server drops most connections, since its listen backlog overflows
+and every accepted connection holds a thread with whole body in memory.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+import psutil
+
+_HOST = 'localhost'
+_SERVER_SCRIPT = """
+import functools, sys
+from vprof import async_server, stats_server
+host, port, kind = sys.argv[1], int(sys.argv[2]), sys.argv[3]
+if kind == 'async':
+    server = async_server.AsyncStatsServer((host, port), {})
+else:
+    server = stats_server.StatsServer(
+        (host, port), functools.partial(stats_server.StatsHandler, {}))
+print('ready', flush=True)
+server.serve_forever()
+"""
+
+
+def make_profile(num_records):
+    """Returns gzipped profiler stats with specified number of records."""
+    records = [
+        ['/srv/app/module%d.py' % (i % 50), i, 'func%d' % i, 0.001 * i,
+         0.01, i, i, 0.001, 0.002, 'color%d' % i]
+        for i in range(num_records)]
+    stats = {'p': {
+        'objectName': 'handler (function)', 'callStats': records,
+        'totalTime': 1.5, 'primitiveCalls': num_records,
+        'totalCalls': num_records}}
+    return gzip.compress(json.dumps(stats).encode('utf-8'))
+
+
+async def upload(port, body, num_uploads, latencies):
+    """Sends uploads over one persistent connection."""
+    try:
+        reader, writer = await asyncio.open_connection(_HOST, port)
+    except OSError:
+        return num_uploads
+    request = ('POST /?session=bench HTTP/1.1\r\nHost: %s\r\n'
+               'Content-Length: %d\r\n\r\n' % (_HOST, len(body))).encode()
+    failed = sent = 0
+    try:
+        for _ in range(num_uploads):
+            start_time = time.perf_counter()
+            writer.write(request + body)
+            await writer.drain()
+            status_line = await reader.readline()
+            content_length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.lower() == 'content-length':
+                    content_length = int(value)
+            await reader.readexactly(content_length)
+            sent += 1
+            if b' 200 ' not in status_line:
+                failed += 1
+            latencies.append(time.perf_counter() - start_time)
+    except (OSError, asyncio.IncompleteReadError):
+        failed += num_uploads - sent
+    finally:
+        writer.close()
+    return failed
+
+
+async def run_clients(port, body, num_clients, num_uploads, latencies):
+    """Runs concurrent clients and returns number of failed uploads."""
+    results = await asyncio.gather(*[
+        upload(port, body, num_uploads, latencies)
+        for _ in range(num_clients)])
+    return sum(results)
+
+
+def benchmark(kind, port, body, num_clients, num_uploads):
+    """Benchmarks server of specified kind."""
+    server = subprocess.Popen(
+        [sys.executable, '-c', _SERVER_SCRIPT, _HOST, str(port), kind],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    server.stdout.readline()
+    process = psutil.Process(server.pid)
+    latencies, peak_rss, peak_threads = [], 0, 0
+
+    async def _monitor(done):
+        nonlocal peak_rss, peak_threads
+        while not done.is_set():
+            peak_rss = max(peak_rss, process.memory_info().rss)
+            peak_threads = max(peak_threads, process.num_threads())
+            await asyncio.sleep(0.05)
+
+    async def _run():
+        done = asyncio.Event()
+        monitor = asyncio.ensure_future(_monitor(done))
+        failed = await run_clients(
+            port, body, num_clients, num_uploads, latencies)
+        done.set()
+        await monitor
+        return failed
+
+    start_time = time.perf_counter()
+    failed = asyncio.run(_run())
+    run_time = time.perf_counter() - start_time
+    server.kill()
+    server.wait()
+    latencies.sort()
+    print('%-8s %11.1f %7.1f %8.1f %7d %8d %12.1f' % (
+        kind, len(latencies) / run_time,
+        statistics.median(latencies) * 1000,
+        latencies[int(len(latencies) * 0.99) - 1] * 1000, failed,
+        peak_threads, peak_rss / 2 ** 20))
+
+
+def main():
+    """Main function of the script."""
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n', maxsplit=1)[0])
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--uploads', type=int, default=10)
+    parser.add_argument('--records', type=int, default=2000)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+    body = make_profile(args.records)
+    print('Profile: %.1fKB gzipped' % (len(body) / 1024))
+    print('server    uploads/s  p50 ms   p99 ms  failed  threads  '
+          'peak RSS MB')
+    for i, kind in enumerate(('threaded', 'async')):
+        benchmark(kind, args.port + i, body, args.clients, args.uploads)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,11 @@
 """Setup script for vprof."""
 import glob
+import gzip
 import re
 import shlex
 import subprocess
+import sys
+import time
 import unittest
 
 import pkg_resources
@@ -60,6 +63,35 @@ class RunEndToEndTestCommand(cmd.Command):
         unittest.TextTestRunner(verbosity=2, buffer=True).run(suite)
 
 
+class RunStartupBenchmarkCommand(cmd.Command):
+    """Class that measures vprof CLI startup time."""
+    description = 'Measure vprof CLI startup time'
+    user_options = [('runs=', 'n', 'number of runs')]
+    modes = (
+        ('interpreter', 'pass'),
+        ('vprof CLI', 'import vprof.__main__'),
+        ('profilers', 'import vprof.runner; vprof.runner.load_profilers()'),
+    )
+
+    def initialize_options(self):
+        self.runs = 10
+
+    def finalize_options(self):
+        self.runs = int(self.runs)
+
+    def run(self):
+        for name, statement in self.modes:
+            command = [sys.executable, '-c', statement]
+            run_times = []
+            for _ in range(self.runs):
+                start_time = time.time()
+                subprocess.check_call(command)
+                run_times.append(time.time() - start_time)
+            print('%s: %.1f ms (min %.1f ms)' % (
+                name, 1000 * sum(run_times) / self.runs,
+                1000 * min(run_times)))
+
+
 class RunLintBackendCommand(cmd.Command):
     """Class that runs Python linter."""
     description = 'Run Python linter'
@@ -108,7 +140,8 @@ class RunCleanCommand(cmd.Command):
 
     def run(self):
         subprocess.check_output(
-            shlex.split('rm -rf vprof/ui/vprof_min.js'))
+            shlex.split('rm -rf vprof/ui/vprof_min.js '
+                        'vprof/ui/vprof_min.js.gz'))
 
 
 class RunDepsInstallCommand(cmd.Command):
@@ -134,6 +167,10 @@ class VProfBuild(install):
     """Class that represents UI build command."""
     def run(self):
         subprocess.check_call(shlex.split('npm run build'))
+        # Stats server serves precompressed bundle as is.
+        with open('vprof/ui/vprof_min.js', 'rb') as bundle_file, \
+                gzip.open('vprof/ui/vprof_min.js.gz', 'wb', 9) as gzip_file:
+            gzip_file.write(bundle_file.read())
 
 
 class VProfInstall(install):
@@ -166,7 +203,7 @@ def get_requirements():
 
 setup(
     name='vprof',
-    version=get_vprof_version('vprof/__main__.py'),
+    version=get_vprof_version('vprof/version.py'),
     packages=['vprof'],
     description="Visual profiler for Python",
     url='http://github.com/nvdv/vprof',
@@ -195,6 +232,7 @@ setup(
         'test_python': RunUnittestsBackendCommand,
         'test_javascript': RunUnittestsFrontendCommand,
         'e2e_test': RunEndToEndTestCommand,
+        'benchmark_startup': RunStartupBenchmarkCommand,
         'lint_python': RunLintBackendCommand,
         'lint_javascript': RunLintFrontendCommand,
         'deps_install': RunDepsInstallCommand,
@@ -1,20 +1,14 @@
 """Main module of the profiler."""
-# pylint: disable=wrong-import-position
-import builtins
-import os
-import psutil
-
-# Take process RSS in order to compute profiler memory overhead.
-builtins.initial_rss_size = psutil.Process(os.getpid()).memory_info().rss
-
+# Profilers, runner and worker are imported only in modes that use them,
+# so rendering UI from file or launching in remote mode starts fast.
+# pylint: disable=import-outside-toplevel
 import argparse
+import gzip
 import json
 import sys
 
-from vprof import runner
 from vprof import stats_server
-
-__version__ = '0.38'
+from vprof.version import __version__
 
 _PROGRAN_NAME = 'vprof'
 _MODULE_DESC = 'Visual profiler for Python'
@@ -25,15 +19,66 @@ available CONFIG options
   c - flame graph
   m - memory graph
   h - code heatmap""")
+_INPUT_FORMATS = ('json', 'pstats', 'folded')
+_OUTPUT_FORMATS = ('json', 'binary')
 _ERR_CODES = {
     'ambiguous_configuration': 1,
     'bad_option': 2,
-    'input_file_error': 3
+    'input_file_error': 3,
+    'worker_error': 4,
 }
 
 
-def main():
-    """Main function of the module."""
+def import_stats(filename, input_format):
+    """Loads stats in format of other profilers.
+
+    Args:
+        filename: Name of the file with stats.
+        input_format: 'pstats' for cProfile stats or 'folded' for collapsed
+            stacks.
+    Returns:
+        A dict with stats that can be rendered by UI.
+    """
+    if input_format == 'pstats':
+        from vprof import profiler
+        return {'p': profiler.Profiler.load_pstats(filename)}
+    from vprof import flame_graph
+    return {'c': flame_graph.FlameGraphProfiler.load_collapsed_stacks(
+        filename)}
+
+
+def load_saved_stats(filename):
+    """Loads stats saved by vprof in JSON or binary format.
+
+    Stats in binary format are decoded lazily, when they are accessed.
+    """
+    from vprof import profile_file
+    if profile_file.is_profile_file(filename):
+        reader = profile_file.ProfileReader(filename)
+        saved_stats = profile_file.LazyStats(reader)
+        saved_stats['version'] = reader.version
+        return saved_stats
+    open_file = gzip.open if filename.endswith('.gz') else open
+    with open_file(filename, 'rt') as ifile:
+        return json.loads(ifile.read())
+
+
+def save_stats(program_stats, filename, output_format):
+    """Saves stats to file in output_format."""
+    if output_format == 'binary':
+        from vprof import profile_file
+        with profile_file.ProfileWriter(filename, __version__) as writer:
+            for option, stats in program_stats.items():
+                if option != 'version':
+                    writer.write_section(option, stats)
+        return
+    with open(filename, 'w') as outfile:
+        program_stats['version'] = __version__
+        outfile.write(json.dumps(dict(program_stats), indent=2))
+
+
+def _create_parser():
+    """Returns parser of command line arguments."""
     parser = argparse.ArgumentParser(
         prog=_PROGRAN_NAME, description=_MODULE_DESC,
         formatter_class=argparse.RawTextHelpFormatter)
@@ -44,8 +89,17 @@ def main():
     launch_modes.add_argument('-i', '--input-file', dest='input_file',
                               type=str, default='',
                               help='render UI from file')
+    launch_modes.add_argument('-w', '--worker', dest='worker',
+                              action='store_true', default=False,
+                              help='launch worker that profiles programs in '
+                                   'processes forked from it')
     launch_modes.add_argument('-c', '--config', nargs=2, dest='config',
                               help=_CONFIG_DESC, metavar=('CONFIG', 'SRC'))
+    parser.add_argument('--input-format', dest='input_format',
+                        choices=_INPUT_FORMATS, default='json',
+                        help='format of input file - vprof json, cProfile '
+                             'stats (shown as profiler) or collapsed stacks '
+                             '(shown as flame graph)')
     parser.add_argument('-H', '--host', dest='host', default=_HOST, type=str,
                         help='set internal webserver host')
     parser.add_argument('-p', '--port', dest='port', default=_PORT, type=int,
@@ -54,49 +108,178 @@ def main():
                         action='store_true', default=False,
                         help="don't start browser automatically")
     parser.add_argument('-o', '--output-file', dest='output_file',
-                        type=str, default='', help='save profile to file')
+                        type=str, default='',
+                        help='save profile to file, converts input file '
+                             'when used with -i')
+    parser.add_argument('--output-format', dest='output_format',
+                        choices=_OUTPUT_FORMATS, default='json',
+                        help='format of output file - vprof json or compact '
+                             'binary format written as profilers finish')
+    parser.add_argument('--repeat', dest='repeat', default=1, type=int,
+                        help='aggregate stats of REPEAT profiled runs '
+                             '(flame graph and profiler)')
+    parser.add_argument('--warmup', dest='warmup', default=0, type=int,
+                        help='do WARMUP unprofiled runs before profiling '
+                             '(flame graph and profiler)')
+    parser.add_argument('--timer', dest='timer', default='default',
+                        help='timer used by profiler - default, '
+                             'perf_counter_ns, process_time_ns or '
+                             'thread_time_ns')
+    parser.add_argument('--parallel', dest='parallel',
+                        action='store_true', default=False,
+                        help='run profilers concurrently, stats might be '
+                             'distorted by interference between runs')
+    parser.add_argument('--preload', dest='preload', default='', type=str,
+                        help='comma-separated modules imported by worker '
+                             'at start')
+    parser.add_argument('--use-worker', dest='use_worker',
+                        action='store_true', default=False,
+                        help='profile program in running worker')
+    parser.add_argument('--worker-socket', dest='worker_socket',
+                        default=None, type=str,
+                        help='set worker Unix socket path')
+    parser.add_argument('--async-server', dest='async_server',
+                        action='store_true', default=False,
+                        help='use asyncio-based server in remote mode, '
+                             'handles many concurrent uploaders better')
+    parser.add_argument('--aggregate-half-life', dest='aggregate_half_life',
+                        default=None, type=float,
+                        help='in remote mode, uploaded flame graphs lose '
+                             'half of their weight every '
+                             'AGGREGATE_HALF_LIFE seconds')
+    parser.add_argument('--aggregate-window', dest='aggregate_window',
+                        default=None, type=float,
+                        help='in remote mode, show flame graphs uploaded '
+                             'during the last AGGREGATE_WINDOW seconds')
     parser.add_argument('--debug', dest='debug_mode',
                         action='store_true', default=False,
                         help="don't suppress error messages")
     parser.add_argument('--version', action='version',
                         version='vprof %s' % __version__)
-    args = parser.parse_args()
+    return parser
+
 
-    # Render UI from file.
+def _render_input_file(args):
+    """Renders UI from input file or converts it to output file."""
+    from vprof import profile_file
+    try:
+        if args.input_format != 'json':
+            saved_stats = import_stats(args.input_file, args.input_format)
+            saved_stats['version'] = __version__
+        else:
+            saved_stats = load_saved_stats(args.input_file)
+    except (OSError, ValueError, TypeError, EOFError,
+            profile_file.Error) as exc:
+        print('Unable to import %s: %s' % (args.input_file, exc))
+        sys.exit(_ERR_CODES['input_file_error'])
+    if saved_stats['version'] != __version__:
+        print('Incorrect profiler version - %s. %s is required.' % (
+            saved_stats['version'], __version__))
+        sys.exit(_ERR_CODES['input_file_error'])
+    if args.output_file:
+        save_stats(saved_stats, args.output_file, args.output_format)
+    else:
+        stats_server.start(args.host, args.port, saved_stats,
+                           args.dont_start_browser, args.debug_mode)
+
+
+def _launch_worker(args):
+    """Launches worker that profiles programs in processes forked from it."""
+    from vprof import worker
+    preload = [name for name in args.preload.split(',') if name]
+    try:
+        worker.serve(
+            args.worker_socket or worker.DEFAULT_SOCKET_PATH,
+            preload=preload)
+    except worker.Error as exc:
+        print(exc)
+        sys.exit(_ERR_CODES['worker_error'])
+
+
+def _launch_remote(args, parser):
+    """Launches server that shows stats uploaded by remote programs."""
+    from vprof import call_tree_aggregate
+    try:
+        aggregate_factory = call_tree_aggregate.get_aggregate_factory(
+            half_life=args.aggregate_half_life,
+            window=args.aggregate_window)
+    except call_tree_aggregate.Error as exc:
+        parser.error(str(exc))
+    server_factory = stats_server.create_server
+    if args.async_server:
+        from vprof import async_server
+        server_factory = async_server.AsyncStatsServer
+    stats_server.start(args.host, args.port, {},
+                       args.dont_start_browser, args.debug_mode,
+                       server_factory=server_factory,
+                       aggregate_factory=aggregate_factory)
+
+
+def _run_profilers(args):
+    """Profiles program and renders UI or saves stats to file."""
+    from vprof import runner
+    from vprof import worker
+    config, source = args.config
+    prof_options = {
+        'repeat': args.repeat,
+        'warmup': args.warmup,
+        'timer': args.timer,
+        'parallel': args.parallel,
+    }
+    writer = None
+    if args.output_file and args.output_format == 'binary':
+        from vprof import profile_file
+        # Stats of each profiler are written as soon as it finishes.
+        writer = profile_file.ProfileWriter(args.output_file, __version__)
+    try:
+        if args.use_worker:
+            program_stats = worker.request_profile(
+                source, config,
+                args.worker_socket or worker.DEFAULT_SOCKET_PATH,
+                **prof_options)
+            if writer:
+                for option, stats in program_stats.items():
+                    writer.write_section(option, stats)
+        else:
+            program_stats = runner.run_profilers(
+                source, config, verbose=True,
+                stats_callback=writer.write_section if writer else None,
+                **prof_options)
+    except worker.Error as exc:
+        print(exc)
+        sys.exit(_ERR_CODES['worker_error'])
+    except runner.AmbiguousConfigurationError:
+        print('Profiler configuration %s is ambiguous. '
+              'Please, remove duplicates.' % config)
+        sys.exit(_ERR_CODES['ambiguous_configuration'])
+    except runner.BadOptionError as exc:
+        print(exc)
+        sys.exit(_ERR_CODES['bad_option'])
+    finally:
+        if writer:
+            writer.close()
+
+    if args.output_file and not writer:
+        save_stats(program_stats, args.output_file, args.output_format)
+    elif not args.output_file:
+        stats_server.start(
+            args.host, args.port, program_stats,
+            args.dont_start_browser, args.debug_mode)
+
+
+def main():
+    """Main function of the module."""
+    parser = _create_parser()
+    args = parser.parse_args()
     if args.input_file:
-        with open(args.input_file) as ifile:
-            saved_stats = json.loads(ifile.read())
-            if saved_stats['version'] != __version__:
-                print('Incorrect profiler version - %s. %s is required.' % (
-                    saved_stats['version'], __version__))
-                sys.exit(_ERR_CODES['input_file_error'])
-            stats_server.start(args.host, args.port, saved_stats,
-                               args.dont_start_browser, args.debug_mode)
-    # Launch in remote mode.
+        _render_input_file(args)
+    elif args.worker:
+        _launch_worker(args)
     elif args.remote:
-        stats_server.start(args.host, args.port, {},
-                           args.dont_start_browser, args.debug_mode)
-    # Profiler mode.
+        _launch_remote(args, parser)
     else:
-        config, source = args.config
-        try:
-            program_stats = runner.run_profilers(source, config, verbose=True)
-        except runner.AmbiguousConfigurationError:
-            print('Profiler configuration %s is ambiguous. '
-                  'Please, remove duplicates.' % config)
-            sys.exit(_ERR_CODES['ambiguous_configuration'])
-        except runner.BadOptionError as exc:
-            print(exc)
-            sys.exit(_ERR_CODES['bad_option'])
-
-        if args.output_file:
-            with open(args.output_file, 'w') as outfile:
-                program_stats['version'] = __version__
-                outfile.write(json.dumps(program_stats, indent=2))
-        else:
-            stats_server.start(
-                args.host, args.port, program_stats,
-                args.dont_start_browser, args.debug_mode)
+        _run_profilers(args)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,116 @@
+"""Continuous profiling agent.
+
+Agent runs inside a process, samples stacks of all threads at a low rate
+and saves a flame graph of every fixed time window to a directory. Directory
+is used as a ring buffer - oldest windows are removed when total size of
+saved windows exceeds the limit, so profiles of recent incidents are always
+available.
+"""
+import gzip
+import json
+import os
+import re
+import time
+
+from vprof import flame_graph
+from vprof import profiling_window
+from vprof.version import __version__
+
+_SAMPLE_INTERVAL = 0.01
+_WINDOW_LENGTH = 60
+_MAX_SIZE = 64 * 1024 * 1024
+_FILENAME_FORMAT = 'vprof-%d-%d.json.gz'
+_FILENAME_REGEX = re.compile(
+    r'^vprof-(?P<timestamp>\d+)-(?P<pid>\d+)\.json\.gz$')
+
+
+def list_windows(directory):
+    """Returns (start time, filename) tuples of saved windows, oldest first."""
+    windows = []
+    for filename in os.listdir(directory):
+        match = _FILENAME_REGEX.match(filename)
+        if match:
+            windows.append((
+                int(match.group('timestamp')),
+                os.path.join(directory, filename)))
+    return sorted(windows)
+
+
+def load_window(filename):
+    """Loads stats of a saved window."""
+    with gzip.open(filename, 'rt') as infile:
+        return json.loads(infile.read())
+
+
+class Agent(profiling_window.ProfilingWindow):
+    """Profiles current process continuously in fixed time windows.
+
+    Agent is started with start() and works until stop() is called or,
+    if duration is passed to start(), until duration seconds pass. The last
+    window is cut short when agent stops in the middle of it.
+    """
+
+    def __init__(self, directory, window_length=_WINDOW_LENGTH,
+                 max_size=_MAX_SIZE, sample_interval=_SAMPLE_INTERVAL):
+        """Initializes agent.
+
+        Args:
+            directory: Directory to save windows to.
+            window_length: Window length in seconds.
+            max_size: Max total size of saved windows in bytes.
+            sample_interval: Interval between stack samples in seconds.
+        """
+        super().__init__(sample_interval=sample_interval)
+        self._directory = directory
+        self._window_length = window_length
+        self._max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def _run(self, stopped, delay, duration):
+        """Samples stacks and saves every window until agent is stopped."""
+        if stopped.wait(delay):
+            return
+        end_time = time.time() + duration if duration else float('inf')
+        while not stopped.is_set() and time.time() < end_time:
+            prof = flame_graph._StatProfiler()  # pylint: disable=protected-access
+            start_time = time.time()
+            window_end = min(start_time + self._window_length, end_time)
+            while not stopped.wait(self._sample_interval):
+                self._sample(prof)
+                if time.time() >= window_end:
+                    break
+            self._save(prof, start_time, time.time() - start_time)
+
+    def _save(self, prof, start_time, run_time):
+        """Writes window to directory and removes oldest windows."""
+        run_stats = self._format_stats(prof, start_time, run_time)
+        run_stats['version'] = __version__
+        filename = os.path.join(
+            self._directory,
+            _FILENAME_FORMAT % (int(start_time), os.getpid()))
+        # Window is written to a temporary file first, so readers never see
+        # partially written windows.
+        tmp_filename = filename + '.tmp'
+        with gzip.open(tmp_filename, 'wt') as outfile:
+            outfile.write(json.dumps(run_stats, separators=(',', ':')))
+        os.replace(tmp_filename, filename)
+        self._remove_old_windows()
+
+    def _remove_old_windows(self):
+        """Removes oldest windows until total size fits max_size."""
+        windows = []
+        for _, filename in list_windows(self._directory):
+            try:
+                windows.append((filename, os.path.getsize(filename)))
+            except OSError:  # Removed by agent of another process.
+                continue
+        total_size = sum(size for _, size in windows)
+        # The newest window is kept even if it doesn't fit.
+        for filename, size in windows[:-1]:
+            if total_size <= self._max_size:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total_size -= size
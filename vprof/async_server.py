@@ -0,0 +1,430 @@
+"""Asyncio-based stats server.
+
+Server serves the same endpoints as stats_server.StatsServer, but handles
+all connections in one event loop instead of a thread per connection, so
+it copes with many concurrent uploaders. Uploaded bodies are decompressed
+while they are received, size of each body and total size of bodies in
+memory are limited and number of uploads processed at the same time is
+bounded. GET requests other than /events
+are handled by stats_server.StatsHandler in a thread pool.
+
+Server uses asyncio APIs available since Python 3.5.2.
+"""
+import asyncio
+import functools
+import http
+import http.client
+import io
+import json
+import socket
+import threading
+import traceback
+import zlib
+
+from collections import namedtuple
+from concurrent import futures
+
+from vprof import session_store
+from vprof import stats_server
+
+# Max size of uncompressed upload.
+_MAX_BODY_SIZE = 256 * 1024 * 1024
+# Max total size of uncompressed uploads received and parsed at the same time.
+_MAX_BUFFERED_SIZE = 512 * 1024 * 1024
+# Max number of uploads received and parsed at the same time.
+_MAX_CONCURRENCY = 16
+_MAX_HEADER_SIZE = 64 * 1024
+_EVENTS_URI = '/events'
+_READ_CHUNK_SIZE = 64 * 1024
+# Idle persistent connections are closed after this timeout.
+_KEEPALIVE_TIMEOUT = 60  # seconds
+_EVENTS_KEEPALIVE_INTERVAL = 15  # seconds
+
+# State of server bound to event loop of a serve_forever() call. Before
+# Python 3.10 asyncio primitives are bound to the loop they are created in.
+_LoopState = namedtuple(
+    '_LoopState', 'executor upload_slots profile_changed connections')
+
+
+def _current_task():
+    """Returns task that runs current coroutine."""
+    # asyncio.current_task was added in Python 3.7 and
+    # asyncio.Task.current_task was removed in Python 3.9.
+    if hasattr(asyncio, 'current_task'):
+        return asyncio.current_task()
+    return asyncio.Task.current_task()  # pylint: disable=no-member
+
+
+def _create_socket(server_address):
+    """Returns TCP socket bound to address and listening.
+
+    Works like socket.create_server, which was added in Python 3.8.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(server_address)
+        sock.listen()
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+class Error(Exception):
+    """Base exception for current module."""
+    pass  # pylint: disable=unnecessary-pass
+
+
+class RequestError(Error):
+    """Raised when request can't be handled.
+
+    Connection is closed after response with error status code.
+    """
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class _BodyBudget:
+    """Accounts for uncompressed upload bodies kept in memory.
+
+    Budget is used only by event loop thread, so it needs no lock.
+    """
+
+    def __init__(self, max_body_size, max_total_size):
+        self.max_body_size = max_body_size
+        self.max_total_size = max_total_size
+        self.size = 0
+
+    def get_limit(self, body_size):
+        """Returns max number of bytes body of body_size can grow by."""
+        return min(self.max_body_size - body_size,
+                   self.max_total_size - self.size)
+
+    def reserve(self, body_size, size):
+        """Accounts for size bytes added to body of body_size.
+
+        Raises:
+            RequestError: If body is too large or bodies of concurrent
+                uploads don't leave room for it.
+        """
+        if body_size + size > self.max_body_size:
+            raise RequestError(413, 'Request body is too large')
+        if self.size + size > self.max_total_size:
+            raise RequestError(503, 'Too many uploads in progress')
+        self.size += size
+
+    def release(self, size):
+        """Frees size bytes of processed body."""
+        self.size -= size
+
+
+class _BufferedStatsHandler(stats_server.StatsHandler):
+    """Handles request that was read in advance and buffers response."""
+
+    def setup(self):
+        self.rfile = io.BytesIO(self.request)
+        self.wfile = io.BytesIO()
+
+    def handle(self):
+        self.handle_one_request()
+
+    def finish(self):
+        pass
+
+
+def _format_response(code, headers, body=b''):
+    """Returns HTTP/1.1 response with specified status, headers and body."""
+    lines = ['HTTP/1.1 %d %s' % (code, http.HTTPStatus(code).phrase)]
+    lines.extend('%s: %s' % header for header in headers)
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+
+def _format_error(code, message):
+    """Returns response that reports error and closes connection."""
+    body = message.encode()
+    return _format_response(
+        code, (('Content-type', 'text/plain; charset=utf-8'),
+               ('Content-Length', len(body)),
+               ('Connection', 'close')), body)
+
+
+def _parse_request_head(head):
+    """Returns method, path, HTTP version and headers of request."""
+    request_line, _, header_data = head.partition(b'\r\n')
+    try:
+        method, path, version = request_line.decode('latin-1').split()
+        headers = http.client.parse_headers(io.BytesIO(header_data))
+    except (ValueError, http.client.HTTPException) as exc:
+        raise RequestError(400, 'Bad request') from exc
+    if not version.startswith('HTTP/1.'):
+        raise RequestError(505, 'HTTP version not supported')
+    return method, path, version, headers
+
+
+def _get_content_length(headers):
+    """Returns length of request body."""
+    if headers.get('Transfer-Encoding'):
+        raise RequestError(411, 'Chunked requests are not supported')
+    try:
+        content_length = int(headers.get('Content-Length', 0))
+    except ValueError as exc:
+        raise RequestError(400, 'Bad Content-Length') from exc
+    if content_length < 0:
+        raise RequestError(400, 'Bad Content-Length')
+    return content_length
+
+
+class AsyncStatsServer(stats_server.ProfileStateMixIn):
+    """Stats server that handles connections in asyncio event loop.
+
+    Server mimics socketserver API - socket is bound on creation, requests
+    are handled by serve_forever() and shutdown() stops serving from
+    another thread.
+    """
+
+    def __init__(self, server_address, profile_json,
+                 max_body_size=_MAX_BODY_SIZE,
+                 max_concurrency=_MAX_CONCURRENCY,
+                 max_buffered_size=_MAX_BUFFERED_SIZE,
+                 aggregate_factory=None):
+        """Initializes server and binds socket.
+
+        Args:
+            server_address: Tuple of host and port.
+            profile_json: A dict with program stats or
+                profile_file.LazyStats with stats of saved profile.
+            max_body_size: Max size of uncompressed upload in bytes.
+            max_concurrency: Max number of uploads processed at the same
+                time. Other uploads wait until their turn, so at most
+                max_concurrency bodies are kept in memory.
+            max_buffered_size: Max total size of uncompressed uploads
+                processed at the same time in bytes. Uploads that don't fit
+                are rejected with 503 status.
+            aggregate_factory: Callable that returns new aggregate of
+                uploaded flame graphs.
+        """
+        self.profile_json = profile_json
+        self.socket = _create_socket(server_address)
+        self._body_budget = _BodyBudget(max_body_size, max_buffered_size)
+        self._max_concurrency = max_concurrency
+        self._shutdown_request = False
+        self._is_shut_down = threading.Event()
+        self._loop_state = None
+        self.init_profile_state(aggregate_factory)
+
+    @property
+    def server_address(self):
+        """Returns address socket is bound to."""
+        return self.socket.getsockname()
+
+    def serve_forever(self, poll_interval=0.5):
+        """Handles requests until shutdown() is called."""
+        self._is_shut_down.clear()
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self._serve(poll_interval))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+            self._shutdown_request = False
+            self._is_shut_down.set()
+
+    def shutdown(self):
+        """Stops serve_forever() loop and waits until it's stopped."""
+        self._shutdown_request = True
+        self._is_shut_down.wait()
+
+    def server_close(self):
+        """Closes socket and ends event streams."""
+        self.close_profile_state()
+        self.socket.close()
+
+    async def _serve(self, poll_interval):
+        """Accepts connections until shutdown is requested."""
+        self._loop_state = _LoopState(
+            executor=futures.ThreadPoolExecutor(
+                max_workers=self._max_concurrency),
+            upload_slots=asyncio.Semaphore(self._max_concurrency),
+            profile_changed=asyncio.Condition(),
+            connections=set())
+        connections = self._loop_state.connections
+        try:
+            server = await asyncio.start_server(
+                self._handle_connection, sock=self.socket,
+                limit=_MAX_HEADER_SIZE)
+            while not self._shutdown_request:
+                await asyncio.sleep(poll_interval)
+            server.close()
+            for connection in list(connections):
+                connection.cancel()
+            await asyncio.gather(*connections, return_exceptions=True)
+            await server.wait_closed()
+        finally:
+            self._loop_state.executor.shutdown(wait=False)
+
+    async def _handle_connection(self, reader, writer):
+        """Handles requests sent over connection."""
+        self._loop_state.connections.add(_current_task())
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await asyncio.wait_for(
+                        reader.readuntil(b'\r\n\r\n'), _KEEPALIVE_TIMEOUT)
+                except asyncio.LimitOverrunError:
+                    writer.write(_format_error(431, 'Request too large'))
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    break
+                try:
+                    keep_alive = await self._handle_request(
+                        head, reader, writer)
+                except RequestError as exc:
+                    writer.write(_format_error(exc.code, str(exc)))
+                    break
+                await writer.drain()
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError,
+                asyncio.TimeoutError):
+            pass
+        except asyncio.CancelledError:
+            # Connections are cancelled on shutdown.
+            pass
+        except Exception:  # pylint: disable=broad-except
+            traceback.print_exc()
+        finally:
+            self._loop_state.connections.discard(_current_task())
+            writer.close()
+
+    async def _handle_request(self, head, reader, writer):
+        """Handles request and returns whether connection is kept alive."""
+        method, path, version, headers = _parse_request_head(head)
+        keep_alive = (version == 'HTTP/1.1' and
+                      headers.get('Connection', '').lower() != 'close')
+        content_length = _get_content_length(headers)
+        if method == 'POST':
+            await self._handle_upload(path, content_length, reader)
+            writer.write(_format_response(
+                200, (('Content-type', 'text/json; charset=utf-8'),
+                      ('Content-Length', 0))))
+            return keep_alive
+        if content_length > _MAX_HEADER_SIZE:
+            raise RequestError(413, 'Request body is too large')
+        await reader.readexactly(content_length)
+        if method == 'GET' and path.split('?')[0] == _EVENTS_URI:
+            await self._handle_events(headers, writer)
+            return False
+        handler = await asyncio.get_event_loop().run_in_executor(
+            self._loop_state.executor, functools.partial(
+                _BufferedStatsHandler, self.profile_json, head,
+                writer.get_extra_info('peername'), self))
+        writer.write(handler.wfile.getvalue())
+        return keep_alive and not handler.close_connection
+
+    async def _handle_upload(self, path, content_length, reader):
+        """Receives upload and merges it into profile."""
+        try:
+            session_id = stats_server.get_upload_session_id(path)
+        except session_store.BadSessionIdError as exc:
+            raise RequestError(400, 'Unsupported session ID') from exc
+        if content_length > self._body_budget.max_body_size:
+            raise RequestError(413, 'Request body is too large')
+        async with self._loop_state.upload_slots:
+            body = bytearray()
+            try:
+                await self._read_body(reader, content_length, body)
+                await asyncio.get_event_loop().run_in_executor(
+                    self._loop_state.executor, self._add_upload, body,
+                    session_id)
+            except ValueError as exc:
+                raise RequestError(400, 'Malformed profile') from exc
+            finally:
+                self._body_budget.release(len(body))
+        async with self._loop_state.profile_changed:
+            self._loop_state.profile_changed.notify_all()
+
+    async def _read_body(self, reader, content_length, body):
+        """Reads and decompresses gzipped body chunk by chunk into body.
+
+        Decompressed bytes are reserved in body budget as they are added,
+        caller releases them once body is processed.
+
+        Raises:
+            RequestError: If body is malformed, too large when decompressed
+                or doesn't fit into memory left by concurrent uploads.
+        """
+        budget = self._body_budget
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        remaining = content_length
+        try:
+            while remaining:
+                data = await asyncio.wait_for(
+                    reader.read(min(remaining, _READ_CHUNK_SIZE)),
+                    _KEEPALIVE_TIMEOUT)
+                if not data:
+                    raise asyncio.IncompleteReadError(b'', remaining)
+                remaining -= len(data)
+                while data:
+                    # Output is capped, so compressed bombs can't exhaust
+                    # memory.
+                    chunk = decompressor.decompress(
+                        data, budget.get_limit(len(body)) + 1)
+                    budget.reserve(len(body), len(chunk))
+                    body += chunk
+                    data = decompressor.unconsumed_tail
+        except zlib.error as exc:
+            raise RequestError(400, 'Body is not gzipped') from exc
+        if not decompressor.eof:
+            raise RequestError(400, 'Body is not gzipped')
+
+    def _add_upload(self, json_data, session_id):
+        """Parses uploaded profiles and merges them into profile."""
+        uploaded_stats = json.loads(json_data.decode('utf-8'))
+        # Uploaders can send several profiles in one batch.
+        if not isinstance(uploaded_stats, list):
+            uploaded_stats = [uploaded_stats]
+        if not all(isinstance(stats, dict) for stats in uploaded_stats):
+            raise ValueError('Profile is not an object')
+        self.add_uploads(
+            self.profile_json, uploaded_stats, session_id, len(json_data))
+
+    def _get_manifest(self):
+        """Returns current profile manifest."""
+        with self.lock:
+            return stats_server.get_manifest(
+                self.profile_json, self.profile_version)
+
+    async def _handle_events(self, headers, writer):
+        """Streams profile updates as server-sent events.
+
+        Stream works the same way as /events of stats_server.StatsServer.
+        """
+        try:
+            last_version = int(headers.get('Last-Event-ID'))
+        except (TypeError, ValueError):
+            last_version = None
+        writer.write(_format_response(
+            200, (('Content-type', 'text/event-stream'),
+                  ('Cache-Control', 'no-cache'),
+                  ('Connection', 'close'))))
+        while not self.closed:
+            manifest = self._get_manifest()
+            if manifest['version'] == last_version:
+                writer.write(b': keepalive\n\n')
+            else:
+                last_version = manifest['version']
+                writer.write(stats_server.format_event(manifest))
+            await writer.drain()
+            profile_changed = self._loop_state.profile_changed
+            async with profile_changed:
+                try:
+                    await asyncio.wait_for(
+                        profile_changed.wait_for(
+                            lambda: self.profile_version != last_version),
+                        _EVENTS_KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
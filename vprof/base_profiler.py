@@ -1,11 +1,16 @@
 """Base class of a profiler wrapper."""
 import inspect
+import marshal
 import multiprocessing
 import os
 import pkgutil
 import sys
 import zlib
 
+# Marshalled code of compiled modules keyed by module path, modification time
+# and size.
+_CODE_CACHE = {}
+
 
 def get_pkg_module_names(package_path):
     """Returns module filenames from package.
@@ -23,6 +28,26 @@ def get_pkg_module_names(package_path):
     return module_names
 
 
+def get_module_code(module_path):
+    """Returns marshalled code object of the module.
+
+    Module is read and compiled only once per run, even if it's profiled by
+    several profilers. Marshalled code can be sent to child processes and
+    restored there with marshal.loads.
+    Args:
+        module_path: Path to Python module.
+    Returns:
+        Bytes with marshalled code object.
+    """
+    module_stat = os.stat(module_path)
+    key = (module_path, module_stat.st_mtime_ns, module_stat.st_size)
+    if key not in _CODE_CACHE:
+        with open(module_path, 'rb') as srcfile:
+            _CODE_CACHE[key] = marshal.dumps(
+                compile(srcfile.read(), module_path, 'exec'))
+    return _CODE_CACHE[key]
+
+
 def hash_name(name):
     """Computes hash of the name."""
     return zlib.adler32(name.encode('utf-8'))
@@ -31,35 +56,36 @@ def hash_name(name):
 class ProcessWithException(multiprocessing.Process):
     """Process subclass that propagates exceptions to parent process.
 
-    Also handles sending function output to parent process.
+    Also handles sending function output to parent process. Output and
+    exception are pickled once and sent directly through the pipe.
     Args:
         parent_conn: Parent end of multiprocessing.Pipe.
         child_conn: Child end of multiprocessing.Pipe.
-        result: Result of the child process.
     """
 
-    def __init__(self, result, *args, **kwargs):
+    def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.parent_conn, self.child_conn = multiprocessing.Pipe()
-        self.result = result
+        self.parent_conn, self.child_conn = multiprocessing.Pipe(
+            duplex=False)
 
     def run(self):
         try:
-            self.result.update(
-                self._target(*self._args, **self._kwargs))
-            self.child_conn.send(None)
+            self.child_conn.send(
+                (self._target(*self._args, **self._kwargs), None))
         except Exception as exc:  # pylint: disable=broad-except
-            self.child_conn.send(exc)
+            self.child_conn.send((None, exc))
 
-    @property
-    def exception(self):
-        """Returns exception from child process."""
-        return self.parent_conn.recv()
+    def receive(self):
+        """Returns target function output and exception from child process.
 
-    @property
-    def output(self):
-        """Returns target function output."""
-        return self.result._getvalue()  # pylint: disable=protected-access
+        Must be called before join(), since child process blocks until large
+        output is read from the pipe.
+        """
+        try:
+            return self.parent_conn.recv()
+        except EOFError:
+            return None, RuntimeError(
+                'Process %s exited without sending results' % self.name)
 
 
 def run_in_separate_process(func, *args, **kwargs):
@@ -68,27 +94,32 @@ def run_in_separate_process(func, *args, **kwargs):
     This function is used instead of a decorator, since Python multiprocessing
     module can't serialize decorated function on all platforms.
     """
-    manager = multiprocessing.Manager()
-    manager_dict = manager.dict()
-    process = ProcessWithException(
-        manager_dict, target=func, args=args, kwargs=kwargs)
+    process = ProcessWithException(target=func, args=args, kwargs=kwargs)
     process.start()
+    # Child end of the pipe is closed in parent, so receive() doesn't hang
+    # if child process dies before sending results.
+    process.child_conn.close()
+    output, exc = process.receive()
     process.join()
-    exc = process.exception
     if exc:
         raise exc
-    return process.output
+    return output
 
 
-class BaseProfiler:
+# Attributes are run object description shared by all profilers and run
+# counts, grouping them would only add indirection to every profiler.
+class BaseProfiler:  # pylint: disable=too-many-instance-attributes
     """Base class for a profiler wrapper."""
 
-    def __init__(self, run_object):
+    def __init__(self, run_object, repeat=1, warmup=0):
         """Initializes profiler.
 
         Args:
             run_object: object to be profiled.
+            repeat: number of profiled runs to aggregate.
+            warmup: number of unprofiled runs before profiled ones.
         """
+        self._repeat, self._warmup = repeat, warmup
         run_obj_type = self.get_run_object_type(run_object)
         if run_obj_type == 'module':
             self.init_module(run_object)
@@ -0,0 +1,293 @@
+"""Running aggregates of flame graph call trees.
+
+Stats server merges call trees uploaded to it into aggregates, so flame
+graph shows samples of all profiled calls instead of the last one. Merging
+an uploaded tree takes time linear in its size - nodes of aggregate keep
+their children in dicts keyed by frame. Aggregate can weight samples by
+their age, so it shows current hot paths, or keep only samples uploaded
+during the last time window.
+"""
+import collections
+import math
+import time
+
+from vprof import base_profiler
+from vprof import flame_graph
+
+# Decay weights are renormalized when they grow by that factor.
+_MAX_DECAY_WEIGHT = 2 ** 10
+# Nodes with lower sample count are removed from decayed aggregates.
+_MIN_SAMPLE_COUNT = 0.5
+_NUM_WINDOW_BUCKETS = 6
+_SYNTHETIC_ROOT = ('all uploads', '', 0)
+
+
+class Error(Exception):
+    """Base exception for current module."""
+    pass  # pylint: disable=unnecessary-pass
+
+
+class BadCallTreeError(Error, ValueError):
+    """Raised when uploaded call tree is malformed."""
+    pass  # pylint: disable=unnecessary-pass
+
+
+def _get_merge_items(call_tree):
+    """Returns (parent, frame, sample count) tuples of call tree nodes.
+
+    Parent is the list index of parent node item or -1 for root, parents
+    always precede their children.
+
+    Raises:
+        BadCallTreeError: If call tree is malformed.
+    """
+    items, pending = [], [(-1, call_tree)]
+    try:
+        while pending:
+            parent, node = pending.pop()
+            frame = tuple(node['stack'])
+            if len(frame) != 3:
+                raise ValueError('Frame must be (func, filename, lineno)')
+            items.append((parent, frame, float(node['sampleCount'])))
+            parent = len(items) - 1
+            # Children are reversed, so they are popped in upload order.
+            pending.extend(
+                (parent, child) for child in reversed(node['children']))
+    except (KeyError, TypeError, ValueError) as exc:
+        raise BadCallTreeError('Malformed call tree') from exc
+    return items
+
+
+class CallTreeAggregate:
+    """Sum of call trees, optionally with exponentially decayed weights.
+
+    Nodes are [sample count, children by frame] lists.
+    """
+
+    def __init__(self, half_life=None):
+        """Initializes aggregate.
+
+        Args:
+            half_life: If specified, samples lose half of their weight every
+                half_life seconds.
+        """
+        self._decay_rate = math.log(2) / half_life if half_life else 0
+        self._half_life = half_life
+        self._roots = {}
+        self._run_time = 0.0
+        # Samples are added with weight growing over time instead of
+        # decaying all stored samples, weights are relative to _base_time.
+        self._base_time = None
+        self.uploads = 0
+        self.last_stats = None
+
+    def _get_weight(self, curr_time):
+        """Returns weight of samples added at curr_time."""
+        if not self._decay_rate:
+            return 1.0
+        if self._base_time is None:
+            self._base_time = curr_time
+        weight = math.exp(self._decay_rate * (curr_time - self._base_time))
+        if weight > _MAX_DECAY_WEIGHT:
+            self._scale(1 / weight)
+            self._base_time = curr_time
+            weight = 1.0
+        return weight
+
+    def _scale(self, factor):
+        """Multiplies sample counts by factor and removes tiny nodes."""
+        self._run_time *= factor
+        pending = [self._roots]
+        while pending:
+            children = pending.pop()
+            for frame, node in list(children.items()):
+                node[0] *= factor
+                if node[0] < _MIN_SAMPLE_COUNT:
+                    del children[frame]
+                else:
+                    pending.append(node[1])
+
+    def add(self, stats, curr_time=None):
+        """Merges flame graph stats into aggregate.
+
+        Uploads with empty or missing call tree are only counted.
+
+        Args:
+            stats: Flame graph stats with call tree in 'callStats'.
+            curr_time: Time of upload, current time if not specified.
+        Raises:
+            BadCallTreeError: If call tree is malformed.
+        """
+        call_tree = stats.get('callStats')
+        items = _get_merge_items(call_tree) if call_tree else []
+        weight = self._get_weight(
+            time.time() if curr_time is None else curr_time)
+        nodes = []
+        for parent, frame, sample_count in items:
+            children = self._roots if parent < 0 else nodes[parent][1]
+            node = children.get(frame)
+            if node is None:
+                node = children[frame] = [0.0, {}]
+            node[0] += sample_count * weight
+            nodes.append(node)
+        self._run_time += (stats.get('runTime') or 0) * weight
+        self.uploads += 1
+        self.last_stats = stats
+
+    def merge(self, other):
+        """Merges other aggregate into this one, both without decay."""
+        # pylint: disable=protected-access
+        pending = [(self._roots, other._roots)]
+        while pending:
+            children, other_children = pending.pop()
+            for frame, other_node in other_children.items():
+                node = children.get(frame)
+                if node is None:
+                    node = children[frame] = [0.0, {}]
+                node[0] += other_node[0]
+                pending.append((node[1], other_node[1]))
+        self._run_time += other._run_time
+        self.uploads += other.uploads
+        self.last_stats = other.last_stats or self.last_stats
+
+    def _get_current_factor(self, curr_time):
+        """Returns factor that converts stored sample counts to current."""
+        if not self._decay_rate or self._base_time is None:
+            return 1.0
+        return math.exp(-self._decay_rate * (curr_time - self._base_time))
+
+    def _format_tree(self, frame, node, factor, total_samples):
+        """Formats aggregated subtree for the UI."""
+        sample_count = int(round(node[0] * factor))
+        funcname, filename, _ = frame
+        return {
+            'stack': frame,
+            'children': [
+                self._format_tree(child_frame, child, factor, total_samples)
+                for child_frame, child in node[1].items()
+                if child[0] * factor >= _MIN_SAMPLE_COUNT],
+            'sampleCount': sample_count,
+            'samplePercentage': flame_graph._StatProfiler._get_percentage(  # pylint: disable=protected-access
+                sample_count, total_samples),
+            'colorHash': base_profiler.hash_name(
+                '%s @ %s' % (funcname, filename)),
+        }
+
+    def _get_root(self):
+        """Returns frame and node of aggregated tree root."""
+        if len(self._roots) == 1:
+            return next(iter(self._roots.items()))
+        return _SYNTHETIC_ROOT, [
+            sum(node[0] for node in self._roots.values()), self._roots]
+
+    def get_stats(self, curr_time=None):
+        """Returns aggregated flame graph stats.
+
+        Args:
+            curr_time: Time to compute decayed sample counts at, current
+                time if not specified.
+        """
+        factor = self._get_current_factor(
+            time.time() if curr_time is None else curr_time)
+        call_tree = {}
+        if self._roots:
+            frame, root = self._get_root()
+            total_samples = int(round(root[0] * factor))
+            if total_samples:
+                call_tree = self._format_tree(
+                    frame, root, factor, total_samples)
+        last_stats = self.last_stats or {}
+        return {
+            'objectName': last_stats.get('objectName'),
+            'sampleInterval': last_stats.get('sampleInterval'),
+            'runTime': self._run_time * factor,
+            'callStats': call_tree,
+            'totalSamples': call_tree.get('sampleCount', 0),
+            'timestamp': last_stats.get('timestamp'),
+            'uploads': self.uploads,
+            'halfLife': self._half_life,
+        }
+
+
+class WindowedCallTreeAggregate:
+    """Sum of call trees uploaded during the last time window.
+
+    Window is split into buckets with separate aggregates, the oldest
+    bucket is dropped as a whole when it leaves the window.
+    """
+
+    def __init__(self, window, num_buckets=_NUM_WINDOW_BUCKETS):
+        """Initializes aggregate.
+
+        Args:
+            window: Window length in seconds.
+            num_buckets: Number of buckets window is split into.
+        """
+        self._window = window
+        self._bucket_length = window / num_buckets
+        # Tuples of bucket start time and aggregate, oldest first.
+        self._buckets = collections.deque()
+
+    @property
+    def uploads(self):
+        """Number of uploads in buckets, expired buckets are dropped by
+        add and get_stats.
+        """
+        return sum(bucket.uploads for _, bucket in self._buckets)
+
+    def _drop_expired(self, curr_time):
+        """Drops buckets that left the window."""
+        while (self._buckets and
+               self._buckets[0][0] + self._bucket_length <=
+               curr_time - self._window):
+            self._buckets.popleft()
+
+    def add(self, stats, curr_time=None):
+        """Merges flame graph stats into current bucket.
+
+        Args:
+            stats: Flame graph stats with call tree in 'callStats'.
+            curr_time: Time of upload, current time if not specified.
+        Raises:
+            BadCallTreeError: If call tree is malformed.
+        """
+        curr_time = time.time() if curr_time is None else curr_time
+        self._drop_expired(curr_time)
+        if (not self._buckets or
+                self._buckets[-1][0] + self._bucket_length <= curr_time):
+            self._buckets.append((curr_time, CallTreeAggregate()))
+        self._buckets[-1][1].add(stats, curr_time)
+
+    def get_stats(self, curr_time=None):
+        """Returns flame graph stats of calls uploaded during the window.
+
+        Args:
+            curr_time: End of the window, current time if not specified.
+        """
+        self._drop_expired(time.time() if curr_time is None else curr_time)
+        aggregate = CallTreeAggregate()
+        for _, bucket in self._buckets:
+            aggregate.merge(bucket)
+        stats = aggregate.get_stats()
+        stats['window'] = self._window
+        del stats['halfLife']
+        return stats
+
+
+def get_aggregate_factory(half_life=None, window=None):
+    """Returns callable that creates aggregates of specified kind.
+
+    Args:
+        half_life: Half-life of samples in seconds for decayed aggregates.
+        window: Window length in seconds for windowed aggregates.
+    Raises:
+        Error: If both half_life and window are specified or they aren't
+            positive.
+    """
+    if half_life is not None and window is not None:
+        raise Error('Aggregate can be either decayed or windowed.')
+    if any(value is not None and value <= 0 for value in (half_life, window)):
+        raise Error('Half-life and window must be positive.')
+    if window:
+        return lambda: WindowedCallTreeAggregate(window)
+    return lambda: CallTreeAggregate(half_life)
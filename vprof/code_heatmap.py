@@ -1,6 +1,7 @@
 """Code heatmap module."""
 import inspect
 import fnmatch
+import marshal
 import os
 import runpy
 import sys
@@ -10,16 +11,25 @@ from collections import defaultdict
 from collections import deque
 from vprof import base_profiler
 
-_STDLIB_PATHS = [
-    os.path.abspath(path) for path in sys.path
-    if os.path.isdir(path) and path.startswith(sys.prefix)]
+# Computed on first use, since scanning sys.path slows down import.
+_STDLIB_PATHS = None
+
+
+def _get_stdlib_paths():
+    """Returns paths of standard library and installed modules."""
+    global _STDLIB_PATHS  # pylint: disable=global-statement
+    if _STDLIB_PATHS is None:
+        _STDLIB_PATHS = [
+            os.path.abspath(path) for path in sys.path
+            if os.path.isdir(path) and path.startswith(sys.prefix)]
+    return _STDLIB_PATHS
 
 
 def check_standard_dir(module_path):
     """Checks whether path belongs to standard library or installed modules."""
     if 'site-packages' in module_path:
         return True
-    for stdlib_path in _STDLIB_PATHS:
+    for stdlib_path in _get_stdlib_paths():
         if fnmatch.fnmatchcase(module_path, stdlib_path + '*'):
             return True
     return False
@@ -187,11 +197,9 @@ class CodeHeatmapProfiler(base_profiler.BaseProfiler):
             'runTime': run_time
         }
 
-    def _profile_module(self):
+    def _profile_module(self, module_code):
         """Calculates heatmap for a module."""
-        with open(self._run_object, 'r') as srcfile:
-            src_code = srcfile.read()
-            code = compile(src_code, self._run_object, 'exec')
+        code = marshal.loads(module_code)
         try:
             with _CodeHeatmapCalculator() as prof:
                 exec(code, self._globs, None)
@@ -214,7 +222,9 @@ class CodeHeatmapProfiler(base_profiler.BaseProfiler):
 
     def profile_module(self):
         """Runs module profiler in a separate process."""
-        return base_profiler.run_in_separate_process(self._profile_module)
+        return base_profiler.run_in_separate_process(
+            self._profile_module,
+            base_profiler.get_module_code(self._run_object))
 
     def profile_function(self):
         """Calculates heatmap for a function."""
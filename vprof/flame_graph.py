@@ -1,5 +1,8 @@
 """Flame graph module."""
 import inspect
+import marshal
+import os
+import re
 import runpy
 import signal
 import time
@@ -8,6 +11,10 @@ from collections import defaultdict
 from vprof import base_profiler
 
 _SAMPLE_INTERVAL = 0.001
+# Frame format used by py-spy and similar samplers - "func (file.py:10)".
+_FOLDED_FRAME_REGEX = re.compile(
+    r'^(?P<func>.+) \((?P<filename>.+):(?P<lineno>\d+)\)$')
+_FOLDED_ROOT = ('all', '', 0)
 
 
 class _StatProfiler:
@@ -51,6 +58,15 @@ class _StatProfiler:
         self._stats[tuple(stack)] += 1
         signal.setitimer(signal.ITIMER_PROF, _SAMPLE_INTERVAL)
 
+    def add_stack(self, stack, sample_count):
+        """Adds stack collected elsewhere to self._stats.
+
+        Args:
+            stack: Call stack, top of the stack goes first.
+            sample_count: Sample count of call stack.
+        """
+        self._stats[tuple(stack)] += sample_count
+
     @staticmethod
     def _insert_stack(stack, sample_count, call_tree):
         """Inserts a stack into the call tree.
@@ -113,21 +129,54 @@ class _StatProfiler:
             call_tree['children'][0], call_tree['sampleCount'])
 
 
+def _parse_folded_frame(frame):
+    """Converts frame from collapsed stack into (func, filename, lineno)."""
+    match = _FOLDED_FRAME_REGEX.match(frame)
+    if match:
+        return (match.group('func'), match.group('filename'),
+                int(match.group('lineno')))
+    return (frame, '', 0)
+
+
 class FlameGraphProfiler(base_profiler.BaseProfiler):
     """Statistical profiler wrapper.
 
     Runs statistical profiler and returns collected stats.
     """
 
-    def _profile_package(self):
-        """Runs statistical profiler on a package."""
-        with _StatProfiler() as prof:
-            prof.base_frame = inspect.currentframe()
-            try:
-                runpy.run_path(self._run_object, run_name='__main__')
-            except SystemExit:
-                pass
+    @staticmethod
+    def load_collapsed_stacks(filename):
+        """Loads call tree from a file with collapsed stacks.
+
+        Each line of the file contains semicolon-separated frames of a stack,
+        starting from the root, and sample count. The file is read line by
+        line, so only unique stacks and frames are kept in memory.
+        """
+        prof, frames = _StatProfiler(), {}
+        with open(filename) as stacks_file:
+            for line in stacks_file:
+                stack, _, sample_count = line.strip().rpartition(' ')
+                if not stack or not sample_count.isdigit():
+                    continue
+                curr_stack = [_FOLDED_ROOT]
+                for frame in stack.split(';'):
+                    if frame not in frames:
+                        frames[frame] = _parse_folded_frame(frame)
+                    curr_stack.append(frames[frame])
+                prof.add_stack(reversed(curr_stack), int(sample_count))
+
+        call_tree = prof.call_tree
+        return {
+            'objectName': '%s (collapsed stacks)' % filename,
+            'sampleInterval': None,
+            'runTime': None,
+            'callStats': call_tree,
+            'totalSamples': call_tree.get('sampleCount', 0),
+            'timestamp': int(os.path.getmtime(filename))
+        }
 
+    def _format_stats(self, prof):
+        """Formats collected samples for UI."""
         call_tree = prof.call_tree
         return {
             'objectName': self._object_name,
@@ -135,49 +184,62 @@ class FlameGraphProfiler(base_profiler.BaseProfiler):
             'runTime': prof.run_time,
             'callStats': call_tree,
             'totalSamples': call_tree.get('sampleCount', 0),
+            'repeat': self._repeat,
+            'warmup': self._warmup,
             'timestamp': int(time.time())
         }
 
+    def _profile_package(self):
+        """Runs statistical profiler on a package."""
+        for _ in range(self._warmup):
+            try:
+                runpy.run_path(self._run_object, run_name='__main__')
+            except SystemExit:
+                pass
+        # Samples of all runs are merged into a single call tree.
+        with _StatProfiler() as prof:
+            prof.base_frame = inspect.currentframe()
+            for _ in range(self._repeat):
+                try:
+                    runpy.run_path(self._run_object, run_name='__main__')
+                except SystemExit:
+                    pass
+        return self._format_stats(prof)
+
     def profile_package(self):
         """Runs package profiler in a separate process."""
         return base_profiler.run_in_separate_process(self._profile_package)
 
-    def _profile_module(self):
+    def _profile_module(self, module_code):
         """Runs statistical profiler on a module."""
-        with open(self._run_object, 'rb') as srcfile, _StatProfiler() as prof:
-            code = compile(srcfile.read(), self._run_object, 'exec')
-            prof.base_frame = inspect.currentframe()
+        code = marshal.loads(module_code)
+        for _ in range(self._warmup):
             try:
                 exec(code, self._globs, None)
             except SystemExit:
                 pass
-
-        call_tree = prof.call_tree
-        return {
-            'objectName': self._object_name,
-            'sampleInterval': _SAMPLE_INTERVAL,
-            'runTime': prof.run_time,
-            'callStats': call_tree,
-            'totalSamples': call_tree.get('sampleCount', 0),
-            'timestamp': int(time.time())
-        }
+        with _StatProfiler() as prof:
+            prof.base_frame = inspect.currentframe()
+            for _ in range(self._repeat):
+                try:
+                    exec(code, self._globs, None)
+                except SystemExit:
+                    pass
+        return self._format_stats(prof)
 
     def profile_module(self):
         """Runs module profiler in a separate process."""
-        return base_profiler.run_in_separate_process(self._profile_module)
+        return base_profiler.run_in_separate_process(
+            self._profile_module,
+            base_profiler.get_module_code(self._run_object))
 
     def profile_function(self):
         """Runs statistical profiler on a function."""
+        for _ in range(self._warmup):
+            self._run_object(*self._run_args, **self._run_kwargs)
         with _StatProfiler() as prof:
-            result = self._run_object(*self._run_args, **self._run_kwargs)
-
-        call_tree = prof.call_tree
-        return {
-            'objectName': self._object_name,
-            'sampleInterval': _SAMPLE_INTERVAL,
-            'runTime': prof.run_time,
-            'callStats': call_tree,
-            'totalSamples': call_tree.get('sampleCount', 0),
-            'result': result,
-            'timestamp': int(time.time())
-        }
+            for _ in range(self._repeat):
+                result = self._run_object(*self._run_args, **self._run_kwargs)
+        run_stats = self._format_stats(prof)
+        run_stats['result'] = result
+        return run_stats
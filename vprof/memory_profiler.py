@@ -2,6 +2,7 @@
 import builtins
 import gc
 import inspect
+import marshal
 import os
 import operator
 import psutil
@@ -16,6 +17,22 @@ from vprof import base_profiler
 
 
 _BYTES_IN_MB = 1024 * 1024
+# Object census is taken when RSS grows by _CENSUS_RSS_THRESHOLD bytes,
+# but not more often than once per _CENSUS_MIN_INTERVAL seconds. Census
+# walks the whole heap, so interval is also at least _CENSUS_COST_RATIO
+# times longer than the last census took.
+_CENSUS_RSS_THRESHOLD = 32 * _BYTES_IN_MB
+_CENSUS_MIN_INTERVAL = 0.5
+_CENSUS_COST_RATIO = 2
+_CENSUS_TOP_TYPES = 20
+# Approximate memory taken by a code event kept by _CodeEventsTracker -
+# tuple, int with RSS and a pointer in deque.
+_EVENT_SIZE = sys.getsizeof((0, 0, '', '')) + sys.getsizeof(2 ** 40) + 8
+
+
+def _get_current_rss():
+    """Returns resident set size of the current process."""
+    return psutil.Process(os.getpid()).memory_info().rss
 
 
 def _remove_duplicates(objects):
@@ -62,6 +79,32 @@ def _get_obj_count_difference(objs1, objs2):
     return obj_count_1 - obj_count_2
 
 
+def _count_objects_by_type(excluded_objects):
+    """Counts objects in memory by type.
+
+    GC doesn't track strings, numbers and containers that hold only them,
+    so they are counted as referents of tracked objects. Excluded objects
+    and objects referenced only by them aren't counted.
+    """
+    gc.collect()
+    counts, seen = Counter(), set()
+    excluded_ids = {id(obj) for obj in excluded_objects}
+    excluded_ids.update((id(counts), id(seen), id(excluded_ids)))
+    for obj in gc.get_objects():
+        if id(obj) in excluded_ids or inspect.isframe(obj):
+            continue
+        counts[type(obj)] += 1
+        pending = gc.get_referents(obj)
+        while pending:
+            referent = pending.pop()
+            if gc.is_tracked(referent) or id(referent) in seen:
+                continue
+            seen.add(id(referent))
+            counts[type(referent)] += 1
+            pending.extend(gc.get_referents(referent))
+    return counts
+
+
 def _format_obj_count(objects):
     """Formats object count."""
     result = []
@@ -75,6 +118,64 @@ def _format_obj_count(objects):
     return sorted(result, key=operator.itemgetter(1), reverse=True)
 
 
+class _ObjectCensus:
+    """Counts objects by type when memory usage grows.
+
+    Counts are differences from the baseline counted on start, so
+    snapshots show objects created by profiled code.
+    """
+
+    def __init__(self):
+        self.snapshots = []
+        self._baseline = Counter()
+        self._base_rss = None
+        self._next_census_time = 0
+
+    @property
+    def objects(self):
+        """Returns objects that hold census data."""
+        objects = [self, self.snapshots, self._baseline]
+        for snapshot in self.snapshots:
+            objects.extend((snapshot, snapshot[2]))
+        return objects
+
+    def start(self, excluded_objects):
+        """Counts baseline objects."""
+        self._baseline = _count_objects_by_type(
+            excluded_objects + self.objects)
+
+    def check(self, event_num, curr_rss, own_size, get_excluded_objects):
+        """Takes snapshot if memory usage has grown enough since the last one.
+
+        Args:
+            event_num: Number of current code event.
+            curr_rss: Current resident set size.
+            own_size: Memory taken by profiler, it doesn't count as growth.
+            get_excluded_objects: Returns profiler objects that aren't
+                counted.
+        """
+        curr_rss -= own_size
+        if self._base_rss is None or curr_rss < self._base_rss:
+            self._base_rss = curr_rss
+            return
+        if curr_rss - self._base_rss < _CENSUS_RSS_THRESHOLD:
+            return
+        start_time = time.time()
+        if start_time < self._next_census_time:
+            return
+        # Finalizers run by GC can trigger check before census is taken.
+        self._next_census_time = float('inf')
+        obj_count = _count_objects_by_type(
+            get_excluded_objects() + self.objects)
+        self.snapshots.append(
+            (event_num, curr_rss + own_size, obj_count - self._baseline))
+        # Counting can take memory that isn't returned to OS.
+        self._base_rss = _get_current_rss() - own_size
+        end_time = time.time()
+        self._next_census_time = end_time + max(
+            _CENSUS_MIN_INTERVAL, _CENSUS_COST_RATIO * (end_time - start_time))
+
+
 class _CodeEventsTracker:
     """Tracks specified events during code execution.
 
@@ -86,11 +187,13 @@ class _CodeEventsTracker:
         self._original_trace_function = sys.gettrace()
         self._process = psutil.Process(os.getpid())
         self._resulting_events = []
+        self._census = _ObjectCensus()
         self.mem_overhead = None
         self.target_modules = target_modules
 
     def __enter__(self):
         """Enables events tracker."""
+        self._census.start(self._get_own_objects())
         sys.settrace(self._trace_memory_usage)
         return self
 
@@ -101,11 +204,32 @@ class _CodeEventsTracker:
     def _trace_memory_usage(self, frame, event, arg):  #pylint: disable=unused-argument
         """Checks memory usage when 'line' event occur."""
         if event == 'line' and frame.f_code.co_filename in self.target_modules:
+            curr_rss = self._process.memory_info().rss
             self._events_list.append(
-                (frame.f_lineno, self._process.memory_info().rss,
+                (frame.f_lineno, curr_rss,
                  frame.f_code.co_name, frame.f_code.co_filename))
+            self._census.check(
+                len(self._events_list), curr_rss,
+                len(self._events_list) * _EVENT_SIZE, self._get_own_objects)
         return self._trace_memory_usage
 
+    def _get_own_objects(self):
+        """Returns tracker objects that aren't counted by census."""
+        return [self, self._events_list, self._resulting_events]
+
+    @property
+    def objects_census(self):
+        """Returns object census snapshots taken during execution.
+
+        Each snapshot contains number of the code event it was taken at,
+        memory usage and counts of object types that grew the most since
+        the start.
+        """
+        return [
+            [event_num, float(mem - self.mem_overhead) / _BYTES_IN_MB,
+             _format_obj_count(obj_count)[:_CENSUS_TOP_TYPES]]
+            for event_num, mem, obj_count in self._census.snapshots]
+
     @property
     def code_events(self):
         """Returns processed memory usage."""
@@ -135,6 +259,7 @@ class _CodeEventsTracker:
             self._events_list,
             self._process
         ]
+        overhead.extend(self._census.objects)
         overhead_count = _get_object_count_by_type(overhead)
         # One for reference to __dict__ and one for reference to
         # the current module.
@@ -153,7 +278,7 @@ class MemoryProfiler(base_profiler.BaseProfiler):
     Runs memory profiler and processes collected stats.
     """
 
-    def profile_package(self):
+    def _profile_package(self):
         """Returns memory stats for a package."""
         target_modules = base_profiler.get_pkg_module_names(self._run_object)
         try:
@@ -164,20 +289,30 @@ class MemoryProfiler(base_profiler.BaseProfiler):
             pass
         return prof, None
 
-    def profile_module(self):
+    def profile_package(self):
+        """Runs package memory profiler in a separate process."""
+        return base_profiler.run_in_separate_process(
+            self._collect_isolated_stats, self._profile_package)
+
+    def _profile_module(self, module_code):
         """Returns memory stats for a module."""
         target_modules = {self._run_object}
+        code = marshal.loads(module_code)
         try:
-            with open(self._run_object, 'rb') as srcfile,\
-                _CodeEventsTracker(target_modules) as prof:
-                code = compile(srcfile.read(), self._run_object, 'exec')
+            with _CodeEventsTracker(target_modules) as prof:
                 prof.compute_mem_overhead()
                 exec(code, self._globs, None)
         except SystemExit:
             pass
         return prof, None
 
-    def profile_function(self):
+    def profile_module(self):
+        """Runs module memory profiler in a separate process."""
+        return base_profiler.run_in_separate_process(
+            self._collect_isolated_stats, self._profile_module,
+            base_profiler.get_module_code(self._run_object))
+
+    def _profile_function(self):
         """Returns memory stats for a function."""
         target_modules = {self._run_object.__code__.co_filename}
         with _CodeEventsTracker(target_modules) as prof:
@@ -185,10 +320,23 @@ class MemoryProfiler(base_profiler.BaseProfiler):
             result = self._run_object(*self._run_args, **self._run_kwargs)
         return prof, result
 
-    def run(self):
-        """Collects memory stats for a specified Python program."""
+    def profile_function(self):
+        """Collects memory stats for a function in current process."""
+        return self._collect_stats(self._profile_function)
+
+    def _collect_isolated_stats(self, profile, *args):
+        """Collects memory stats in a freshly started child process.
+
+        RSS baseline is taken inside the child, so memory left over by
+        previously run profilers doesn't affect the results.
+        """
+        builtins.initial_rss_size = _get_current_rss()
+        return self._collect_stats(profile, *args)
+
+    def _collect_stats(self, profile, *args):
+        """Runs profile and collects memory stats of the Python program."""
         existing_objects = _get_in_memory_objects()
-        prof, result = self.profile()
+        prof, result = profile(*args)
         new_objects = _get_in_memory_objects()
 
         new_obj_count = _get_obj_count_difference(new_objects, existing_objects)
@@ -202,6 +350,7 @@ class MemoryProfiler(base_profiler.BaseProfiler):
             'codeEvents': prof.code_events,
             'totalEvents': len(prof.code_events),
             'objectsCount': pretty_obj_count,
+            'objectsCensus': prof.objects_census,
             'result': result,
             'timestamp': int(time.time())
         }
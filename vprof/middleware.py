@@ -0,0 +1,235 @@
+"""WSGI middleware that profiles a fraction of requests."""
+import inspect
+import os
+import random
+import sys
+import threading
+import time
+
+from collections import namedtuple
+
+from vprof import flame_graph
+from vprof import runner
+
+_ROOT_FRAME = ('requests', '', 0)
+_MAX_ROUTES = 100
+# Route of requests sampled after max_routes distinct routes.
+_OTHER_ROUTE = '<other>'
+
+# Request that is being processed by application.
+_Request = namedtuple('_Request', 'route base_frame sampled start_time')
+
+
+class _RequestTracker:
+    """Keeps requests processed by application and selects sampled ones.
+
+    Requests are sampled from start to finish with 1 / sample_rate
+    probability. If latency_threshold is specified, other requests are
+    sampled once they run longer than latency_threshold seconds. Only
+    the first max_routes distinct routes are kept, requests to other
+    routes are tracked under _OTHER_ROUTE, so the flame graph doesn't grow
+    with every distinct URL.
+    """
+
+    def __init__(self, sample_rate, latency_threshold, max_routes):
+        self._sample_rate = sample_rate
+        self._latency_threshold = latency_threshold
+        self._max_routes = max_routes
+        # Requests by ID of thread that processes them.
+        self._requests = {}
+        self._routes = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._requests)
+
+    def start(self, route, base_frame):
+        """Adds request processed by current thread if it can be sampled.
+
+        Returns:
+            Whether request can be sampled.
+        """
+        sampled = random.random() < 1.0 / self._sample_rate
+        if not sampled and self._latency_threshold is None:
+            return False
+        start_time = time.time()
+        with self._lock:
+            if route not in self._routes:
+                if len(self._routes) < self._max_routes:
+                    self._routes.add(route)
+                else:
+                    route = _OTHER_ROUTE
+            self._requests[threading.get_ident()] = _Request(
+                route, base_frame, sampled, start_time)
+        return True
+
+    def finish(self):
+        """Removes request processed by current thread."""
+        with self._lock:
+            del self._requests[threading.get_ident()]
+
+    def get_sampled(self):
+        """Returns (thread ID, request) pairs of requests to sample now."""
+        curr_time = time.time()
+        with self._lock:
+            requests = list(self._requests.items())
+        return [
+            (thread_id, request) for thread_id, request in requests
+            if request.sampled or
+            curr_time - request.start_time >= self._latency_threshold]
+
+
+def _get_path(environ):
+    """Returns request path as route of the request."""
+    return environ.get('PATH_INFO') or '/'
+
+
+class _SamplerThread:
+    """Background thread that calls sample and flush periodically.
+
+    Threads don't survive fork, so thread is started lazily by every
+    worker process of pre-forking servers.
+    """
+
+    def __init__(self, sample, flush, interval, flush_interval):
+        self._sample, self._flush = sample, flush
+        self.interval, self._flush_interval = interval, flush_interval
+        self._lock = threading.Lock()
+        # Sampler threads by ID of process that started them.
+        self._threads = {}
+        self._stopped = threading.Event()
+
+    def ensure_started(self):
+        """Starts thread in current process if it's not running."""
+        pid = os.getpid()
+        if pid in self._threads:
+            return
+        with self._lock:
+            if pid not in self._threads:
+                thread = threading.Thread(target=self._run, daemon=True)
+                thread.start()
+                self._threads[pid] = thread
+
+    def stop(self):
+        """Stops thread and waits until it finishes."""
+        self._stopped.set()
+        with self._lock:
+            thread = self._threads.get(os.getpid())
+        if thread:
+            thread.join()
+
+    def _run(self):
+        """Samples stacks and periodically flushes collected stats."""
+        last_flush = time.time()
+        while not self._stopped.wait(self.interval):
+            self._sample()
+            if time.time() - last_flush >= self._flush_interval:
+                self._flush()
+                last_flush = time.time()
+
+
+class ProfilingMiddleware:
+    """WSGI middleware that builds flame graphs of sampled requests.
+
+    Every request is sampled from start to finish with 1 / sample_rate
+    probability, so sampling doesn't lock onto periodic request patterns.
+    If latency_threshold is specified, other requests are sampled once they
+    run longer than latency_threshold seconds. Stacks of request threads are
+    sampled by a background thread, so the middleware works with threaded
+    servers and doesn't use signals. Samples are aggregated into one flame
+    graph with a subtree per route, which is request path by default.
+    Samples collected since the last upload are periodically sent to vprof
+    server, which sums them up with earlier uploads. Only the application
+    call is profiled, iteration over returned body is not.
+    """
+
+    def __init__(self, app, sample_rate=100, latency_threshold=None,
+                 host='localhost', port=8000, sample_interval=0.005,
+                 flush_interval=60, uploader=None, route_key=_get_path,
+                 max_routes=_MAX_ROUTES):
+        """Initializes middleware.
+
+        Args:
+            app: WSGI application.
+            sample_rate: Requests are sampled with 1 / sample_rate
+                probability, must be at least 1.
+            latency_threshold: Requests running longer than that number of
+                seconds are sampled as well.
+            host: Host name to send collected data.
+            port: Port number to send collected data.
+            sample_interval: Interval between stack samples in seconds.
+            flush_interval: Interval between uploads in seconds.
+            uploader: runner.AsyncUploader to send collected data with.
+            route_key: Callable that returns route of request by WSGI
+                environ, e.g. URL pattern matched by the application.
+            max_routes: Max number of distinct routes in the flame graph.
+                Requests to other routes are added to '<other>' route.
+        Raises:
+            ValueError: If sample_rate is less than 1.
+        """
+        if sample_rate < 1:
+            raise ValueError(
+                'sample_rate must be at least 1, got %r' % sample_rate)
+        self._app = app
+        self._requests = _RequestTracker(
+            sample_rate, latency_threshold, max_routes)
+        self._sampler = _SamplerThread(
+            self.sample, self.flush, sample_interval, flush_interval)
+        self._uploader = uploader or runner.AsyncUploader(host, port)
+        self._prof = flame_graph._StatProfiler()  # pylint: disable=protected-access
+        self._route_key = route_key
+
+    def __call__(self, environ, start_response):
+        if not self._requests.start(
+                self._route_key(environ), inspect.currentframe()):
+            return self._app(environ, start_response)
+        self._sampler.ensure_started()
+        try:
+            return self._app(environ, start_response)
+        finally:
+            self._requests.finish()
+
+    def sample(self):
+        """Adds current stacks of requests selected for sampling to stats."""
+        frames = sys._current_frames()  # pylint: disable=protected-access
+        for thread_id, request in self._requests.get_sampled():
+            frame = frames.get(thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame and frame is not request.base_frame:
+                stack.append((
+                    frame.f_code.co_name,
+                    frame.f_code.co_filename,
+                    frame.f_code.co_firstlineno))
+                frame = frame.f_back
+            if frame is None:  # Request finished while stack was collected.
+                continue
+            stack.append((request.route, 'route', 0))
+            stack.append(_ROOT_FRAME)
+            self._prof.add_stack(stack, 1)
+
+    def flush(self):
+        """Sends stats collected since the last flush to vprof server."""
+        prof = self._prof
+        self._prof = flame_graph._StatProfiler()  # pylint: disable=protected-access
+        call_tree = prof.call_tree
+        if not call_tree:
+            return
+        self._uploader.submit({'c': {
+            'objectName': 'Sampled requests (WSGI)',
+            'sampleInterval': self._sampler.interval,
+            'runTime': call_tree['sampleCount'] * self._sampler.interval,
+            'callStats': call_tree,
+            'totalSamples': call_tree['sampleCount'],
+            'timestamp': int(time.time())
+        }})
+
+    def close(self):
+        """Stops sampling and sends collected stats.
+
+        Sampler thread is stopped first, so it doesn't flush concurrently.
+        """
+        self._sampler.stop()
+        self.flush()
@@ -0,0 +1,645 @@
+"""Compact binary format of saved profiles.
+
+File starts with a header and contains a compressed section with stats of
+every profiler, followed by a section index and a footer:
+
+    header:  magic, format version
+    section: zlib compressed string table and encoded stats
+    ...
+    index:   vprof version, section names, offsets and sizes
+    footer:  index offset, magic
+
+Sections are written as soon as profilers finish and can be read
+independently, so only requested stats have to be decompressed and decoded.
+Strings are stored once per section in the string table. Lists of equally
+sized rows are stored column by column, flame graph call trees are stored
+as a frame table and sample counts.
+"""
+import array
+import itertools
+import mmap
+import operator
+import struct
+import sys
+import weakref
+import zlib
+
+from collections import OrderedDict
+from collections import abc
+from vprof import base_profiler
+from vprof import flame_graph
+
+FORMAT_VERSION = 1
+_MAGIC = b'VPROF'
+_FOOTER = struct.Struct('<Q')
+_FLOAT = struct.Struct('<d')
+_COMPRESSION_LEVEL = 6
+
+# Value tags.
+(_NONE_TAG, _FALSE_TAG, _TRUE_TAG, _INT_TAG, _FLOAT_TAG, _STR_TAG, _LIST_TAG,
+ _DICT_TAG, _TABLE_TAG, _TREE_TAG) = range(10)
+# Table column tags.
+_VALUES_COLUMN, _INTS_COLUMN, _FLOATS_COLUMN, _STRINGS_COLUMN = range(4)
+_TREE_KEYS = {'stack', 'children', 'sampleCount', 'samplePercentage',
+              'colorHash'}
+
+
+class Error(Exception):
+    """Base exception for current module."""
+    pass  # pylint: disable=unnecessary-pass
+
+
+class FormatError(Error):
+    """Raised when file is not a valid profile file."""
+    pass  # pylint: disable=unnecessary-pass
+
+
+def _is_int(value):
+    """Checks whether value is an integer, but not a bool."""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _get_json_key(key):
+    """Converts dict key to string the same way as JSON encoder."""
+    if isinstance(key, str):
+        return key
+    if key is None or isinstance(key, bool):
+        return {None: 'null', True: 'true', False: 'false'}[key]
+    if isinstance(key, float):
+        return repr(key)
+    return str(key)
+
+
+def _get_node_params(frame, sample_count, total_samples):
+    """Returns sample percentage and color hash of call tree node."""
+    funcname, filename, _ = frame
+    return (
+        flame_graph._StatProfiler._get_percentage(  # pylint: disable=protected-access
+            sample_count, total_samples),
+        base_profiler.hash_name('%s @ %s' % (funcname, filename)))
+
+
+class _ByteWriter:
+    """Writes integers and strings into a buffer."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write_varint(self, value):
+        """Writes non-negative integer using 7 bits per byte."""
+        while value > 0x7f:
+            self._buffer.append((value & 0x7f) | 0x80)
+            value >>= 7
+        self._buffer.append(value)
+
+    def write_int(self, value):
+        """Writes integer in zigzag encoding."""
+        self.write_varint(2 * value if value >= 0 else -2 * value - 1)
+
+    def write_text(self, value):
+        """Writes length-prefixed string."""
+        data = value.encode('utf-8', 'surrogatepass')
+        self.write_varint(len(data))
+        self._buffer += data
+
+    def getvalue(self):
+        """Returns written data."""
+        return bytes(self._buffer)
+
+
+class _ByteReader:
+    """Reads integers and strings written by _ByteWriter."""
+
+    def __init__(self, data):
+        self._data = data
+        self._pos = 0
+
+    def read_varint(self):
+        """Reads non-negative integer."""
+        result, shift = 0, 0
+        while True:
+            byte = self._data[self._pos]
+            self._pos += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def read_int(self):
+        """Reads integer in zigzag encoding."""
+        value = self.read_varint()
+        return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+    def read_text(self):
+        """Reads length-prefixed string."""
+        length = self.read_varint()
+        if self._pos + length > len(self._data):
+            raise IndexError('string is out of range')
+        value = bytes(self._data[self._pos:self._pos + length])
+        self._pos += length
+        return value.decode('utf-8', 'surrogatepass')
+
+
+class _Encoder(_ByteWriter):
+    """Encodes stats into section payload."""
+
+    def __init__(self):
+        super().__init__()
+        self._strings = OrderedDict()
+
+    def _get_string_index(self, value):
+        """Returns index of the string in string table."""
+        return self._strings.setdefault(value, len(self._strings))
+
+    def _write_string(self, value):
+        """Writes index of the string in string table."""
+        self.write_varint(self._get_string_index(value))
+
+    def _write_value(self, value):
+        """Writes tagged value.
+
+        Writer is looked up by value type and then by its base classes, so
+        subclasses of supported types are encoded as their bases.
+        """
+        writer = self._VALUE_WRITERS.get(type(value))
+        if writer is None:
+            writers = map(self._VALUE_WRITERS.get, type(value).__mro__)
+            writer = next(filter(None, writers), None)
+        if writer is None:
+            raise TypeError('Unable to encode %s' % type(value).__name__)
+        writer(self, value)
+
+    def _write_none(self, _):
+        """Writes None."""
+        self._buffer.append(_NONE_TAG)
+
+    def _write_bool(self, value):
+        """Writes bool."""
+        self._buffer.append(_TRUE_TAG if value else _FALSE_TAG)
+
+    def _write_int_value(self, value):
+        """Writes tagged integer."""
+        self._buffer.append(_INT_TAG)
+        self.write_int(value)
+
+    def _write_float(self, value):
+        """Writes float."""
+        self._buffer.append(_FLOAT_TAG)
+        self._buffer += _FLOAT.pack(value)
+
+    def _write_str(self, value):
+        """Writes tagged string."""
+        self._buffer.append(_STR_TAG)
+        self._write_string(value)
+
+    def _write_mapping(self, value):
+        """Writes dict as call tree if possible."""
+        if not (value.keys() == _TREE_KEYS and self._write_tree(value)):
+            self._write_dict(value)
+
+    def _write_sequence(self, value):
+        """Writes list or tuple as table if possible."""
+        if self._is_table(value):
+            self._write_table(value)
+            return
+        self._buffer.append(_LIST_TAG)
+        self.write_varint(len(value))
+        for item in value:
+            self._write_value(item)
+
+    def _write_dict(self, value):
+        """Writes dict. Keys are converted to strings like in JSON."""
+        self._buffer.append(_DICT_TAG)
+        self.write_varint(len(value))
+        for key, item in value.items():
+            self._write_string(_get_json_key(key))
+            self._write_value(item)
+
+    @staticmethod
+    def _is_table(value):
+        """Checks whether value is a list of equally sized rows."""
+        if len(value) < 2 or not isinstance(value[0], (list, tuple)):
+            return False
+        return (set(map(type, value)) <= {list, tuple} and
+                len(value[0]) > 0 and len(set(map(len, value))) == 1)
+
+    def _write_array(self, column_tag, typecode, values):
+        """Writes column of values as little-endian array of fixed size
+        items.
+        """
+        column = array.array(typecode, values)
+        if sys.byteorder == 'big':
+            column.byteswap()
+        self._buffer.append(column_tag)
+        self._buffer += column.tobytes()
+
+    def _write_table(self, rows):
+        """Writes rows column by column.
+
+        Columns of integers, floats and strings are written as arrays of
+        fixed size items, which are compressed well and decoded fast.
+        Integer columns are delta encoded, since they usually contain
+        sorted or close values (event numbers, line numbers, counts).
+        """
+        self._buffer.append(_TABLE_TAG)
+        self.write_varint(len(rows))
+        self.write_varint(len(rows[0]))
+        for column in zip(*rows):
+            column_types = set(map(type, column))
+            if column_types == {int}:
+                deltas = [column[0]]
+                deltas.extend(map(operator.sub, column[1:], column[:-1]))
+                try:
+                    self._write_array(_INTS_COLUMN, 'q', deltas)
+                    continue
+                except OverflowError:
+                    pass
+            elif column_types == {float}:
+                self._write_array(_FLOATS_COLUMN, 'd', column)
+                continue
+            elif column_types == {str}:
+                self._write_array(
+                    _STRINGS_COLUMN, 'q', map(self._get_string_index, column))
+                continue
+            self._buffer.append(_VALUES_COLUMN)
+            for item in column:
+                self._write_value(item)
+
+    def _collect_frames(self, node, total_samples, frames):
+        """Collects frames of the call tree into frames.
+
+        Returns False if the tree can't be restored from frames and sample
+        counts.
+        """
+        if node.keys() != _TREE_KEYS or not _is_int(node['sampleCount']):
+            return False
+        frame = node['stack']
+        if (not isinstance(frame, (list, tuple)) or len(frame) != 3 or
+                not isinstance(frame[0], str) or
+                not isinstance(frame[1], str) or not _is_int(frame[2])):
+            return False
+        node_params = _get_node_params(
+            frame, node['sampleCount'], total_samples)
+        if node_params != (node['samplePercentage'], node['colorHash']):
+            return False
+        frames.setdefault(tuple(frame), len(frames))
+        return all(self._collect_frames(child, total_samples, frames)
+                   for child in node['children'])
+
+    def _write_node(self, node, frames):
+        """Writes frame index, sample count and children of the node."""
+        self.write_varint(frames[tuple(node['stack'])])
+        self.write_varint(node['sampleCount'])
+        self.write_varint(len(node['children']))
+        for child in node['children']:
+            self._write_node(child, frames)
+
+    def _write_tree(self, root):
+        """Writes flame graph call tree.
+
+        Sample percentages and color hashes are computed from frames and
+        sample counts when the tree is read, so the tree is written only if
+        they can be restored exactly. Returns True if the tree is written.
+        """
+        frames = OrderedDict()
+        if (not _is_int(root['sampleCount']) or
+                not self._collect_frames(root, root['sampleCount'], frames)):
+            return False
+        self._buffer.append(_TREE_TAG)
+        self.write_varint(len(frames))
+        for funcname, filename, lineno in frames:
+            self._write_string(funcname)
+            self._write_string(filename)
+            self.write_int(lineno)
+        self._write_node(root, frames)
+        return True
+
+    def encode(self, value):
+        """Returns string table followed by encoded value."""
+        self._write_value(value)
+        string_table = _ByteWriter()
+        string_table.write_varint(len(self._strings))
+        for string in self._strings:
+            string_table.write_text(string)
+        return string_table.getvalue() + self.getvalue()
+
+    _VALUE_WRITERS = {
+        type(None): _write_none,
+        bool: _write_bool,
+        int: _write_int_value,
+        float: _write_float,
+        str: _write_str,
+        dict: _write_mapping,
+        list: _write_sequence,
+        tuple: _write_sequence,
+    }
+
+
+class _Decoder(_ByteReader):
+    """Decodes stats from section payload."""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self._strings = [self.read_text()
+                         for _ in range(self.read_varint())]
+
+    def _read_string(self):
+        """Reads string by its index in string table."""
+        return self._strings[self.read_varint()]
+
+    def _read_value(self):
+        """Reads tagged value."""
+        tag = self._data[self._pos]
+        self._pos += 1
+        reader = self._VALUE_READERS.get(tag)
+        if reader is None:
+            raise FormatError('Unknown value tag %s' % tag)
+        return reader(self)
+
+    def _read_float(self):
+        """Reads float."""
+        value, = _FLOAT.unpack_from(self._data, self._pos)
+        self._pos += _FLOAT.size
+        return value
+
+    def _read_list(self):
+        """Reads list of tagged values."""
+        return [self._read_value() for _ in range(self.read_varint())]
+
+    def _read_dict(self):
+        """Reads dict with string keys."""
+        value = OrderedDict()
+        for _ in range(self.read_varint()):
+            key = self._read_string()
+            value[key] = self._read_value()
+        return value
+
+    def _read_array(self, typecode, length):
+        """Reads little-endian array of fixed size items."""
+        column = array.array(typecode)
+        end_pos = self._pos + length * column.itemsize
+        if end_pos > len(self._data):
+            raise IndexError('array is out of range')
+        column.frombytes(self._data[self._pos:end_pos])
+        if sys.byteorder == 'big':
+            column.byteswap()
+        self._pos = end_pos
+        return column
+
+    def _read_table(self):
+        """Reads rows stored column by column."""
+        num_rows, num_columns = self.read_varint(), self.read_varint()
+        columns = []
+        for _ in range(num_columns):
+            column_tag = self._data[self._pos]
+            self._pos += 1
+            if column_tag == _INTS_COLUMN:
+                column = itertools.accumulate(
+                    self._read_array('q', num_rows))
+            elif column_tag == _FLOATS_COLUMN:
+                column = self._read_array('d', num_rows)
+            elif column_tag == _STRINGS_COLUMN:
+                strings = self._strings
+                column = [strings[index]
+                          for index in self._read_array('q', num_rows)]
+            elif column_tag == _VALUES_COLUMN:
+                column = [self._read_value() for _ in range(num_rows)]
+            else:
+                raise FormatError('Unknown column tag %s' % column_tag)
+            columns.append(column)
+        return list(map(list, zip(*columns)))
+
+    def _read_node(self, frames, total_samples):
+        """Reads call tree node and its children."""
+        frame = frames[self.read_varint()]
+        sample_count = self.read_varint()
+        children = [self._read_node(frames, total_samples)
+                    for _ in range(self.read_varint())]
+        sample_percentage, color_hash = _get_node_params(
+            frame, sample_count, total_samples)
+        return OrderedDict((
+            ('stack', list(frame)),
+            ('children', children),
+            ('sampleCount', sample_count),
+            ('samplePercentage', sample_percentage),
+            ('colorHash', color_hash)))
+
+    def _read_tree(self):
+        """Reads flame graph call tree."""
+        frames = [
+            (self._read_string(), self._read_string(), self.read_int())
+            for _ in range(self.read_varint())]
+        # Total sample count is the sample count of the root node.
+        root_pos = self._pos
+        self.read_varint()
+        total_samples = self.read_varint()
+        self._pos = root_pos
+        return self._read_node(frames, total_samples)
+
+    def decode(self):
+        """Decodes value that follows string table."""
+        value = self._read_value()
+        if self._pos != len(self._data):
+            raise FormatError('Unexpected data after section end')
+        return value
+
+    _VALUE_READERS = {
+        _NONE_TAG: lambda _: None,
+        _FALSE_TAG: lambda _: False,
+        _TRUE_TAG: lambda _: True,
+        _INT_TAG: _ByteReader.read_int,
+        _FLOAT_TAG: _read_float,
+        _STR_TAG: _read_string,
+        _LIST_TAG: _read_list,
+        _DICT_TAG: _read_dict,
+        _TABLE_TAG: _read_table,
+        _TREE_TAG: _read_tree,
+    }
+
+
+def encode_section(stats):
+    """Returns compressed section payload with stats."""
+    return zlib.compress(_Encoder().encode(stats), _COMPRESSION_LEVEL)
+
+
+def decode_section(payload):
+    """Decodes stats from compressed section payload.
+
+    Raises:
+        FormatError: when payload is corrupted.
+    """
+    try:
+        return _Decoder(zlib.decompress(payload)).decode()
+    except (zlib.error, IndexError, UnicodeDecodeError, struct.error) as exc:
+        raise FormatError('Corrupted section: %s' % exc) from exc
+
+
+class ProfileWriter:
+    """Writes profile file section by section."""
+
+    def __init__(self, filename, version):
+        """Creates profile file.
+
+        Args:
+            filename: Name of the file.
+            version: vprof version that produced stats.
+        """
+        self._file = open(filename, 'wb')
+        self._version = version
+        self._index = []
+        self._file.write(_MAGIC + bytes((FORMAT_VERSION,)))
+
+    def write_section(self, name, stats):
+        """Compresses and writes section with stats."""
+        payload = encode_section(stats)
+        self._index.append((name, self._file.tell(), len(payload)))
+        self._file.write(payload)
+        self._file.flush()
+
+    def close(self):
+        """Writes section index and closes file."""
+        if self._file.closed:
+            return
+        index = _ByteWriter()
+        index.write_text(self._version)
+        index.write_varint(len(self._index))
+        for name, offset, size in self._index:
+            index.write_text(name)
+            index.write_varint(offset)
+            index.write_varint(size)
+        index_offset = self._file.tell()
+        self._file.write(index.getvalue())
+        self._file.write(_FOOTER.pack(index_offset) + _MAGIC)
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tbf):
+        self.close()
+
+
+class ProfileReader:
+    """Reads sections of profile file on demand.
+
+    File is memory-mapped, so only pages of requested sections are read
+    from disk.
+    """
+
+    def __init__(self, filename):
+        """Opens profile file and reads section index.
+
+        Raises:
+            FormatError: when file is not a valid profile file.
+        """
+        with open(filename, 'rb') as infile:
+            try:
+                self._data = mmap.mmap(
+                    infile.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as exc:  # Empty file can't be mapped.
+                raise FormatError('%s is empty' % filename) from exc
+        try:
+            self.version, self._index = self._read_header()
+        except (FormatError, IndexError, UnicodeDecodeError,
+                struct.error) as exc:
+            self._data.close()
+            raise FormatError('%s is not a valid profile file: %s' % (
+                filename, exc)) from exc
+
+    def _read_header(self):
+        """Returns vprof version and section index."""
+        if self._data[:len(_MAGIC)] != _MAGIC:
+            raise FormatError('bad magic')
+        format_version = self._data[len(_MAGIC)]
+        if format_version != FORMAT_VERSION:
+            raise FormatError(
+                'unsupported format version %s' % format_version)
+        footer_pos = len(self._data) - _FOOTER.size - len(_MAGIC)
+        if (footer_pos < len(_MAGIC) + 1 or
+                self._data[footer_pos + _FOOTER.size:] != _MAGIC):
+            raise FormatError('index is missing')
+        index_offset, = _FOOTER.unpack_from(self._data, footer_pos)
+        reader = _ByteReader(self._data[index_offset:footer_pos])
+        version = reader.read_text()
+        index = OrderedDict()
+        for _ in range(reader.read_varint()):
+            name = reader.read_text()
+            index[name] = (reader.read_varint(), reader.read_varint())
+        return version, index
+
+    @property
+    def sections(self):
+        """Names of sections in the file."""
+        return list(self._index)
+
+    def read_section(self, name):
+        """Reads and decodes stats of section name."""
+        offset, size = self._index[name]
+        return decode_section(self._data[offset:offset + size])
+
+    def read_all(self):
+        """Reads stats of all sections."""
+        return OrderedDict(
+            (name, self.read_section(name)) for name in self._index)
+
+    def close(self):
+        """Unmaps file."""
+        self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tbf):
+        self.close()
+
+
+class LazyStats(abc.MutableMapping):
+    """Dict of stats that decodes sections of profile file on access.
+
+    Decoded section is shared while it's referenced elsewhere and released
+    afterwards, so only sections in use are kept in memory. Assigned stats
+    are kept in memory and replace sections of the file.
+    """
+
+    def __init__(self, reader):
+        self._reader = reader
+        self._sections = OrderedDict.fromkeys(reader.sections)
+        self._assigned = OrderedDict()
+        self._decoded = weakref.WeakValueDictionary()
+
+    def __getitem__(self, name):
+        if name in self._assigned:
+            return self._assigned[name]
+        if name not in self._sections:
+            raise KeyError(name)
+        stats = self._decoded.get(name)
+        if stats is None:
+            stats = self._reader.read_section(name)
+            try:
+                self._decoded[name] = stats
+            except TypeError:  # Only dicts can be shared.
+                pass
+        return stats
+
+    def __setitem__(self, name, stats):
+        self._sections.pop(name, None)
+        self._assigned[name] = stats
+
+    def __delitem__(self, name):
+        if name in self._assigned:
+            del self._assigned[name]
+        else:
+            del self._sections[name]
+
+    def __iter__(self):
+        yield from self._sections
+        yield from self._assigned
+
+    def __len__(self):
+        return len(self._sections) + len(self._assigned)
+
+
+def is_profile_file(filename):
+    """Checks whether file is in profile file format."""
+    with open(filename, 'rb') as infile:
+        return infile.read(len(_MAGIC)) == _MAGIC
@@ -1,12 +1,26 @@
 """Profiler wrapper module."""
 import cProfile
+import marshal
 import operator
+import os
 import pstats
 import runpy
+import statistics
 import time
 
 from vprof import base_profiler
 
+_NS_TIMER_UNIT = 1e-9
+_NS_TIMERS = ('perf_counter_ns', 'process_time_ns', 'thread_time_ns')
+# Timers supported by profiler. Each timer is described by timer function,
+# duration of timer unit in seconds and number of decimal places to keep in
+# stats. Default timer is the built-in timer of cProfile.
+# Nanosecond timers are not available on all Python versions and platforms.
+TIMERS = {'default': (None, None, 4)}
+TIMERS.update(
+    (name, (getattr(time, name), _NS_TIMER_UNIT, 9))
+    for name in _NS_TIMERS if hasattr(time, name))
+
 
 class Profiler(base_profiler.BaseProfiler):
     """Python profiler wrapper.
@@ -14,9 +28,26 @@ class Profiler(base_profiler.BaseProfiler):
     Runs cProfile on specified program and returns collected stats.
     """
 
+    def __init__(self, run_object, timer='default', **kwargs):
+        """Initializes profiler.
+
+        Args:
+            run_object: object to be profiled.
+            timer: name of the timer from TIMERS.
+            kwargs: arguments of BaseProfiler.
+        """
+        if timer not in TIMERS:
+            raise ValueError('Unknown timer: %s' % timer)
+        super().__init__(run_object, **kwargs)
+        self._timer = timer
+        self._precision = TIMERS[timer][2]
+
     @staticmethod
-    def _transform_stats(prof):
-        """Processes collected stats for UI."""
+    def _transform_stats(prof, precision=4):
+        """Processes collected stats for UI.
+
+        Times are rounded to specified number of decimal places.
+        """
         records = []
         for info, params in prof.stats.items():
             filename, lineno, funcname = info
@@ -25,7 +56,7 @@ class Profiler(base_profiler.BaseProfiler):
                 percentage = 0
             else:
                 percentage = round(100 * (cum_time / prof.total_tt), 4)
-            cum_time = round(cum_time, 4)
+            cum_time = round(cum_time, precision)
             func_name = '%s @ %s' % (funcname, filename)
             color_hash = base_profiler.hash_name(func_name)
             records.append(
@@ -33,68 +64,149 @@ class Profiler(base_profiler.BaseProfiler):
                  cum_calls, time_per_call, filename, color_hash))
         return sorted(records, key=operator.itemgetter(4), reverse=True)
 
-    def _profile_package(self):
-        """Runs cProfile on a package."""
-        prof = cProfile.Profile()
-        prof.enable()
-        try:
-            runpy.run_path(self._run_object, run_name='__main__')
-        except SystemExit:
-            pass
-        prof.disable()
-        prof_stats = pstats.Stats(prof)
+    @staticmethod
+    def _transform_call_graph(prof, call_stats, precision=4):
+        """Processes caller/callee edges for UI.
+
+        Functions are referenced by their index in call_stats. Each edge
+        is a list of caller index, callee index, primitive calls,
+        number of calls, total time and cumulative time. Note that pstats
+        stores number of calls before primitive calls in caller stats.
+        """
+        func_ids = {
+            (record[0], record[1], record[2]): i
+            for i, record in enumerate(call_stats)}
+        edges = []
+        for callee, params in prof.stats.items():
+            callers = params[4]
+            for caller, (num_calls, prim_calls, tot_time, cum_time) in (
+                    callers.items()):
+                if caller not in func_ids or callee not in func_ids:
+                    continue
+                edges.append(
+                    (func_ids[caller], func_ids[callee], prim_calls,
+                     num_calls, round(tot_time, precision),
+                     round(cum_time, precision)))
+        return sorted(edges)
+
+    @classmethod
+    def load_pstats(cls, filename):
+        """Loads stats saved by cProfile or pstats and formats them for UI."""
+        prof_stats = pstats.Stats(filename)
         prof_stats.calc_callees()
+        call_stats = cls._transform_stats(prof_stats)
         return {
-            'objectName': self._object_name,
-            'callStats': self._transform_stats(prof_stats),
+            'objectName': '%s (pstats)' % filename,
+            'callStats': call_stats,
+            'callGraph': cls._transform_call_graph(prof_stats, call_stats),
             'totalTime': prof_stats.total_tt,
             'primitiveCalls': prof_stats.prim_calls,
             'totalCalls': prof_stats.total_calls,
-            'timestamp': int(time.time())
+            'timestamp': int(os.path.getmtime(filename))
         }
 
-    def profile_package(self):
-        """Runs package profiler in a separate process."""
-        return base_profiler.run_in_separate_process(self._profile_package)
+    @staticmethod
+    def _transform_run_stats(run_times, call_stats, precision=4):
+        """Computes per run cumulative time stats for each call_stats record.
 
-    def _profile_module(self):
-        """Runs cProfile on a module."""
-        prof = cProfile.Profile()
-        try:
-            with open(self._run_object, 'rb') as srcfile:
-                code = compile(srcfile.read(), self._run_object, 'exec')
-            prof.runctx(code, self._globs, None)
-        except SystemExit:
-            pass
-        prof_stats = pstats.Stats(prof)
+        Returns a list of (mean, min, standard deviation) tuples in the same
+        order as call_stats.
+        """
+        run_stats = []
+        for record in call_stats:
+            func = (record[0], record[1], record[2])
+            times = [curr_run.get(func, 0) for curr_run in run_times]
+            run_stats.append(
+                (round(statistics.mean(times), precision),
+                 round(min(times), precision),
+                 round(statistics.pstdev(times), precision)))
+        return run_stats
+
+    def _profile_runs(self, run_func, *args, **kwargs):
+        """Runs cProfile on run_func repeatedly and aggregates stats.
+
+        Unprofiled warmup runs are done before profiled ones.
+        Returns:
+            A tuple of aggregated pstats.Stats, a list with cumulative time
+            of each function per run and the result of the last run.
+        """
+        for _ in range(self._warmup):
+            try:
+                run_func(*args, **kwargs)
+            except SystemExit:
+                pass
+        prof_stats, run_times, result = None, [], None
+        for _ in range(self._repeat):
+            prof = self._create_profile()
+            prof.enable()
+            try:
+                result = run_func(*args, **kwargs)
+            except SystemExit:
+                pass
+            prof.disable()
+            curr_stats = pstats.Stats(prof)
+            run_times.append({
+                func: params[3] for func, params in curr_stats.stats.items()})
+            if prof_stats is None:
+                prof_stats = curr_stats
+            else:
+                prof_stats.add(curr_stats)
         prof_stats.calc_callees()
+        return prof_stats, run_times, result
+
+    def _create_profile(self):
+        """Creates cProfile profile with selected timer."""
+        timer, time_unit, _ = TIMERS[self._timer]
+        if timer is None:
+            return cProfile.Profile()
+        return cProfile.Profile(timer, time_unit)
+
+    def _format_stats(self, prof_stats, run_times):
+        """Formats aggregated profiler stats for UI."""
+        call_stats = self._transform_stats(prof_stats, self._precision)
         return {
             'objectName': self._object_name,
-            'callStats': self._transform_stats(prof_stats),
+            'callStats': call_stats,
+            'callGraph': self._transform_call_graph(
+                prof_stats, call_stats, self._precision),
+            'runStats': self._transform_run_stats(
+                run_times, call_stats, self._precision),
+            'timer': self._timer,
+            'repeat': self._repeat,
+            'warmup': self._warmup,
             'totalTime': prof_stats.total_tt,
             'primitiveCalls': prof_stats.prim_calls,
             'totalCalls': prof_stats.total_calls,
             'timestamp': int(time.time())
         }
 
+    def _profile_package(self):
+        """Runs cProfile on a package."""
+        prof_stats, run_times, _ = self._profile_runs(
+            runpy.run_path, self._run_object, run_name='__main__')
+        return self._format_stats(prof_stats, run_times)
+
+    def profile_package(self):
+        """Runs package profiler in a separate process."""
+        return base_profiler.run_in_separate_process(self._profile_package)
+
+    def _profile_module(self, module_code):
+        """Runs cProfile on a module."""
+        code = marshal.loads(module_code)
+        prof_stats, run_times, _ = self._profile_runs(
+            exec, code, self._globs, None)
+        return self._format_stats(prof_stats, run_times)
+
     def profile_module(self):
         """Runs module profiler in a separate process."""
-        return base_profiler.run_in_separate_process(self._profile_module)
+        return base_profiler.run_in_separate_process(
+            self._profile_module,
+            base_profiler.get_module_code(self._run_object))
 
     def profile_function(self):
         """Runs cProfile on a function."""
-        prof = cProfile.Profile()
-        prof.enable()
-        result = self._run_object(*self._run_args, **self._run_kwargs)
-        prof.disable()
-        prof_stats = pstats.Stats(prof)
-        prof_stats.calc_callees()
-        return {
-            'objectName': self._object_name,
-            'callStats': self._transform_stats(prof_stats),
-            'totalTime': prof_stats.total_tt,
-            'primitiveCalls': prof_stats.prim_calls,
-            'totalCalls': prof_stats.total_calls,
-            'result': result,
-            'timestamp': int(time.time())
-        }
+        prof_stats, run_times, result = self._profile_runs(
+            self._run_object, *self._run_args, **self._run_kwargs)
+        run_stats = self._format_stats(prof_stats, run_times)
+        run_stats['result'] = result
+        return run_stats
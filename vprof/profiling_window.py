@@ -0,0 +1,173 @@
+"""Profiling windows of long-running processes.
+
+Window samples stacks of all threads of the current process during a
+period of time. Windows can be started and stopped after a delay or duration
+or with signals sent to the process, so a misbehaving service can be
+profiled without restarting it.
+"""
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+from vprof import flame_graph
+from vprof import runner
+from vprof.version import __version__
+
+_SAMPLE_INTERVAL = 0.005
+_ROOT_FRAME = ('all threads', '', 0)
+
+
+class ProfilingWindow:
+    """Samples stacks of all threads of the current process.
+
+    Stacks are sampled from a background thread, so windows can be started
+    from any thread, including signal handlers and timers. When a window
+    ends, collected flame graph is written to file or sent to vprof server.
+    """
+
+    def __init__(self, output_file=None, host='localhost', port=8000,
+                 sample_interval=_SAMPLE_INTERVAL, uploader=None):
+        """Initializes profiling window.
+
+        Args:
+            output_file: Name of the file to save stats of each window.
+                {pid} and {timestamp} are replaced with process ID and window
+                start time. Stats are sent to vprof server if it's not
+                specified.
+            host: Host name to send collected data.
+            port: Port number to send collected data.
+            sample_interval: Interval between stack samples in seconds.
+            uploader: runner.AsyncUploader to send collected data with.
+        """
+        self._output_file = output_file
+        self._address = (host, port)
+        self._sample_interval = sample_interval
+        self._uploader = uploader
+        self._lock = threading.RLock()  # Signal handlers run in main thread.
+        self._stopped = None
+        self._thread = None
+
+    @property
+    def active(self):
+        """True if window is scheduled or running."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, delay=0, duration=None):
+        """Starts profiling window.
+
+        Args:
+            delay: Number of seconds to wait before sampling.
+            duration: Window length in seconds. Window lasts until stop()
+                is called if it's not specified.
+        Returns:
+            False if window is already running, True otherwise.
+        """
+        with self._lock:
+            if self.active:
+                return False
+            self._stopped = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run, args=(self._stopped, delay, duration),
+                daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """Stops profiling window without waiting for stats to be saved."""
+        with self._lock:
+            if self._stopped is not None:
+                self._stopped.set()
+
+    def toggle(self, duration=None):
+        """Stops running window or starts a new one."""
+        if self.active:
+            self.stop()
+        else:
+            self.start(duration=duration)
+
+    def join(self, timeout=None):
+        """Waits until current window ends and its stats are saved."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self, stopped, delay, duration):
+        """Samples stacks until window ends and saves collected stats."""
+        if stopped.wait(delay):
+            return
+        prof = flame_graph._StatProfiler()  # pylint: disable=protected-access
+        start_time = time.time()
+        while not stopped.wait(self._sample_interval):
+            self._sample(prof)
+            if duration is not None and time.time() - start_time >= duration:
+                break
+        self._save(prof, start_time, time.time() - start_time)
+
+    @staticmethod
+    def _sample(prof):
+        """Adds current stacks of all threads except sampler to prof."""
+        sampler_id = threading.get_ident()
+        frames = sys._current_frames()  # pylint: disable=protected-access
+        for thread_id, frame in frames.items():
+            if thread_id == sampler_id:
+                continue
+            stack = []
+            while frame:
+                stack.append((
+                    frame.f_code.co_name,
+                    frame.f_code.co_filename,
+                    frame.f_code.co_firstlineno))
+                frame = frame.f_back
+            stack.append(_ROOT_FRAME)
+            prof.add_stack(stack, 1)
+
+    def _format_stats(self, prof, start_time, run_time):
+        """Formats window stats for UI."""
+        call_tree = prof.call_tree
+        return {'c': {
+            'objectName': 'Profiling window (pid %s)' % os.getpid(),
+            'sampleInterval': self._sample_interval,
+            'runTime': run_time,
+            'callStats': call_tree,
+            'totalSamples': call_tree.get('sampleCount', 0),
+            'timestamp': int(start_time)
+        }}
+
+    def _save(self, prof, start_time, run_time):
+        """Writes window stats to file or sends them to vprof server."""
+        run_stats = self._format_stats(prof, start_time, run_time)
+        if self._output_file:
+            run_stats['version'] = __version__
+            filename = self._output_file.format(
+                pid=os.getpid(), timestamp=int(start_time))
+            with open(filename, 'w') as outfile:
+                outfile.write(json.dumps(run_stats))
+        else:
+            if self._uploader is None:
+                self._uploader = runner.AsyncUploader(*self._address)
+            self._uploader.submit(run_stats)
+
+
+def install_signal_handlers(window, start_signal=None, stop_signal=None,
+                            duration=None):
+    """Controls profiling window with signals sent to the process.
+
+    start_signal starts a window and stop_signal ends it. If both signals
+    are the same, the signal toggles the window.
+    Must be called from the main thread.
+    Args:
+        window: ProfilingWindow to control.
+        start_signal: Signal that starts window, SIGUSR1 by default.
+        stop_signal: Signal that stops window, SIGUSR2 by default.
+        duration: Max window length in seconds.
+    """
+    start_signal = start_signal or signal.SIGUSR1
+    stop_signal = stop_signal or signal.SIGUSR2
+    if start_signal == stop_signal:
+        signal.signal(
+            start_signal, lambda *_: window.toggle(duration=duration))
+        return
+    signal.signal(start_signal, lambda *_: window.start(duration=duration))
+    signal.signal(stop_signal, lambda *_: window.stop())
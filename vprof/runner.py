@@ -2,8 +2,13 @@
 # pylint: disable=wrong-import-position
 import builtins
 import gzip
+import http.client
+import importlib
 import os
 import psutil
+import queue
+import threading
+import urllib.parse
 import urllib.request
 
 # Take initial RSS in order to compute profiler memory overhead
@@ -12,18 +17,18 @@ if not hasattr(builtins, 'initial_rss_size'):
     builtins.initial_rss_size = psutil.Process(os.getpid()).memory_info().rss
 
 import json
+import time
 
 from collections import OrderedDict
-from vprof import code_heatmap
-from vprof import flame_graph
-from vprof import memory_profiler
-from vprof import profiler
+from concurrent import futures
+from vprof import base_profiler
 
+# Profiler modules are imported only when corresponding option is selected.
 _PROFILERS = (
-    ('m', memory_profiler.MemoryProfiler),
-    ('c', flame_graph.FlameGraphProfiler),
-    ('h', code_heatmap.CodeHeatmapProfiler),
-    ('p', profiler.Profiler)
+    ('m', 'vprof.memory_profiler', 'MemoryProfiler'),
+    ('c', 'vprof.flame_graph', 'FlameGraphProfiler'),
+    ('h', 'vprof.code_heatmap', 'CodeHeatmapProfiler'),
+    ('p', 'vprof.profiler', 'Profiler')
 )
 
 
@@ -42,13 +47,82 @@ class BadOptionError(Error):
     pass  # pylint: disable=unnecessary-pass
 
 
-def run_profilers(run_object, prof_config, verbose=False):
+def load_profilers(prof_config=None):
+    """Imports profilers selected in prof_config.
+
+    Args:
+        prof_config: A string with profilers configuration. All profilers
+            are imported if it's not specified.
+    Returns:
+        A list of (option, profiler class) tuples.
+    """
+    return [
+        (option, getattr(importlib.import_module(module_name), class_name))
+        for option, module_name, class_name in _PROFILERS
+        if prof_config is None or option in prof_config]
+
+
+def _timed_run(curr_profiler):
+    """Runs profiler and returns collected stats and run time."""
+    start_time = time.time()
+    run_stats = curr_profiler.run()
+    return run_stats, time.time() - start_time
+
+
+def _run_profilers_in_parallel(profilers, verbose=False, stats_callback=None):
+    """Runs profilers concurrently.
+
+    Module and package profilers run the program in child processes, so
+    every profiler is started from its own thread and child processes
+    execute on separate cores.
+    Args:
+        profilers: A list of (option, profiler) tuples.
+        verbose: True if info about running profilers should be shown.
+        stats_callback: Function called with option and stats of each
+            profiler.
+    Returns:
+        An ordered dictionary with collected stats.
+    """
+    if verbose:
+        print('Running %s in parallel. Profilers compete for CPU, memory '
+              'and I/O, so collected stats might be distorted...' % ', '.join(
+                  curr_profiler.__class__.__name__
+                  for _, curr_profiler in profilers))
+    start_time = time.time()
+    with futures.ThreadPoolExecutor(max_workers=len(profilers)) as executor:
+        pending = [(option, executor.submit(_timed_run, curr_profiler))
+                   for option, curr_profiler in profilers]
+    run_stats, sequential_time = OrderedDict(), 0
+    for option, future in pending:
+        run_stats[option], run_time = future.result()
+        sequential_time += run_time
+        if stats_callback is not None:
+            stats_callback(option, run_stats[option])
+    if verbose:
+        run_time = time.time() - start_time
+        print('Profilers finished in %.2fs, sequential run would take about '
+              '%.2fs (%.2fs saved)' % (
+                  run_time, sequential_time, sequential_time - run_time))
+    return run_stats
+
+
+def run_profilers(run_object, prof_config, verbose=False, repeat=1, warmup=0,
+                  timer='default', parallel=False, stats_callback=None):
     """Runs profilers on run_object.
 
     Args:
         run_object: An object (string or tuple) for profiling.
         prof_config: A string with profilers configuration.
         verbose: True if info about running profilers should be shown.
+        repeat: Number of profiled runs to aggregate. Used by flame graph
+            and profiler.
+        warmup: Number of unprofiled runs before profiled ones. Used by
+            flame graph and profiler.
+        timer: Name of the timer used by profiler (see profiler.TIMERS).
+        parallel: True if profilers should run concurrently. Functions are
+            always profiled sequentially in the current process.
+        stats_callback: Function called with option and stats as soon as
+            each profiler finishes.
     Returns:
         An ordered dictionary with collected stats.
     Raises:
@@ -59,22 +133,175 @@ def run_profilers(run_object, prof_config, verbose=False):
         raise AmbiguousConfigurationError(
             'Profiler configuration %s is ambiguous' % prof_config)
 
-    available_profilers = {opt for opt, _ in _PROFILERS}
+    available_profilers = {opt for opt, _, _ in _PROFILERS}
     for option in prof_config:
         if option not in available_profilers:
             raise BadOptionError('Unknown option: %s' % option)
+    if repeat < 1:
+        raise BadOptionError('Repeat count must be positive: %s' % repeat)
+    if warmup < 0:
+        raise BadOptionError('Warmup count must not be negative: %s' % warmup)
+    if ('p' in prof_config and
+            timer not in importlib.import_module('vprof.profiler').TIMERS):
+        raise BadOptionError('Unknown timer: %s' % timer)
+
+    profilers = []
+    for option, prof in load_profilers(prof_config):
+        prof_kwargs = {'repeat': repeat, 'warmup': warmup}
+        if option == 'p':
+            prof_kwargs['timer'] = timer
+        profilers.append((option, prof(run_object, **prof_kwargs)))
+
+    run_obj_type = base_profiler.BaseProfiler.get_run_object_type(run_object)
+    if parallel and len(profilers) > 1 and run_obj_type != 'function':
+        return _run_profilers_in_parallel(
+            profilers, verbose=verbose, stats_callback=stats_callback)
 
     run_stats = OrderedDict()
-    present_profilers = ((o, p) for o, p in _PROFILERS if o in prof_config)
-    for option, prof in present_profilers:
-        curr_profiler = prof(run_object)
+    for option, curr_profiler in profilers:
         if verbose:
             print('Running %s...' % curr_profiler.__class__.__name__)
         run_stats[option] = curr_profiler.run()
+        if stats_callback is not None:
+            stats_callback(option, run_stats[option])
     return run_stats
 
 
-def run(func, options, args=(), kwargs={}, host='localhost', port=8000):  # pylint: disable=dangerous-default-value
+def _get_upload_uri(session=None):
+    """Returns URI to upload stats of the session to."""
+    if session is None:
+        return '/'
+    return '/?' + urllib.parse.urlencode({'session': session})
+
+
+class _UploadConnection:  # pylint: disable=too-few-public-methods
+    """Persistent HTTP connection that uploads stats to vprof server."""
+
+    def __init__(self, host, port, timeout, upload_uri):
+        self._host, self._port, self._timeout = host, port, timeout
+        self._upload_uri = upload_uri
+        self._conn = None
+
+    def post(self, post_data):
+        """Sends data, reconnecting once if connection was dropped.
+
+        Data is not resent after timeouts or error responses, since the
+        server may have already received it.
+
+        Raises:
+            OSError: If server is unavailable.
+            http.client.HTTPException: If upload fails.
+        """
+        for attempt in range(2):
+            if self._conn is None:
+                self._conn = http.client.HTTPConnection(
+                    self._host, self._port, timeout=self._timeout)
+            try:
+                self._conn.request('POST', self._upload_uri, post_data)
+                response = self._conn.getresponse()
+                response.read()
+            except ConnectionError:  # Includes RemoteDisconnected.
+                self._close()
+                if attempt:
+                    raise
+                continue
+            except (OSError, http.client.HTTPException):
+                self._close()
+                raise
+            if response.status != 200:
+                raise http.client.HTTPException(
+                    'Upload failed with status %s' % response.status)
+            return
+
+    def _close(self):
+        """Closes connection, so the next request reconnects."""
+        self._conn.close()
+        self._conn = None
+
+
+class AsyncUploader:
+    """Uploads collected stats to vprof server from a background thread.
+
+    Stats are put into a bounded queue and sent in batches over a persistent
+    HTTP connection, so profiled calls are never blocked by network.
+    Stats are dropped when the queue is full or the server is unavailable.
+    """
+
+    def __init__(self, host='localhost', port=8000, max_queue_size=100,
+                 max_batch_size=10, timeout=5, session=None):
+        """Initializes uploader and starts background thread.
+
+        Args:
+            host: Host name to send collected data.
+            port: Port number to send collected data.
+            max_queue_size: Max number of stats waiting for upload.
+            max_batch_size: Max number of stats sent in one request.
+            timeout: Timeout of network operations in seconds.
+            session: Session ID to store stats under on the server. Each
+                uploaded profile is stored separately if it's not specified.
+        """
+        self._connection = _UploadConnection(
+            host, port, timeout, _get_upload_uri(session))
+        self._max_batch_size = max_batch_size
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        # Stats are dropped by both submitting and uploading threads.
+        self._dropped_count = 0
+        self._dropped_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._process, daemon=True)
+        self._thread.start()
+
+    @property
+    def dropped_count(self):
+        """Returns number of stats dropped since start."""
+        with self._dropped_lock:
+            return self._dropped_count
+
+    def _drop(self, count):
+        """Counts dropped stats."""
+        with self._dropped_lock:
+            self._dropped_count += count
+
+    def submit(self, run_stats):
+        """Schedules run_stats for upload without blocking."""
+        try:
+            self._queue.put_nowait(run_stats)
+        except queue.Full:
+            self._drop(1)
+
+    def flush(self):
+        """Blocks until all submitted stats are uploaded or dropped."""
+        self._queue.join()
+
+    def _get_batch(self):
+        """Waits for stats and returns all available ones up to batch size."""
+        batch = [self._queue.get()]
+        while len(batch) < self._max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _process(self):
+        """Uploads stats from the queue."""
+        while True:
+            batch = self._get_batch()
+            try:
+                self._upload(batch)
+            except (OSError, http.client.HTTPException):
+                self._drop(len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _upload(self, batch):
+        """Sends batch of stats."""
+        self._connection.post(
+            gzip.compress(json.dumps(batch).encode('utf-8')))
+
+
+def run(func, options, args=(), kwargs={}, host='localhost', port=8000,  # pylint: disable=dangerous-default-value
+        uploader=None, session=None):
     """Runs profilers on a function.
 
     Args:
@@ -84,6 +311,11 @@ def run(func, options, args=(), kwargs={}, host='localhost', port=8000):  # pyli
         kwargs: func keyword arguments.
         host: Host name to send collected data.
         port: Port number to send collected data.
+        uploader: AsyncUploader that sends collected data in background.
+            If it's not specified, data is sent to host and port before
+            returning.
+        session: Session ID to store stats under on the server. Ignored if
+            uploader is specified.
 
     Returns:
         A result of func execution.
@@ -96,7 +328,11 @@ def run(func, options, args=(), kwargs={}, host='localhost', port=8000):  # pyli
             result = run_stats[prof]['result']
         del run_stats[prof]['result']  # Don't send result to remote host
 
+    if uploader is not None:
+        uploader.submit(run_stats)
+        return result
     post_data = gzip.compress(
         json.dumps(run_stats).encode('utf-8'))
-    urllib.request.urlopen('http://%s:%s' % (host, port), post_data)
+    urllib.request.urlopen(
+        'http://%s:%s%s' % (host, port, _get_upload_uri(session)), post_data)
     return result
@@ -0,0 +1,374 @@
+"""Bounded store of profiles uploaded to stats server.
+
+Every upload belongs to a session - a run ID chosen by uploader or assigned
+by server, so concurrent uploaders don't overwrite each other's stats.
+Recently used sessions are kept in memory. When total size of sessions in
+memory exceeds the limit, least recently used sessions are spilled to disk
+in binary profile format, and when spilled sessions exceed disk limit, the
+oldest of them are removed. Sessions are written to disk and read back
+outside of the store lock, so uploads and reads of other sessions aren't
+blocked by spills and loads.
+"""
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+from collections import namedtuple
+
+from vprof.version import __version__
+
+_MAX_MEMORY_SIZE = 256 * 1024 * 1024
+_MAX_DISK_SIZE = 1024 * 1024 * 1024
+_SESSION_ID_REGEX = re.compile(r'^[A-Za-z0-9_.-]{1,128}$')
+
+# Session being written to disk. Session stays in memory until file is
+# written, the spill is canceled if session is used meanwhile.
+_Spill = namedtuple('_Spill', 'session filename tmp_filename stats')
+
+
+class Error(Exception):
+    """Base exception for current module."""
+    pass  # pylint: disable=unnecessary-pass
+
+
+class BadSessionIdError(Error):
+    """Raised when session ID contains unsupported characters."""
+    pass  # pylint: disable=unnecessary-pass
+
+
+def is_valid_session_id(session_id):
+    """Checks whether session ID is 1-128 letters, digits, '_', '.' or '-'."""
+    return bool(_SESSION_ID_REGEX.match(session_id))
+
+
+class _Session:
+    """Stats of a session and their location."""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.stats = {}
+        # Approximate sizes of profiler stats in memory by profiler option.
+        self.sizes = {}
+        self.uploads = 0
+        self.updated = None
+        self.filename = None
+        self.disk_size = 0
+
+    @property
+    def size(self):
+        """Returns approximate size of session stats."""
+        return sum(self.sizes.values())
+
+    def get_info(self):
+        """Returns session description for listing."""
+        return {
+            'id': self.session_id,
+            'profilers': sorted(self.sizes),
+            'uploads': self.uploads,
+            'updated': self.updated,
+            'size': self.size,
+            'spilled': self.filename is not None,
+        }
+
+
+class _SpillDirectory:
+    """Directory with spilled sessions and their total size.
+
+    Temporary directory is created on first spill and removed on close if
+    directory is not specified.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self._is_temporary = path is None
+        self.max_size = max_size
+        self.size = 0
+
+    def get_filename(self, session_id):
+        """Returns name of file to spill session to."""
+        if self.path is None:
+            self.path = tempfile.mkdtemp(prefix='vprof-sessions-')
+        os.makedirs(self.path, exist_ok=True)
+        return os.path.join(
+            self.path,
+            '%s.vprof' % hashlib.sha1(session_id.encode()).hexdigest())
+
+    def remove_temporary(self):
+        """Removes temporary directory.
+
+        Returns:
+            Whether spilled sessions were removed.
+        """
+        if not self._is_temporary or self.path is None:
+            return False
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.path = None
+        return True
+
+
+def _remove_file(filename):
+    """Removes file if it exists."""
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+class SessionStore:
+    """Keeps stats uploaded in different sessions.
+
+    All methods are thread-safe.
+    """
+
+    def __init__(self, directory=None, max_memory_size=_MAX_MEMORY_SIZE,
+                 max_disk_size=_MAX_DISK_SIZE):
+        """Initializes store.
+
+        Args:
+            directory: Directory to spill sessions to. Temporary directory
+                is created on first spill and removed on close if it's not
+                specified.
+            max_memory_size: Max approximate size of sessions kept in memory
+                in bytes. The most recently used session is always kept in
+                memory.
+            max_disk_size: Max total size of spilled sessions in bytes.
+        """
+        self._spill_dir = _SpillDirectory(directory, max_disk_size)
+        self._max_memory_size = max_memory_size
+        # Sessions ordered from least to most recently used.
+        self._sessions = OrderedDict()
+        # Temporary filenames of sessions being spilled by session ID.
+        self._spilling = {}
+        # IDs of spilled sessions being read back to memory.
+        self._loading = set()
+        self._memory_size = 0
+        # Notified when a session is loaded.
+        self._lock = threading.Condition()
+
+    @staticmethod
+    def new_session_id():
+        """Returns unique ID for uploads that don't specify session."""
+        return uuid.uuid4().hex
+
+    def __contains__(self, session_id):
+        with self._lock:
+            return session_id in self._sessions
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def add(self, session_id, run_stats, size):
+        """Merges uploaded stats into session stats.
+
+        Stats of each profiler replace previous stats of the same profiler
+        in the session.
+
+        Args:
+            session_id: Session ID.
+            run_stats: A dict with stats by profiler option.
+            size: Approximate size of run_stats, e.g. size of uploaded JSON.
+        Raises:
+            BadSessionIdError: If session ID is invalid.
+        """
+        if not is_valid_session_id(session_id):
+            raise BadSessionIdError(
+                'Unsupported session ID %r' % session_id)
+        with self._lock:
+            session = self._use(session_id)
+            if session is None:
+                session = _Session(session_id)
+                self._sessions[session_id] = session
+            option_size = size // max(len(run_stats), 1)
+            for option in run_stats:
+                self._memory_size -= session.sizes.get(option, 0)
+                session.sizes[option] = option_size
+                self._memory_size += option_size
+            session.stats.update(run_stats)
+            session.uploads += 1
+            session.updated = time.time()
+            spills = self._start_spills()
+        self._write_spills(spills)
+
+    def get(self, session_id):
+        """Returns copy of the session stats or None if there is no session.
+
+        Stats of each profiler aren't copied, since they are replaced by
+        uploads, not modified.
+        """
+        with self._lock:
+            session = self._use(session_id)
+            if session is None:
+                return None
+            stats = dict(session.stats)
+            spills = self._start_spills()
+        self._write_spills(spills)
+        return stats
+
+    def list_sessions(self):
+        """Returns descriptions of sessions, most recently used first."""
+        with self._lock:
+            return [
+                session.get_info()
+                for session in reversed(self._sessions.values())]
+
+    def close(self):
+        """Removes temporary directory with spilled sessions."""
+        with self._lock:
+            if self._spill_dir.remove_temporary():
+                for session in list(self._sessions.values()):
+                    if session.filename is not None:
+                        self._forget(session)
+
+    def _use(self, session_id):
+        """Marks session as the most recently used and loads its stats.
+
+        Must be called with lock held. Lock is released while stats of
+        spilled session are read, and while waiting for another thread to
+        read them.
+
+        Returns:
+            The session or None if there is no session.
+        """
+        while True:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if session_id in self._loading:
+                self._lock.wait()
+            elif session.filename is not None:
+                self._load(session)
+            else:
+                break
+        self._cancel_spill(session)
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _load(self, session):
+        """Reads stats of spilled session back to memory.
+
+        Must be called with lock held. Lock is released while the file is
+        read. Session is removed if the file can't be read.
+        """
+        from vprof import profile_file  # pylint: disable=import-outside-toplevel
+        filename = session.filename
+        self._loading.add(session.session_id)
+        self._lock.release()
+        stats = None
+        try:
+            with profile_file.ProfileReader(filename) as reader:
+                stats = reader.read_all()
+        except (OSError, profile_file.Error):
+            pass
+        finally:
+            self._lock.acquire()
+            self._loading.discard(session.session_id)
+            self._lock.notify_all()
+        # Spilled session is removed only on close while it's loaded.
+        if self._sessions.get(session.session_id) is not session:
+            return
+        _remove_file(filename)
+        if stats is None:
+            self._forget(session)
+            return
+        session.stats = stats
+        session.filename = None
+        self._spill_dir.size -= session.disk_size
+        self._memory_size += session.size
+        session.disk_size = 0
+
+    def _start_spills(self):
+        """Selects least recently used sessions to spill while over limit.
+
+        Must be called with lock held. Selected sessions don't count
+        towards memory limit, so concurrent calls don't select extra
+        sessions.
+
+        Returns:
+            A list of spills to write with _write_spills.
+        """
+        spills = []
+        for session in list(self._sessions.values())[:-1]:
+            if self._memory_size <= self._max_memory_size:
+                break
+            if (session.filename is not None or
+                    session.session_id in self._spilling):
+                continue
+            filename = self._spill_dir.get_filename(session.session_id)
+            tmp_filename = '%s.%s.tmp' % (filename, uuid.uuid4().hex)
+            self._spilling[session.session_id] = tmp_filename
+            self._memory_size -= session.size
+            spills.append(_Spill(
+                session, filename, tmp_filename, dict(session.stats)))
+        return spills
+
+    def _write_spills(self, spills):
+        """Writes selected sessions to disk without holding lock."""
+        if not spills:
+            return
+        from vprof import profile_file  # pylint: disable=import-outside-toplevel
+        for spill in spills:
+            written = False
+            try:
+                with profile_file.ProfileWriter(
+                        spill.tmp_filename, __version__) as writer:
+                    for option, stats in spill.stats.items():
+                        writer.write_section(option, stats)
+                written = True
+            except OSError:  # Directory was removed on close.
+                pass
+            finally:
+                with self._lock:
+                    self._finish_spill(spill, written)
+
+    def _finish_spill(self, spill, written):
+        """Replaces stats of spilled session with written file.
+
+        Must be called with lock held. Written file is discarded if the
+        spill was canceled or the store was closed meanwhile.
+        """
+        session = spill.session
+        if self._spilling.get(session.session_id) != spill.tmp_filename:
+            _remove_file(spill.tmp_filename)
+            return
+        replaced = False
+        # Directory changes if it was removed on close.
+        if (written and
+                os.path.dirname(spill.filename) == self._spill_dir.path):
+            try:
+                os.replace(spill.tmp_filename, spill.filename)
+                replaced = True
+            except OSError:
+                pass
+        if not replaced:
+            _remove_file(spill.tmp_filename)
+            self._cancel_spill(session)
+            return
+        del self._spilling[session.session_id]
+        session.stats = None
+        session.filename = spill.filename
+        session.disk_size = os.path.getsize(spill.filename)
+        self._spill_dir.size += session.disk_size
+        for spilled in list(self._sessions.values()):
+            if self._spill_dir.size <= self._spill_dir.max_size:
+                break
+            if (spilled.filename is not None and
+                    spilled.session_id not in self._loading):
+                os.remove(spilled.filename)
+                self._forget(spilled)
+
+    def _cancel_spill(self, session):
+        """Keeps session that is being spilled in memory."""
+        if self._spilling.pop(session.session_id, None) is not None:
+            self._memory_size += session.size
+
+    def _forget(self, session):
+        """Removes spilled session from the store."""
+        del self._sessions[session.session_id]
+        self._spill_dir.size -= session.disk_size
@@ -1,79 +1,840 @@
 """Profiler server."""
+import email.utils
 import functools
 import gzip
+import hashlib
 import io
 import json
+import mimetypes
+import operator
 import os
+import re
 import socketserver
 import sys
+import threading
+import urllib.parse
 import webbrowser
 
+from collections import OrderedDict
+from collections import defaultdict
 from http import server
 
+from vprof import session_store
+
 _STATIC_DIR = 'ui'
-_PROFILE_HTML = '%s/profile.html' % _STATIC_DIR
+_PROFILE_HTML = '/profile.html'
+# UI sources and tests aren't served.
+_SKIPPED_STATIC_DIRS = ('__tests__', 'node_modules')
+# Assets referenced from HTML get fingerprint in query string, so responses
+# to fingerprinted URLs never change and can be cached for a year.
+_ASSET_REFERENCE_RE = re.compile(r'((?:src|href)=")([^"?#:]+)(")')
+_FINGERPRINT_PARAM = 'v'
+_IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+_EVENTS_URI = '/events'
+_PROFILE_URI = '/profile'
+_PROFILER_URI_PREFIX = '/profile/'
+_SESSIONS_URI = '/sessions'
+_SESSION_URI_PREFIX = '/sessions/'
+_AGGREGATES_URI = '/aggregates'
+_AGGREGATE_URI_PREFIX = '/aggregates/'
+# Max number of flame graph aggregates, least recently updated ones are
+# dropped.
+_MAX_AGGREGATES = 64
+# Keys of profile that don't hold profiler stats.
+_NON_PROFILER_KEYS = ('version',)
+# Comments are sent to idle event streams to detect disconnected clients
+# and keep proxies from closing the connection.
+_EVENTS_KEEPALIVE_INTERVAL = 15  # seconds
+_CALL_STATS_PAGE_SIZE = 100
+_MAX_CALL_STATS_PAGE_SIZE = 1000
+_MAX_CALLERS = 5
+_DEFAULT_SORT = '-percentage'
+# Max number of cached responses, pages of profiler records are cached
+# separately.
+_RESPONSE_CACHE_SIZE = 64
+# Max total size of cached response bodies. Sections of saved profiles are
+# loaded lazily, so cache must not keep all of them in memory.
+_RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# Sortable columns of profiler records and their positions in a record.
+_CALL_STATS_COLUMNS = {
+    'filename': 0,
+    'line': 1,
+    'function': 2,
+    'time': 3,
+    'percentage': 4,
+    'calls': 5,
+}
+
+
+class CallStatsIndex:  # pylint: disable=too-few-public-methods
+    """Provides paginated access to profiler records.
+
+    Records sorted by each column are computed on first request and
+    reused afterwards.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+        self._records = stats['callStats']
+        self._orders = {}
+        self._callers = None
+
+    def _get_order(self, column):
+        """Returns record indices sorted by column in ascending order."""
+        if column not in self._orders:
+            pos = _CALL_STATS_COLUMNS[column]
+            self._orders[column] = sorted(
+                range(len(self._records)),
+                key=lambda i: self._records[i][pos])
+        return self._orders[column]
+
+    def _get_callers(self, func_id):
+        """Returns top callers of the function ordered by cumulative time."""
+        if self._callers is None:
+            callers = defaultdict(list)
+            for edge in self.stats.get('callGraph', ()):
+                callers[edge[1]].append(edge)
+            self._callers = {
+                callee: sorted(edges, key=operator.itemgetter(5),
+                               reverse=True)[:_MAX_CALLERS]
+                for callee, edges in callers.items()}
+        return [
+            [self._records[caller][2], self._records[caller][1],
+             num_calls, cum_time]
+            for caller, _, _, num_calls, _, cum_time in self._callers.get(
+                func_id, ())]
+
+    def get_page(self, sort=_DEFAULT_SORT, offset=0,
+                 limit=_CALL_STATS_PAGE_SIZE, name_filter=''):
+        """Returns page of records sorted and filtered by specified params.
+
+        Args:
+            sort: Column name, prefixed with '-' for descending order.
+            offset: Number of records to skip.
+            limit: Max number of records in the page.
+            name_filter: Substring of function name or filename.
+        """
+        order = self._get_order(sort.lstrip('-'))
+        if sort.startswith('-'):
+            order = order[::-1]
+        if name_filter:
+            name_filter = name_filter.lower()
+            order = [
+                i for i in order
+                if name_filter in self._records[i][2].lower() or
+                name_filter in self._records[i][0].lower()]
+        func_ids = order[offset:offset + limit]
+        page = {
+            'callStats': [self._records[i] for i in func_ids],
+            'funcIds': func_ids,
+            'callers': [self._get_callers(i) for i in func_ids],
+            'offset': offset,
+            'totalRecords': len(order),
+        }
+        if 'runStats' in self.stats:
+            page['runStats'] = [self.stats['runStats'][i] for i in func_ids]
+        return page
+
+
+def _accepts_gzip(accept_encoding):
+    """Checks whether gzip is acceptable according to Accept-Encoding.
+
+    Any encoding is acceptable when the header is missing.
+    """
+    if accept_encoding is None:
+        return True
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() not in ('gzip', '*'):
+            continue
+        quality = params.strip().lower()
+        if quality.startswith('q='):
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+class _Response:
+    """Encoded response body, compressed on first request.
+
+    Args:
+        content: Response body.
+        content_type: MIME type of the body.
+        last_modified: Modification time of the body source, if known.
+        compressed_content: Gzipped body, if available beforehand.
+    """
+
+    def __init__(self, content, content_type, last_modified=None,
+                 compressed_content=None):
+        self.content = content
+        self.content_type = content_type
+        self.last_modified = last_modified
+        self.fingerprint = hashlib.sha1(content).hexdigest()
+        # Weak ETag, since compressed and uncompressed bodies are
+        # semantically equivalent.
+        self.etag = 'W/"%s"' % self.fingerprint
+        self._compressed_content = compressed_content
+
+    @property
+    def compressed_content(self):
+        """Returns gzipped body or None if gzip doesn't make it smaller."""
+        if self._compressed_content is None:
+            self._compressed_content = gzip.compress(self.content)
+        if len(self._compressed_content) >= len(self.content):
+            return None
+        return self._compressed_content
+
+    @property
+    def size(self):
+        """Returns size of body and gzipped body if it's compressed."""
+        return len(self.content) + len(self._compressed_content or b'')
+
+
+class _ResponseCache:
+    """LRU cache of responses limited by count and total size.
+
+    Responses bigger than the size limit aren't cached. Cache isn't
+    thread-safe, callers hold profile state lock.
+    """
+
+    def __init__(self, max_count=_RESPONSE_CACHE_SIZE,
+                 max_size=_RESPONSE_CACHE_MAX_BYTES):
+        self._max_count = max_count
+        self._max_size = max_size
+        self._responses = OrderedDict()
+        self.size = 0
+
+    def __len__(self):
+        return len(self._responses)
+
+    def get(self, key):
+        """Returns cached response or None and marks it recently used."""
+        response = self._responses.get(key)
+        if response is not None:
+            self._responses.move_to_end(key)
+        return response
+
+    def put(self, key, response):
+        """Caches response and evicts least recently used ones."""
+        if response.size > self._max_size:
+            return
+        old_response = self._responses.pop(key, None)
+        if old_response is not None:
+            self.size -= old_response.size
+        self._responses[key] = response
+        self.size += response.size
+        while (len(self._responses) > self._max_count or
+               self.size > self._max_size):
+            _, old_response = self._responses.popitem(last=False)
+            self.size -= old_response.size
+
+    def clear(self):
+        """Removes all responses."""
+        self._responses.clear()
+        self.size = 0
+
+
+def _get_mime_type(filename):
+    """Returns MIME type of static file."""
+    mime_type, _ = mimetypes.guess_type(filename)
+    return mime_type or 'application/octet-stream'
+
+
+def _fingerprint_references(html, static_files):
+    """Appends fingerprints to URLs of static files referenced by HTML."""
+    def _replace(match):
+        prefix, url, suffix = match.groups()
+        response = static_files.get('/' + url.lstrip('/'))
+        if response is None:
+            return match.group(0)
+        return '%s%s?%s=%s%s' % (
+            prefix, url, _FINGERPRINT_PARAM, response.fingerprint, suffix)
+    return _ASSET_REFERENCE_RE.sub(_replace, html.decode('utf-8')).encode()
+
+
+def load_static_files(static_dir):
+    """Loads and compresses UI files.
+
+    Sibling .gz files produced by build are used as compressed bodies
+    instead of compressing files again.
+
+    Args:
+        static_dir: Directory with UI files.
+    Returns:
+        A dict mapping URL paths to responses.
+    """
+    static_files, html_files = {}, []
+    for dirpath, dirnames, filenames in os.walk(static_dir):
+        dirnames[:] = [
+            dirname for dirname in dirnames
+            if dirname not in _SKIPPED_STATIC_DIRS]
+        for filename in filenames:
+            if (filename.endswith('.gz') and
+                    filename[:-len('.gz')] in filenames):
+                continue
+            path = os.path.join(dirpath, filename)
+            url = '/' + os.path.relpath(path, static_dir).replace(os.sep, '/')
+            with io.open(path, 'rb') as res_file:
+                content = res_file.read()
+            compressed_content = None
+            # Stale .gz is ignored if bundle was rebuilt after compression.
+            if (os.path.exists(path + '.gz') and
+                    os.path.getmtime(path + '.gz') >= os.path.getmtime(path)):
+                with io.open(path + '.gz', 'rb') as res_file:
+                    compressed_content = res_file.read()
+            mime_type = _get_mime_type(filename)
+            if mime_type == 'text/html':
+                html_files.append((url, content, os.path.getmtime(path)))
+                continue
+            response = _Response(
+                content, mime_type, last_modified=os.path.getmtime(path),
+                compressed_content=compressed_content)
+            # Compress once at start instead of on first request.
+            response.compressed_content  # pylint: disable=pointless-statement
+            static_files[url] = response
+    for url, content, last_modified in html_files:
+        response = _Response(
+            _fingerprint_references(content, static_files), 'text/html',
+            last_modified=last_modified)
+        response.compressed_content  # pylint: disable=pointless-statement
+        static_files[url] = response
+    return static_files
+
+
+def _create_default_aggregate():
+    """Returns aggregate of uploaded flame graphs without decay.
+
+    Aggregate module loads profiler modules, so it's imported on the first
+    upload instead of server start.
+    """
+    from vprof import call_tree_aggregate  # pylint: disable=import-outside-toplevel
+    return call_tree_aggregate.CallTreeAggregate()
+
+
+class _CallTreeAggregates:
+    """Aggregates of uploaded flame graphs keyed by object name.
+
+    Least recently updated aggregates are dropped when there are more than
+    max_count of them. Aggregates aren't thread-safe, callers hold profile
+    state lock.
+    """
+
+    def __init__(self, factory, max_count=_MAX_AGGREGATES):
+        self._factory = factory
+        self._max_count = max_count
+        # Aggregates ordered from least to most recently updated.
+        self._aggregates = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._aggregates
+
+    def get(self, key):
+        """Returns aggregate or None if there is no aggregate."""
+        return self._aggregates.get(key)
+
+    def add(self, key, stats):
+        """Merges flame graph stats into aggregate with the key.
+
+        Returns:
+            Updated aggregate.
+        Raises:
+            call_tree_aggregate.BadCallTreeError: If call tree is malformed.
+        """
+        aggregate = self._aggregates.get(key)
+        if aggregate is None:
+            aggregate = self._factory()
+        aggregate.add(stats)
+        self._aggregates[key] = aggregate
+        self._aggregates.move_to_end(key)
+        if len(self._aggregates) > self._max_count:
+            self._aggregates.popitem(last=False)
+        return aggregate
+
+    def list_aggregates(self):
+        """Returns names and upload counts, most recently updated first."""
+        return [
+            {'name': key, 'uploads': aggregate.uploads}
+            for key, aggregate in reversed(self._aggregates.items())]
+
+
+def get_profiler_options(profile_json):
+    """Returns sorted options of profilers with collected stats."""
+    return sorted(
+        option for option in profile_json
+        if option not in _NON_PROFILER_KEYS)
 
 
-class StatsServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+def get_manifest(profile_json, profile_version):
+    """Returns profile version and options of profilers with stats."""
+    return {
+        'version': profile_version,
+        'profilers': get_profiler_options(profile_json),
+    }
+
+
+def format_event(manifest):
+    """Returns server-sent event with profile manifest."""
+    return ('id: %d\nevent: profile\ndata: %s\n\n' % (
+        manifest['version'], json.dumps(manifest))).encode()
+
+
+def get_upload_session_id(path):
+    """Returns session ID from upload URI or None if it's not specified.
+
+    Raises:
+        session_store.BadSessionIdError: If session ID is invalid.
+    """
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(path).query)
+    session_id = query.get('session', [None])[0]
+    if (session_id is not None and
+            not session_store.is_valid_session_id(session_id)):
+        raise session_store.BadSessionIdError(
+            'Unsupported session ID %r' % session_id)
+    return session_id
+
+
+class ProfileStateMixIn:
+    """Keeps profile state shared by request handlers of a server.
+
+    Responses with profile data are cached until profile is updated.
+    Static files are loaded and compressed once on server start.
+    Clients subscribed to /events are notified when profile is updated.
+    Uploaded stats are also kept separately by session in session_store.
+    Uploaded flame graphs are merged into aggregates keyed by object name,
+    and flame graph stats of profile refer to the last updated aggregate.
+    """
+    call_stats_index = None
+    # State is set by init_profile_state, which servers call from __init__.
+    lock = None
+    profile_version = 0
+    closed = False
+    session_store = None
+    response_cache = None
+    call_tree_aggregates = None
+    static_files = None
+
+    def init_profile_state(self, aggregate_factory=None):
+        """Initializes profile state.
+
+        Args:
+            aggregate_factory: Callable that returns new flame graph
+                aggregate, call_tree_aggregate.CallTreeAggregate if not
+                specified.
+        """
+        # Condition is notified when profile is updated or closed.
+        self.lock = threading.Condition()
+        self.profile_version = 0
+        self.closed = False
+        self.session_store = session_store.SessionStore()
+        self.response_cache = _ResponseCache()
+        self.call_tree_aggregates = _CallTreeAggregates(
+            aggregate_factory or _create_default_aggregate)
+        self.static_files = load_static_files(
+            os.path.join(os.path.dirname(__file__), _STATIC_DIR))
+
+    def close_profile_state(self):
+        """Ends event streams and removes spilled sessions."""
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+        self.session_store.close()
+
+    def add_uploads(self, profile_json, uploaded_stats, session_id, size):
+        """Stores uploaded profiles and merges them into current profile.
+
+        Args:
+            profile_json: Current profile.
+            uploaded_stats: A list of uploaded profiles.
+            session_id: Session ID of uploads or None to store every
+                profile in a new session.
+            size: Size of uploaded JSON.
+        Raises:
+            call_tree_aggregate.BadCallTreeError: If uploaded flame graph
+                is malformed. Profiles preceding it are merged.
+        """
+        for run_stats in uploaded_stats:
+            self.session_store.add(
+                session_id or self.session_store.new_session_id(),
+                run_stats, size // len(uploaded_stats))
+        with self.lock:
+            try:
+                for run_stats in uploaded_stats:
+                    profile_json.update(self._aggregate_call_tree(run_stats))
+            finally:
+                self.profile_version += 1
+                self.response_cache.clear()
+                self.lock.notify_all()
+
+    def _aggregate_call_tree(self, run_stats):
+        """Merges uploaded flame graph into aggregate with the same name.
+
+        Must be called with lock held. Uploads with empty call tree are
+        counted, but don't change aggregated tree.
+
+        Returns:
+            Uploaded stats with flame graph stats replaced by aggregate.
+        """
+        stats = run_stats.get('c')
+        if not isinstance(stats, dict):
+            return run_stats
+        aggregate = self.call_tree_aggregates.add(
+            str(stats.get('objectName')), stats)
+        # Stored session stats are left intact.
+        return dict(run_stats, c=aggregate)
+
+    def get_aggregate_stats(self, key):
+        """Returns stats of aggregate or None if there is no aggregate."""
+        with self.lock:
+            aggregate = self.call_tree_aggregates.get(key)
+            if aggregate is None:
+                return None
+            return aggregate.get_stats()
+
+
+class StatsServer(ProfileStateMixIn, socketserver.ThreadingMixIn,
+                  socketserver.TCPServer):
     """Declares multithreaded HTTP server."""
     allow_reuse_address = True
+    # Don't wait for persistent connections of uploaders on shutdown.
+    daemon_threads = True
+
+    def __init__(self, *args, aggregate_factory=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.init_profile_state(aggregate_factory)
+
+    def server_close(self):
+        """Closes server and ends event streams."""
+        self.close_profile_state()
+        super().server_close()
 
 
 class StatsHandler(server.SimpleHTTPRequestHandler):
     """Program stats request handler."""
+    # Allows uploaders to reuse connections.
+    protocol_version = 'HTTP/1.1'
 
     def __init__(self, profile_json, *args, **kwargs):
         self._profile_json = profile_json
         self.uri_map = {
-            '/': self._handle_root,
-            '/profile': self._handle_profile,
+            _PROFILE_URI: self._handle_manifest,
+            _SESSIONS_URI: self._handle_sessions,
+            _AGGREGATES_URI: self._handle_aggregates,
         }
+        # Handlers of URIs with parameter, called with unquoted parameter.
+        self.prefix_map = (
+            (_PROFILER_URI_PREFIX, self._route_profiler),
+            (_AGGREGATE_URI_PREFIX, self._route_aggregate),
+            (_SESSION_URI_PREFIX, self._route_session),
+        )
         # Since this class is old-style - call parent method directly.
         server.SimpleHTTPRequestHandler.__init__(
             self, *args, **kwargs)
 
+    def _get_call_stats_index(self):
+        """Returns index of profiler records or None if there are none.
+
+        Index is rebuilt when profiler stats are replaced.
+        """
+        prof_stats = self._profile_json.get('p')
+        if not prof_stats or 'callStats' not in prof_stats:
+            return None
+        index = self.server.call_stats_index
+        if index is None or index.stats is not prof_stats:
+            index = CallStatsIndex(prof_stats)
+            self.server.call_stats_index = index
+        return index
+
+    def _get_manifest(self):
+        """Returns profile version and options of profilers with stats.
+
+        Profile is read under lock, since uploads add profilers to it.
+        """
+        with self.server.lock:
+            return get_manifest(
+                self._profile_json, self.server.profile_version)
+
+    def _handle_manifest(self):
+        """Handles profile manifest requests.
+
+        Stats of each profiler are requested separately via
+        /profile/<option>, so UI loads only stats of opened tabs.
+        """
+        return json.dumps(self._get_manifest()).encode(), 'text/json'
+
+    def _handle_profiler(self, option):
+        """Handles requests for stats of a single profiler."""
+        if option == 'p':
+            index = self._get_call_stats_index()
+            if index is not None:
+                return self._handle_call_stats(index)
+        prof_stats = self._profile_json[option]
+        if option == 'c' and hasattr(prof_stats, 'get_stats'):
+            # Aggregate is formatted under lock, since uploads update it.
+            with self.server.lock:
+                prof_stats = prof_stats.get_stats()
+        return json.dumps(prof_stats).encode(), 'text/json'
+
+    def _handle_aggregates(self):
+        """Handles requests for list of flame graph aggregates."""
+        with self.server.lock:
+            aggregates = self.server.call_tree_aggregates.list_aggregates()
+        return json.dumps({'aggregates': aggregates}).encode(), 'text/json'
+
+    def _handle_aggregate(self, key):
+        """Handles requests for stats of a flame graph aggregate."""
+        return json.dumps(
+            self.server.get_aggregate_stats(key)).encode(), 'text/json'
+
+    def _handle_sessions(self):
+        """Handles requests for list of upload sessions."""
+        return json.dumps({
+            'sessions': self.server.session_store.list_sessions(),
+        }).encode(), 'text/json'
+
+    def _handle_session(self, session_id):
+        """Handles requests for stats uploaded in a session."""
+        return json.dumps(
+            self.server.session_store.get(session_id)).encode(), 'text/json'
+
+    def _handle_call_stats(self, index):
+        """Handles profiler stats requests.
+
+        Only a page of profiler records specified by query is sent, next
+        pages are requested by UI while scrolling.
+        """
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        sort = query.get('sort', [_DEFAULT_SORT])[0]
+        if sort.lstrip('-') not in _CALL_STATS_COLUMNS:
+            sort = _DEFAULT_SORT
+        offset = self._get_int_param(query, 'offset', 0)
+        limit = min(self._get_int_param(
+            query, 'limit', _CALL_STATS_PAGE_SIZE), _MAX_CALL_STATS_PAGE_SIZE)
+        prof_stats = {
+            key: value for key, value in index.stats.items()
+            if key not in ('callStats', 'callGraph', 'runStats')}
+        prof_stats.update(index.get_page(
+            sort=sort, offset=offset, limit=limit,
+            name_filter=query.get('filter', [''])[0]))
+        return json.dumps(prof_stats).encode(), 'text/json'
+
     @staticmethod
-    def _handle_root():
-        """Handles index.html requests."""
-        res_filename = os.path.join(
-            os.path.dirname(__file__), _PROFILE_HTML)
-        with io.open(res_filename, 'rb') as res_file:
-            content = res_file.read()
-        return content, 'text/html'
-
-    def _handle_profile(self):
-        """Handles profile stats requests."""
-        return json.dumps(self._profile_json).encode(), 'text/json'
-
-    def _handle_other(self):
-        """Handles static files requests."""
-        res_filename = os.path.join(
-            os.path.dirname(__file__), _STATIC_DIR, self.path[1:])
-        with io.open(res_filename, 'rb') as res_file:
-            content = res_file.read()
-        _, extension = os.path.splitext(self.path)
-        return content, 'text/%s' % extension[1:]  # Skip dot in the extension.
+    def _get_int_param(query, name, default):
+        """Returns non-negative integer query parameter or default."""
+        try:
+            return max(int(query[name][0]), 0)
+        except (KeyError, ValueError):
+            return default
+
+    def _get_static_file(self, url):
+        """Returns static file response and its Cache-Control value."""
+        response = self.server.static_files.get(
+            _PROFILE_HTML if url.path == '/' else url.path)
+        if response is None:
+            return None, None
+        query = urllib.parse.parse_qs(url.query)
+        if query.get(_FINGERPRINT_PARAM) == [response.fingerprint]:
+            return response, _IMMUTABLE_CACHE_CONTROL
+        return response, 'no-cache'
+
+    def _get_cached_response(self, handler):
+        """Returns response of handler for current profile version."""
+        with self.server.lock:
+            version = self.server.profile_version
+            response = self.server.response_cache.get(self.path)
+            if response is not None:
+                return response
+        response = _Response(*handler())
+        # Compressed before caching, so cache accounts for both bodies.
+        response.compressed_content  # pylint: disable=pointless-statement
+        with self.server.lock:
+            # Response is stale if profile was updated meanwhile.
+            if version == self.server.profile_version:
+                self.server.response_cache.put(self.path, response)
+        return response
+
+    def _is_not_modified(self, response):
+        """Checks whether client has up-to-date copy of the response.
+
+        If-Modified-Since is only checked when If-None-Match is missing.
+        """
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            return if_none_match.strip() == '*' or response.etag in (
+                tag.strip() for tag in if_none_match.split(','))
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if not if_modified_since or response.last_modified is None:
+            return False
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since is None or since.tzinfo is None:
+            return False
+        return int(response.last_modified) <= since.timestamp()
+
+    def _get_last_event_id(self):
+        """Returns profile version last seen by reconnected event stream."""
+        try:
+            return int(self.headers.get('Last-Event-ID'))
+        except (TypeError, ValueError):
+            return None
+
+    def _wait_for_update(self, last_version):
+        """Waits until profile version differs from last_version.
+
+        Returns:
+            Profile manifest or None if server is closed. Manifest version
+            equals last_version on timeout.
+        """
+        with self.server.lock:
+            self.server.lock.wait_for(
+                lambda: (self.server.profile_version != last_version or
+                         self.server.closed),
+                timeout=_EVENTS_KEEPALIVE_INTERVAL)
+            if self.server.closed:
+                return None
+            return self._get_manifest()
+
+    def _handle_events(self):
+        """Streams profile updates as server-sent events.
+
+        Every event carries profile manifest. Current manifest is sent
+        right after connecting, so clients can't miss updates made before
+        they subscribed. Profile version is used as event ID, which lets
+        stream resume on reconnect.
+        """
+        self.close_connection = True
+        self._send_response(
+            200, headers=(('Content-type', 'text/event-stream'),
+                          ('Cache-Control', 'no-cache'),
+                          ('Connection', 'close')))
+        last_version = self._get_last_event_id()
+        try:
+            while True:
+                manifest = self._wait_for_update(last_version)
+                if manifest is None:
+                    return
+                if manifest['version'] == last_version:
+                    self.wfile.write(b': keepalive\n\n')
+                else:
+                    last_version = manifest['version']
+                    self.wfile.write(format_event(manifest))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+    def _route_profiler(self, option):
+        """Returns response with stats of a single profiler."""
+        with self.server.lock:
+            options = get_profiler_options(self._profile_json)
+        if option not in options:
+            return None, None
+        return self._get_cached_response(
+            functools.partial(self._handle_profiler, option)), 'no-cache'
+
+    def _route_aggregate(self, key):
+        """Returns response with stats of a flame graph aggregate."""
+        with self.server.lock:
+            if key not in self.server.call_tree_aggregates:
+                return None, None
+        return self._get_cached_response(
+            functools.partial(self._handle_aggregate, key)), 'no-cache'
+
+    def _route_session(self, session_id):
+        """Returns response with stats uploaded in a session.
+
+        Session stats aren't cached, otherwise cache would keep spilled
+        sessions in memory.
+        """
+        if session_id not in self.server.session_store:
+            return None, None
+        return _Response(*self._handle_session(session_id)), 'no-cache'
+
+    def _get_response(self, url):
+        """Returns response to GET request and its Cache-Control value.
+
+        Clients revalidate responses with profile data on every request
+        and get 304 if the response is not modified.
+
+        Returns:
+            (None, None) if there is nothing at url.
+        """
+        handler = self.uri_map.get(url.path)
+        if handler is not None:
+            return self._get_cached_response(handler), 'no-cache'
+        for prefix, route in self.prefix_map:
+            if url.path.startswith(prefix):
+                return route(urllib.parse.unquote(url.path[len(prefix):]))
+        return self._get_static_file(url)
 
     def do_GET(self):
         """Handles HTTP GET requests."""
-        handler = self.uri_map.get(self.path) or self._handle_other
-        content, content_type = handler()
-        compressed_content = gzip.compress(content)
-        self._send_response(
-            200, headers=(('Content-type', '%s; charset=utf-8' % content_type),
-                          ('Content-Encoding', 'gzip'),
-                          ('Content-Length', len(compressed_content))))
-        self.wfile.write(compressed_content)
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == _EVENTS_URI:
+            self._handle_events()
+            return
+        response, cache_control = self._get_response(url)
+        if response is None:
+            self.send_error(404)
+            return
+        cache_headers = [('ETag', response.etag),
+                         ('Cache-Control', cache_control),
+                         ('Vary', 'Accept-Encoding')]
+        if response.last_modified is not None:
+            cache_headers.append(('Last-Modified', email.utils.formatdate(
+                response.last_modified, usegmt=True)))
+        if self._is_not_modified(response):
+            self._send_response(304, headers=cache_headers)
+            return
+        content_type = response.content_type
+        if content_type.startswith('text/') or content_type in (
+                'application/javascript', 'application/json'):
+            content_type += '; charset=utf-8'
+        headers = [('Content-type', content_type)]
+        headers.extend(cache_headers)
+        compressed_content = None
+        if _accepts_gzip(self.headers.get('Accept-Encoding')):
+            compressed_content = response.compressed_content
+        if compressed_content is not None:
+            content = compressed_content
+            headers.append(('Content-Encoding', 'gzip'))
+        else:
+            content = response.content
+        headers.append(('Content-Length', len(content)))
+        self._send_response(200, headers=headers)
+        self.wfile.write(content)
 
     def do_POST(self):
-        """Handles HTTP POST requests."""
+        """Handles HTTP POST requests.
+
+        Stats are stored in session specified by 'session' query parameter.
+        Each profile gets a new session if the parameter is missing.
+        """
+        from vprof import call_tree_aggregate  # pylint: disable=import-outside-toplevel
+        try:
+            session_id = get_upload_session_id(self.path)
+        except session_store.BadSessionIdError:
+            self.send_error(400, 'Unsupported session ID')
+            return
         post_data = self.rfile.read(int(self.headers['Content-Length']))
         json_data = gzip.decompress(post_data)
-        self._profile_json.update(json.loads(json_data.decode('utf-8')))
+        uploaded_stats = json.loads(json_data.decode('utf-8'))
+        # Uploaders can send several profiles in one batch.
+        if not isinstance(uploaded_stats, list):
+            uploaded_stats = [uploaded_stats]
+        try:
+            self.server.add_uploads(
+                self._profile_json, uploaded_stats, session_id,
+                len(json_data))
+        except call_tree_aggregate.BadCallTreeError:
+            self.send_error(400, 'Malformed call tree')
+            return
         self._send_response(
             200, headers=(('Content-type', '%s; charset=utf-8' % 'text/json'),
-                          ('Content-Encoding', 'gzip'),
-                          ('Content-Length', len(post_data))))
+                          ('Content-Length', 0)))
 
     def _send_response(self, http_code, message=None, headers=None):
         """Sends HTTP response code, message and headers."""
@@ -84,24 +845,40 @@ class StatsHandler(server.SimpleHTTPRequestHandler):
             self.end_headers()
 
 
-def start(host, port, profiler_stats, dont_start_browser, debug_mode):
+def create_server(server_address, profile_json, aggregate_factory=None):
+    """Returns multithreaded stats server bound to server_address."""
+    return StatsServer(
+        server_address, functools.partial(StatsHandler, profile_json),
+        aggregate_factory=aggregate_factory)
+
+
+def start(host, port, profiler_stats, dont_start_browser, debug_mode,
+          server_factory=create_server, aggregate_factory=None):
     """Starts HTTP server with specified parameters.
 
     Args:
         host: Server host name.
         port: Server port.
-        profiler_stats: A dict with collected program stats.
+        profiler_stats: A dict with collected program stats or
+            profile_file.LazyStats with stats of saved profile.
         dont_start_browser: Whether to open browser after profiling.
         debug_mode: Whether to redirect stderr to /dev/null.
+        server_factory: Callable that takes server address, profile and
+            aggregate_factory and returns server, e.g.
+            async_server.AsyncStatsServer, which handles many concurrent
+            uploaders better.
+        aggregate_factory: Callable that returns new aggregate of uploaded
+            flame graphs, see call_tree_aggregate.get_aggregate_factory.
     """
-    stats_handler = functools.partial(StatsHandler, profiler_stats)
     if not debug_mode:
         sys.stderr = open(os.devnull, 'w')
     print('Starting HTTP server...')
+    http_server = server_factory(
+        (host, port), profiler_stats, aggregate_factory=aggregate_factory)
     if not dont_start_browser:
         webbrowser.open('http://{}:{}/'.format(host, port))
     try:
-        StatsServer((host, port), stats_handler).serve_forever()
+        http_server.serve_forever()
     except KeyboardInterrupt:
         print('Stopping...')
         sys.exit(0)
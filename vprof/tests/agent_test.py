@@ -0,0 +1,90 @@
+# pylint: disable=protected-access, missing-docstring
+import os
+import tempfile
+import unittest
+
+from vprof import agent
+from vprof import flame_graph
+
+
+class AgentUnittest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._directory = self._tmp_dir.name
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def _create_window(self, timestamp, size):
+        filename = os.path.join(
+            self._directory, agent._FILENAME_FORMAT % (timestamp, 1))
+        with open(filename, 'wb') as outfile:
+            outfile.write(b'0' * size)
+        return filename
+
+    def testListWindows(self):
+        second = self._create_window(20, 1)
+        first = self._create_window(10, 1)
+        open(os.path.join(self._directory, 'foo.json.gz'), 'w').close()
+        self.assertListEqual(
+            agent.list_windows(self._directory), [(10, first), (20, second)])
+
+    def testRemoveOldWindows(self):
+        self._create_window(10, 100)
+        self._create_window(20, 100)
+        third = self._create_window(30, 100)
+        fourth = self._create_window(40, 100)
+        prof_agent = agent.Agent(self._directory, max_size=250)
+        prof_agent._remove_old_windows()
+        self.assertListEqual(
+            agent.list_windows(self._directory), [(30, third), (40, fourth)])
+
+    def testRemoveOldWindows_KeepsNewest(self):
+        self._create_window(10, 100)
+        newest = self._create_window(20, 100)
+        prof_agent = agent.Agent(self._directory, max_size=10)
+        prof_agent._remove_old_windows()
+        self.assertListEqual(
+            agent.list_windows(self._directory), [(20, newest)])
+
+    def testSave(self):
+        prof = flame_graph._StatProfiler()
+        prof.add_stack((('foo', 'bar.py', 1), ('all threads', '', 0)), 3)
+        prof_agent = agent.Agent(self._directory, sample_interval=0.1)
+        prof_agent._save(prof, 100, 60)
+        windows = agent.list_windows(self._directory)
+        self.assertEqual(len(windows), 1)
+        self.assertEqual(windows[0][0], 100)
+        run_stats = agent.load_window(windows[0][1])
+        self.assertIn('version', run_stats)
+        self.assertEqual(run_stats['c']['totalSamples'], 3)
+        self.assertEqual(run_stats['c']['runTime'], 60)
+        self.assertEqual(run_stats['c']['sampleInterval'], 0.1)
+
+    def testRun(self):
+        prof_agent = agent.Agent(
+            self._directory, window_length=0.02, sample_interval=0.001)
+        prof_agent.start()
+        windows = []
+        for _ in range(500):
+            windows = agent.list_windows(self._directory)
+            if len(windows) >= 2:
+                break
+            prof_agent.join(0.01)
+        prof_agent.stop()
+        prof_agent.join(5)
+        self.assertFalse(prof_agent.active)
+        self.assertGreaterEqual(len(windows), 2)
+
+    def testRun_Duration(self):
+        prof_agent = agent.Agent(
+            self._directory, window_length=60, sample_interval=0.001)
+        prof_agent.start(duration=0.05)
+        prof_agent.join(5)
+        self.assertFalse(prof_agent.active)
+        windows = agent.list_windows(self._directory)
+        self.assertEqual(len(windows), 1)
+        self.assertLess(agent.load_window(windows[0][1])['c']['runTime'], 5)
+
+# pylint: enable=protected-access, missing-docstring
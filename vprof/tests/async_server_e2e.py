@@ -0,0 +1,108 @@
+"""End-to-end tests for asyncio-based stats server."""
+# pylint: disable=protected-access, missing-docstring, blacklisted-name
+import gzip
+import http.client
+import json
+import sys
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+
+from vprof import async_server
+from vprof import runner
+
+_HOST, _PORT = 'localhost', 12345
+_GZIP_HEADERS = {'Accept-Encoding': 'gzip'}
+_POLL_INTERVAL = 0.01
+
+
+@unittest.skipIf(sys.version_info < (3, 5, 2),
+                 'asyncio streams lack readuntil before Python 3.5.2')
+class AsyncServerEndToEndTest(unittest.TestCase):
+
+    def setUp(self):
+
+        def _func(foo, bar):
+            baz = foo + bar
+            time.sleep(0.01)
+            return baz
+        self._func = _func
+
+        self.server = async_server.AsyncStatsServer(
+            (_HOST, _PORT), {}, max_body_size=10 ** 6, max_concurrency=2)
+        threading.Thread(
+            target=self.server.serve_forever,
+            kwargs={'poll_interval': _POLL_INTERVAL}).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _post(self, body, path='/'):
+        connection = http.client.HTTPConnection(_HOST, _PORT, timeout=10)
+        connection.request('POST', path, body)
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        return response.status
+
+    def testRequest(self):
+        runner.run(self._func, 'p', ('foo', 'bar'), host=_HOST, port=_PORT,
+                   session='worker-1')
+        response = urllib.request.urlopen(urllib.request.Request(
+            'http://%s:%s/profile/p' % (_HOST, _PORT), headers=_GZIP_HEADERS))
+        stats = json.loads(gzip.decompress(response.read()).decode('utf-8'))
+        self.assertTrue(stats['totalCalls'] > 0)
+        response = urllib.request.urlopen(
+            'http://%s:%s/sessions' % (_HOST, _PORT))
+        sessions = json.loads(response.read().decode('utf-8'))['sessions']
+        self.assertEqual(sessions[0]['id'], 'worker-1')
+        response = urllib.request.urlopen('http://%s:%s/' % (_HOST, _PORT))
+        self.assertIn(b'<html>', response.read())
+
+    def testRequest_AsyncUploader(self):
+        uploader = runner.AsyncUploader(
+            host=_HOST, port=_PORT, max_batch_size=2)
+        for _ in range(5):
+            runner.run(self._func, 'p', ('foo', 'bar'), uploader=uploader)
+        uploader.flush()
+        self.assertEqual(uploader.dropped_count, 0)
+        response = urllib.request.urlopen(
+            'http://%s:%s/profile' % (_HOST, _PORT))
+        manifest = json.loads(response.read().decode('utf-8'))
+        self.assertEqual(manifest['profilers'], ['p'])
+        self.assertTrue(manifest['version'] >= 3)
+
+    def testRequest_BadUploads(self):
+        self.assertEqual(self._post(b'foo'), 400)
+        self.assertEqual(self._post(gzip.compress(b'[1, 2]')), 400)
+        self.assertEqual(
+            self._post(gzip.compress(b'{}'), '/?session=../foo'), 400)
+        self.assertEqual(self._post(gzip.compress(b'{"p": {}}')[:-4]), 400)
+        self.assertEqual(self._post(gzip.compress(
+            b'{"c": {"callStats": {"stack": "base"}}}')), 400)
+        self.assertEqual(
+            self._post(gzip.compress(b' ' * (10 ** 6 + 1))), 413)
+        self.assertEqual(self._post(gzip.compress(b'{"p": {}}')), 200)
+        self.assertEqual(self.server._body_budget.size, 0)
+
+    def testRequest_Events(self):
+        connection = http.client.HTTPConnection(_HOST, _PORT, timeout=10)
+        connection.request('GET', '/events')
+        response = connection.getresponse()
+        self.assertEqual(
+            response.getheader('Content-Type'), 'text/event-stream')
+        self.assertEqual(response.readline(), b'id: 0\n')
+        for _ in range(3):
+            response.readline()
+        runner.run(self._func, 'p', ('foo', 'bar'), host=_HOST, port=_PORT)
+        self.assertEqual(response.readline(), b'id: 1\n')
+        self.assertEqual(response.readline(), b'event: profile\n')
+        self.assertEqual(
+            json.loads(response.readline()[len('data: '):].decode('utf-8')),
+            {'version': 1, 'profilers': ['p']})
+        connection.close()
+
+# pylint: enable=protected-access, missing-docstring, blacklisted-name
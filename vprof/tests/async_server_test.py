@@ -0,0 +1,62 @@
+# pylint: disable=protected-access, missing-docstring
+import unittest
+
+from vprof import async_server
+
+
+class AsyncServerUnittest(unittest.TestCase):
+
+    def testParseRequestHead(self):
+        method, path, version, headers = async_server._parse_request_head(
+            b'POST /?session=foo HTTP/1.1\r\nHost: localhost\r\n'
+            b'Content-Length: 10\r\n\r\n')
+        self.assertEqual(method, 'POST')
+        self.assertEqual(path, '/?session=foo')
+        self.assertEqual(version, 'HTTP/1.1')
+        self.assertEqual(headers['Content-Length'], '10')
+
+    def testParseRequestHead_Malformed(self):
+        with self.assertRaises(async_server.RequestError) as context:
+            async_server._parse_request_head(b'GET /\r\n\r\n')
+        self.assertEqual(context.exception.code, 400)
+        with self.assertRaises(async_server.RequestError) as context:
+            async_server._parse_request_head(b'GET / HTTP/2.0\r\n\r\n')
+        self.assertEqual(context.exception.code, 505)
+
+    def testGetContentLength(self):
+        _, _, _, headers = async_server._parse_request_head(
+            b'POST / HTTP/1.1\r\nContent-Length: 10\r\n\r\n')
+        self.assertEqual(async_server._get_content_length(headers), 10)
+        _, _, _, headers = async_server._parse_request_head(
+            b'GET / HTTP/1.1\r\n\r\n')
+        self.assertEqual(async_server._get_content_length(headers), 0)
+        for header in (b'Content-Length: -1', b'Content-Length: foo',
+                       b'Transfer-Encoding: chunked'):
+            _, _, _, headers = async_server._parse_request_head(
+                b'POST / HTTP/1.1\r\n' + header + b'\r\n\r\n')
+            with self.assertRaises(async_server.RequestError):
+                async_server._get_content_length(headers)
+
+    def testFormatResponse(self):
+        self.assertEqual(
+            async_server._format_response(
+                404, (('Content-Length', 3),), b'foo'),
+            b'HTTP/1.1 404 Not Found\r\nContent-Length: 3\r\n\r\nfoo')
+
+    def testBodyBudget(self):
+        budget = async_server._BodyBudget(max_body_size=10, max_total_size=15)
+        self.assertEqual(budget.get_limit(0), 10)
+        budget.reserve(0, 8)
+        self.assertEqual(budget.get_limit(0), 7)
+        self.assertEqual(budget.get_limit(8), 2)
+        with self.assertRaises(async_server.RequestError) as context:
+            budget.reserve(8, 3)
+        self.assertEqual(context.exception.code, 413)
+        with self.assertRaises(async_server.RequestError) as context:
+            budget.reserve(0, 8)
+        self.assertEqual(context.exception.code, 503)
+        budget.release(8)
+        budget.reserve(0, 8)
+        self.assertEqual(budget.size, 8)
+
+# pylint: enable=protected-access, missing-docstring
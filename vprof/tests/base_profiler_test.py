@@ -1,4 +1,5 @@
 # pylint: disable=protected-access, missing-docstring
+import marshal
 import sys
 import unittest
 
@@ -26,6 +27,49 @@ class GetPkgModuleNamesUnittest(unittest.TestCase):
                      '/path/to/module/module2.py'})
 
 
+class GetModuleCodeUnittest(unittest.TestCase):
+
+    def setUp(self):
+        base_profiler._CODE_CACHE.clear()
+
+    def tearDown(self):
+        base_profiler._CODE_CACHE.clear()
+
+    @mock.patch('os.stat')
+    def testGetModuleCode(self, stat_mock):
+        stat_mock.return_value.st_mtime_ns = 1
+        stat_mock.return_value.st_size = 12
+        open_mock = mock.mock_open(read_data=b'foo = 1 + 2')
+        with mock.patch('builtins.open', open_mock):
+            code_bytes = base_profiler.get_module_code('foo.py')
+            self.assertEqual(
+                base_profiler.get_module_code('foo.py'), code_bytes)
+        open_mock.assert_called_once_with('foo.py', 'rb')
+        code = marshal.loads(code_bytes)
+        self.assertEqual(code.co_filename, 'foo.py')
+        globs = {}
+        exec(code, globs)  # pylint: disable=exec-used
+        self.assertEqual(globs['foo'], 3)
+
+
+def _dummy_func(first, second=None):
+    if second is None:
+        raise ValueError('second is required')
+    return {'first': first, 'second': second}
+
+
+class RunInSeparateProcessUnittest(unittest.TestCase):
+
+    def testOutput(self):
+        self.assertDictEqual(
+            base_profiler.run_in_separate_process(_dummy_func, 1, second=2),
+            {'first': 1, 'second': 2})
+
+    def testException(self):
+        with self.assertRaises(ValueError):
+            base_profiler.run_in_separate_process(_dummy_func, 1)
+
+
 class BaseProfileUnittest(unittest.TestCase):
     def setUp(self):
         self.profiler = object.__new__(base_profiler.BaseProfiler)
@@ -0,0 +1,146 @@
+# pylint: disable=protected-access, missing-docstring
+import unittest
+
+from vprof import call_tree_aggregate
+
+
+def _node(name, sample_count, children=()):
+    return {'stack': [name, 'foo.py', 1], 'sampleCount': sample_count,
+            'children': list(children)}
+
+
+def _stats(call_tree, run_time=1.0):
+    return {'objectName': 'foo', 'sampleInterval': 0.01,
+            'runTime': run_time, 'callStats': call_tree,
+            'totalSamples': call_tree.get('sampleCount', 0),
+            'timestamp': 1}
+
+
+def _get_counts(call_tree):
+    return {
+        call_tree['stack'][0]: (call_tree['sampleCount'], {
+            child['stack'][0]: child['sampleCount']
+            for child in call_tree['children']})}
+
+
+class CallTreeAggregateUnittest(unittest.TestCase):
+
+    def testAdd(self):
+        aggregate = call_tree_aggregate.CallTreeAggregate()
+        aggregate.add(_stats(_node('main', 3, [
+            _node('foo', 2), _node('bar', 1)])))
+        aggregate.add(_stats(_node('main', 4, [
+            _node('foo', 1), _node('baz', 3)])))
+        stats = aggregate.get_stats()
+        self.assertDictEqual(
+            _get_counts(stats['callStats']),
+            {'main': (7, {'foo': 3, 'bar': 1, 'baz': 3})})
+        self.assertEqual(stats['totalSamples'], 7)
+        self.assertEqual(stats['runTime'], 2.0)
+        self.assertEqual(stats['uploads'], 2)
+        self.assertEqual(stats['objectName'], 'foo')
+        self.assertEqual(
+            stats['callStats']['children'][0]['samplePercentage'],
+            100 * round(3 / 7, 3))
+
+    def testAdd_DifferentRoots(self):
+        aggregate = call_tree_aggregate.CallTreeAggregate()
+        aggregate.add(_stats(_node('main', 3)))
+        aggregate.add(_stats(_node('other', 1)))
+        stats = aggregate.get_stats()
+        self.assertEqual(stats['callStats']['stack'],
+                         call_tree_aggregate._SYNTHETIC_ROOT)
+        self.assertDictEqual(
+            _get_counts(stats['callStats']),
+            {'all uploads': (4, {'main': 3, 'other': 1})})
+
+    def testAdd_Malformed(self):
+        aggregate = call_tree_aggregate.CallTreeAggregate()
+        malformed_trees = (
+            {'stack': 'base', 'sampleCount': 1, 'children': []},
+            {'stack': ['main', 'foo.py', 1], 'children': []},
+            {'stack': ['main', 'foo.py', 1], 'sampleCount': 'x',
+             'children': []},
+            _node('main', 1, [{'stack': ['foo', 'foo.py', 1]}]),
+        )
+        for call_tree in malformed_trees:
+            with self.assertRaises(call_tree_aggregate.BadCallTreeError):
+                aggregate.add(_stats(call_tree))
+        self.assertEqual(aggregate.uploads, 0)
+        self.assertDictEqual(aggregate.get_stats()['callStats'], {})
+
+    def testAdd_EmptyCallTree(self):
+        aggregate = call_tree_aggregate.CallTreeAggregate()
+        aggregate.add(_stats(_node('main', 3)))
+        aggregate.add(_stats({}))
+        stats = aggregate.get_stats()
+        self.assertDictEqual(_get_counts(stats['callStats']),
+                             {'main': (3, {})})
+        self.assertEqual(stats['uploads'], 2)
+        self.assertEqual(stats['runTime'], 2.0)
+
+    def testAdd_Decayed(self):
+        aggregate = call_tree_aggregate.CallTreeAggregate(half_life=10)
+        aggregate.add(_stats(_node('main', 8, [_node('foo', 8)])), 100)
+        aggregate.add(_stats(_node('main', 8, [_node('bar', 8)])), 110)
+        stats = aggregate.get_stats(110)
+        self.assertDictEqual(
+            _get_counts(stats['callStats']),
+            {'main': (12, {'foo': 4, 'bar': 8})})
+        self.assertEqual(stats['halfLife'], 10)
+        stats = aggregate.get_stats(120)
+        self.assertDictEqual(
+            _get_counts(stats['callStats']),
+            {'main': (6, {'foo': 2, 'bar': 4})})
+
+    def testAdd_DecayedRenormalized(self):
+        aggregate = call_tree_aggregate.CallTreeAggregate(half_life=1)
+        aggregate.add(_stats(_node('main', 4, [_node('foo', 4)])), 0)
+        aggregate.add(_stats(_node('main', 4, [_node('bar', 4)])), 20)
+        self.assertEqual(aggregate._base_time, 20)
+        # Samples of foo decayed below minimal count and were removed.
+        self.assertDictEqual(
+            _get_counts(aggregate.get_stats(20)['callStats']),
+            {'main': (4, {'bar': 4})})
+
+    def testGetStats_Empty(self):
+        stats = call_tree_aggregate.CallTreeAggregate().get_stats()
+        self.assertDictEqual(stats['callStats'], {})
+        self.assertEqual(stats['totalSamples'], 0)
+
+    def testWindowed(self):
+        aggregate = call_tree_aggregate.WindowedCallTreeAggregate(
+            60, num_buckets=6)
+        aggregate.add(_stats(_node('main', 1, [_node('foo', 1)])), 0)
+        aggregate.add(_stats(_node('main', 2, [_node('bar', 2)])), 35)
+        aggregate.add(_stats(_node('main', 4, [_node('bar', 4)])), 38)
+        stats = aggregate.get_stats(60)
+        self.assertDictEqual(
+            _get_counts(stats['callStats']),
+            {'main': (7, {'foo': 1, 'bar': 6})})
+        self.assertEqual(stats['uploads'], 3)
+        self.assertEqual(stats['window'], 60)
+        self.assertEqual(aggregate.uploads, 3)
+        self.assertNotIn('halfLife', stats)
+        self.assertEqual(len(aggregate._buckets), 2)
+        stats = aggregate.get_stats(75)
+        self.assertDictEqual(
+            _get_counts(stats['callStats']), {'main': (6, {'bar': 6})})
+        self.assertEqual(len(aggregate._buckets), 1)
+        self.assertDictEqual(aggregate.get_stats(200)['callStats'], {})
+
+    def testGetAggregateFactory(self):
+        aggregate = call_tree_aggregate.get_aggregate_factory()()
+        self.assertIsInstance(aggregate, call_tree_aggregate.CallTreeAggregate)
+        self.assertEqual(aggregate._decay_rate, 0)
+        aggregate = call_tree_aggregate.get_aggregate_factory(half_life=5)()
+        self.assertEqual(aggregate._half_life, 5)
+        aggregate = call_tree_aggregate.get_aggregate_factory(window=60)()
+        self.assertIsInstance(
+            aggregate, call_tree_aggregate.WindowedCallTreeAggregate)
+        with self.assertRaises(call_tree_aggregate.Error):
+            call_tree_aggregate.get_aggregate_factory(half_life=5, window=60)
+        with self.assertRaises(call_tree_aggregate.Error):
+            call_tree_aggregate.get_aggregate_factory(window=0)
+
+# pylint: enable=protected-access, missing-docstring
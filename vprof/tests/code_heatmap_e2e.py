@@ -15,6 +15,7 @@ from vprof import runner
 from vprof.tests import test_pkg # pylint: disable=unused-import
 
 _HOST, _PORT = 'localhost', 12345
+_GZIP_HEADERS = {'Accept-Encoding': 'gzip'}
 _MODULE_FILENAME = 'vprof/tests/test_pkg/dummy_module.py'
 _PACKAGE_PATH = 'vprof/tests/test_pkg/'
 _DUMMY_MODULE_SOURCELINES = [
@@ -37,7 +38,7 @@ class CodeHeatmapModuleEndToEndTest(unittest.TestCase):
         program_stats = code_heatmap.CodeHeatmapProfiler(
             _MODULE_FILENAME).run()
         stats_handler = functools.partial(
-            stats_server.StatsHandler, program_stats)
+            stats_server.StatsHandler, {'h': program_stats})
         self.server = stats_server.StatsServer(
             (_HOST, _PORT), stats_handler)
         threading.Thread(
@@ -49,8 +50,8 @@ class CodeHeatmapModuleEndToEndTest(unittest.TestCase):
         self.server.server_close()
 
     def testRequest(self):
-        response = urllib.request.urlopen(
-            'http://%s:%s/profile' % (_HOST, _PORT))
+        response = urllib.request.urlopen(urllib.request.Request(
+            'http://%s:%s/profile/h' % (_HOST, _PORT), headers=_GZIP_HEADERS))
         response_data = gzip.decompress(response.read())
         stats = json.loads(response_data.decode('utf-8'))
         self.assertEqual(stats['objectName'], _MODULE_FILENAME)
@@ -68,7 +69,7 @@ class CodeHeatmapPackageEndToEndTest(unittest.TestCase):
         program_stats = code_heatmap.CodeHeatmapProfiler(
             _PACKAGE_PATH).run()
         stats_handler = functools.partial(
-            stats_server.StatsHandler, program_stats)
+            stats_server.StatsHandler, {'h': program_stats})
         self.server = stats_server.StatsServer(
             (_HOST, _PORT), stats_handler)
         threading.Thread(
@@ -80,8 +81,8 @@ class CodeHeatmapPackageEndToEndTest(unittest.TestCase):
         self.server.server_close()
 
     def testRequest(self):
-        response = urllib.request.urlopen(
-            'http://%s:%s/profile' % (_HOST, _PORT))
+        response = urllib.request.urlopen(urllib.request.Request(
+            'http://%s:%s/profile/h' % (_HOST, _PORT), headers=_GZIP_HEADERS))
         response_data = gzip.decompress(response.read())
         stats = json.loads(response_data.decode('utf-8'))
         self.assertEqual(stats['objectName'], _PACKAGE_PATH)
@@ -117,22 +118,22 @@ class CodeHeatmapFunctionEndToEndTest(unittest.TestCase):
     def testRequest(self):
         runner.run(
             self._func, 'h', ('foo', 'bar'), host=_HOST, port=_PORT)
-        response = urllib.request.urlopen(
-            'http://%s:%s/profile' % (_HOST, _PORT))
+        response = urllib.request.urlopen(urllib.request.Request(
+            'http://%s:%s/profile/h' % (_HOST, _PORT), headers=_GZIP_HEADERS))
         response_data = gzip.decompress(response.read())
         stats = json.loads(response_data.decode('utf-8'))
-        self.assertTrue(stats['h']['runTime'] > 0)
-        heatmaps = stats['h']['heatmaps']
+        self.assertTrue(stats['runTime'] > 0)
+        heatmaps = stats['heatmaps']
         curr_filename = inspect.getabsfile(inspect.currentframe())
-        self.assertEqual(stats['h']['objectName'],
+        self.assertEqual(stats['objectName'],
                          '_func @ %s (function)' % curr_filename)
         self.assertEqual(len(heatmaps), 1)
         self.assertDictEqual(
-            heatmaps[0]['executionCount'], {'101': 1, '102': 1})
+            heatmaps[0]['executionCount'], {'102': 1, '103': 1})
         self.assertListEqual(
             heatmaps[0]['srcCode'],
-            [['line', 100, u'        def _func(foo, bar):\n'],
-             ['line', 101, u'            baz = foo + bar\n'],
-             ['line', 102, u'            return baz\n']])
+            [['line', 101, u'        def _func(foo, bar):\n'],
+             ['line', 102, u'            baz = foo + bar\n'],
+             ['line', 103, u'            return baz\n']])
 
 # pylint: enable=missing-docstring, blacklisted-name
@@ -6,6 +6,7 @@ import json
 import inspect
 import threading
 import unittest
+import urllib.error
 import urllib.request
 
 from vprof import flame_graph
@@ -14,6 +15,7 @@ from vprof import runner
 from vprof.tests import test_pkg # pylint: disable=unused-import
 
 _HOST, _PORT = 'localhost', 12345
+_GZIP_HEADERS = {'Accept-Encoding': 'gzip'}
 _MODULE_FILENAME = 'vprof/tests/test_pkg/dummy_module.py'
 _PACKAGE_PATH = 'vprof/tests/test_pkg/'
 _POLL_INTERVAL = 0.01
@@ -25,7 +27,7 @@ class FlameGraphModuleEndToEndTest(unittest.TestCase):
         program_stats = flame_graph.FlameGraphProfiler(
             _MODULE_FILENAME).run()
         stats_handler = functools.partial(
-            stats_server.StatsHandler, program_stats)
+            stats_server.StatsHandler, {'c': program_stats})
         self.server = stats_server.StatsServer(
             (_HOST, _PORT), stats_handler)
         threading.Thread(
@@ -37,8 +39,8 @@ class FlameGraphModuleEndToEndTest(unittest.TestCase):
         self.server.server_close()
 
     def testRequest(self):
-        response = urllib.request.urlopen(
-            'http://%s:%s/profile' % (_HOST, _PORT))
+        response = urllib.request.urlopen(urllib.request.Request(
+            'http://%s:%s/profile/c' % (_HOST, _PORT), headers=_GZIP_HEADERS))
         response_data = gzip.decompress(response.read())
         stats = json.loads(response_data.decode('utf-8'))
         self.assertEqual(stats['objectName'], '%s (module)' % _MODULE_FILENAME)
@@ -54,7 +56,7 @@ class FlameGraphPackageEndToEndTest(unittest.TestCase):
         program_stats = flame_graph.FlameGraphProfiler(
             _PACKAGE_PATH).run()
         stats_handler = functools.partial(
-            stats_server.StatsHandler, program_stats)
+            stats_server.StatsHandler, {'c': program_stats})
         self.server = stats_server.StatsServer(
             (_HOST, _PORT), stats_handler)
         threading.Thread(
@@ -66,8 +68,8 @@ class FlameGraphPackageEndToEndTest(unittest.TestCase):
         self.server.server_close()
 
     def testRequest(self):
-        response = urllib.request.urlopen(
-            'http://%s:%s/profile' % (_HOST, _PORT))
+        response = urllib.request.urlopen(urllib.request.Request(
+            'http://%s:%s/profile/c' % (_HOST, _PORT), headers=_GZIP_HEADERS))
         response_data = gzip.decompress(response.read())
         stats = json.loads(response_data.decode('utf-8'))
         self.assertEqual(stats['objectName'], '%s (package)' % _PACKAGE_PATH)
@@ -101,17 +103,59 @@ class FlameGraphFunctionEndToEndTest(unittest.TestCase):
     def testRequest(self):
         runner.run(
             self._func, 'c', ('foo', 'bar'), host=_HOST, port=_PORT)
-        response = urllib.request.urlopen(
-            'http://%s:%s/profile' % (_HOST, _PORT))
+        response = urllib.request.urlopen(urllib.request.Request(
+            'http://%s:%s/profile/c' % (_HOST, _PORT), headers=_GZIP_HEADERS))
         response_data = gzip.decompress(response.read())
         stats = json.loads(response_data.decode('utf-8'))
         curr_filename = inspect.getabsfile(inspect.currentframe())
-        self.assertEqual(stats['c']['objectName'],
+        self.assertEqual(stats['objectName'],
                          '_func @ %s (function)' % curr_filename)
         self.assertEqual(
-            stats['c']['sampleInterval'], flame_graph._SAMPLE_INTERVAL)
-        self.assertTrue(stats['c']['runTime'] > 0)
-        self.assertTrue(len(stats['c']['callStats']) >= 0)
-        self.assertTrue(stats['c']['totalSamples'] >= 0)
+            stats['sampleInterval'], flame_graph._SAMPLE_INTERVAL)
+        self.assertTrue(stats['runTime'] > 0)
+        self.assertTrue(len(stats['callStats']) >= 0)
+        self.assertTrue(stats['totalSamples'] >= 0)
+
+    @staticmethod
+    def _upload(stats):
+        return urllib.request.urlopen(urllib.request.Request(
+            'http://%s:%s/' % (_HOST, _PORT),
+            gzip.compress(json.dumps(stats).encode('utf-8'))))
+
+    def _get_json(self, path):
+        response = urllib.request.urlopen(
+            'http://%s:%s%s' % (_HOST, _PORT, path))
+        return json.loads(response.read().decode('utf-8'))
+
+    def testRequest_Aggregated(self):
+        for route, sample_count in (('/foo', 2), ('/bar', 1), ('/foo', 3)):
+            self._upload({'c': {
+                'objectName': 'Sampled requests', 'sampleInterval': 0.01,
+                'runTime': 0.01 * sample_count,
+                'callStats': {
+                    'stack': ['requests', '', 0], 'sampleCount': sample_count,
+                    'children': [{
+                        'stack': [route, 'route', 0],
+                        'sampleCount': sample_count, 'children': []}]},
+                'totalSamples': sample_count, 'timestamp': 1}})
+        stats = self._get_json('/profile/c')
+        self.assertEqual(stats['totalSamples'], 6)
+        self.assertEqual(stats['uploads'], 3)
+        self.assertDictEqual(
+            {child['stack'][0]: child['sampleCount']
+             for child in stats['callStats']['children']},
+            {'/foo': 5, '/bar': 1})
+
+        aggregates = self._get_json('/aggregates')['aggregates']
+        self.assertListEqual(
+            aggregates, [{'name': 'Sampled requests', 'uploads': 3}])
+        self.assertDictEqual(
+            self._get_json('/aggregates/Sampled%20requests'), stats)
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self._get_json('/aggregates/foo')
+        self.assertEqual(context.exception.code, 404)
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self._upload({'c': {'callStats': {'stack': 'base'}}})
+        self.assertEqual(context.exception.code, 400)
 
 # pylint: enable=missing-docstring, blacklisted-name, protected-access
@@ -2,6 +2,7 @@
 import unittest
 
 from vprof import flame_graph
+from unittest import mock
 
 
 class StatProfilerUnittest(unittest.TestCase):
@@ -46,4 +47,39 @@ class StatProfilerUnittest(unittest.TestCase):
         }
         self.assertDictEqual(self._profiler.call_tree, expected_result)
 
+
+class FlameGraphProfilerUnittest(unittest.TestCase):
+
+    def testParseFoldedFrame(self):
+        self.assertEqual(
+            flame_graph._parse_folded_frame('foo (bar/baz.py:10)'),
+            ('foo', 'bar/baz.py', 10))
+        self.assertEqual(
+            flame_graph._parse_folded_frame('[libc.so]'),
+            ('[libc.so]', '', 0))
+
+    @mock.patch('os.path.getmtime')
+    def testLoadCollapsedStacks(self, getmtime_mock):
+        getmtime_mock.return_value = 42
+        folded_stacks = (
+            'foo (f:1);bar (f:2) 30\n'
+            'foo (f:1) 10\n'
+            'malformed line\n'
+            'foo (f:1);baz 60\n')
+        with mock.patch('builtins.open',
+                        mock.mock_open(read_data=folded_stacks)):
+            stats = flame_graph.FlameGraphProfiler.load_collapsed_stacks(
+                'stacks.txt')
+        self.assertEqual(stats['totalSamples'], 100)
+        self.assertEqual(stats['timestamp'], 42)
+        root = stats['callStats']
+        self.assertEqual(root['stack'], ('all', '', 0))
+        node = root['children'][0]
+        self.assertEqual(node['stack'], ('foo', 'f', 1))
+        self.assertEqual(node['sampleCount'], 100)
+        self.assertEqual(
+            [(child['stack'], child['sampleCount'])
+             for child in node['children']],
+            [(('bar', 'f', 2), 30), (('baz', '', 0), 60)])
+
 # pylint:  enable=protected-access, missing-docstring
@@ -20,6 +20,7 @@ except ImportError:  # __builtin__ was renamed to builtins in Python 3.
 builtins.initial_rss_size = 0
 
 _HOST, _PORT = 'localhost', 12345
+_GZIP_HEADERS = {'Accept-Encoding': 'gzip'}
 _MODULE_FILENAME = 'vprof/tests/test_pkg/dummy_module.py'
 _PACKAGE_PATH = 'vprof/tests/test_pkg/'
 _POLL_INTERVAL = 0.01
@@ -31,7 +32,7 @@ class MemoryProfilerModuleEndToEndTest(unittest.TestCase):
         program_stats = memory_profiler.MemoryProfiler(
             _MODULE_FILENAME).run()
         stats_handler = functools.partial(
-            stats_server.StatsHandler, program_stats)
+            stats_server.StatsHandler, {'m': program_stats})
         self.server = stats_server.StatsServer(
             (_HOST, _PORT), stats_handler)
         threading.Thread(
@@ -43,8 +44,8 @@ class MemoryProfilerModuleEndToEndTest(unittest.TestCase):
         self.server.server_close()
 
     def testRequest(self):
-        response = urllib.request.urlopen(
-            'http://%s:%s/profile' % (_HOST, _PORT))
+        response = urllib.request.urlopen(urllib.request.Request(
+            'http://%s:%s/profile/m' % (_HOST, _PORT), headers=_GZIP_HEADERS))
         response_data = gzip.decompress(response.read())
         stats = json.loads(response_data.decode('utf-8'))
         self.assertEqual(stats['objectName'], '%s (module)' % _MODULE_FILENAME)
@@ -62,7 +63,7 @@ class MemoryProfilerPackageEndToEndTest(unittest.TestCase):
         program_stats = memory_profiler.MemoryProfiler(
             _PACKAGE_PATH).run()
         stats_handler = functools.partial(
-            stats_server.StatsHandler, program_stats)
+            stats_server.StatsHandler, {'m': program_stats})
         self.server = stats_server.StatsServer(
             (_HOST, _PORT), stats_handler)
         threading.Thread(
@@ -74,8 +75,8 @@ class MemoryProfilerPackageEndToEndTest(unittest.TestCase):
         self.server.server_close()
 
     def testRequest(self):
-        response = urllib.request.urlopen(
-            'http://%s:%s/profile' % (_HOST, _PORT))
+        response = urllib.request.urlopen(urllib.request.Request(
+            'http://%s:%s/profile/m' % (_HOST, _PORT), headers=_GZIP_HEADERS))
         response_data = gzip.decompress(response.read())
         stats = json.loads(response_data.decode('utf-8'))
         self.assertEqual(stats['objectName'], '%s (package)' % _PACKAGE_PATH)
@@ -107,19 +108,19 @@ class MemoryProfilerFunctionEndToEndTest(unittest.TestCase):
     def testRequest(self):
         runner.run(
             self._func, 'm', ('foo', 'bar'), host=_HOST, port=_PORT)
-        response = urllib.request.urlopen(
-            'http://%s:%s/profile' % (_HOST, _PORT))
+        response = urllib.request.urlopen(urllib.request.Request(
+            'http://%s:%s/profile/m' % (_HOST, _PORT), headers=_GZIP_HEADERS))
         response_data = gzip.decompress(response.read())
         stats = json.loads(response_data.decode('utf-8'))
         curr_filename = inspect.getabsfile(inspect.currentframe())
-        self.assertEqual(stats['m']['objectName'],
+        self.assertEqual(stats['objectName'],
                          '_func @ %s (function)' % curr_filename)
-        self.assertEqual(stats['m']['totalEvents'], 2)
-        self.assertEqual(stats['m']['codeEvents'][0][0], 1)
-        self.assertEqual(stats['m']['codeEvents'][0][1], 91)
-        self.assertEqual(stats['m']['codeEvents'][0][3], '_func')
-        self.assertEqual(stats['m']['codeEvents'][1][0], 2)
-        self.assertEqual(stats['m']['codeEvents'][1][1], 92)
-        self.assertEqual(stats['m']['codeEvents'][1][3], '_func')
+        self.assertEqual(stats['totalEvents'], 2)
+        self.assertEqual(stats['codeEvents'][0][0], 1)
+        self.assertEqual(stats['codeEvents'][0][1], 92)
+        self.assertEqual(stats['codeEvents'][0][3], '_func')
+        self.assertEqual(stats['codeEvents'][1][0], 2)
+        self.assertEqual(stats['codeEvents'][1][1], 93)
+        self.assertEqual(stats['codeEvents'][1][3], '_func')
 
 # pylint: enable=missing-docstring, blacklisted-name
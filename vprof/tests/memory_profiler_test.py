@@ -52,6 +52,7 @@ class CodeEventsTrackerUnittest(unittest.TestCase):
             code1.co_filename, code2.co_filename,
             code3.co_filename, code4.co_filename}
         self._tracker._events_list = deque()
+        self._tracker._census = mock.MagicMock()
 
         self._tracker._trace_memory_usage(frame1, event, arg)
         self._tracker._trace_memory_usage(frame2, event, arg)
@@ -111,4 +112,73 @@ class CodeEventsTrackerUnittest(unittest.TestCase):
              [3, 1, 3.0, name1, fname1],
              [4, 2, 1.0, name2, fname2]])
 
+    @mock.patch.object(memory_profiler, '_CENSUS_MIN_INTERVAL', 0)
+    @mock.patch.object(memory_profiler, '_CENSUS_RSS_THRESHOLD', 16 * 2 ** 20)
+    def testObjectsCensus(self):
+        def _allocate_spike():
+            spike = []
+            for i in range(8):
+                spike.append(list(map(
+                    '{:0>100}'.format, range(i * 50000, (i + 1) * 50000))))
+            return len(spike)
+
+        tracker = memory_profiler._CodeEventsTracker(
+            {_allocate_spike.__code__.co_filename})
+        with tracker:
+            _allocate_spike()
+        tracker.mem_overhead = 0
+        census = tracker.objects_census
+        self.assertTrue(census)
+        for _, _, obj_count in census:
+            self.assertEqual(obj_count[0][0], 'class str')
+        self.assertTrue(census[-1][2][0][1] >= 100000)
+
+    @mock.patch('vprof.memory_profiler._get_current_rss')
+    @mock.patch('vprof.memory_profiler._count_objects_by_type')
+    def testObjectsCensus_OwnMemory(self, count_mock, rss_mock):
+        mb = memory_profiler._BYTES_IN_MB
+        census = memory_profiler._ObjectCensus()
+        census.check(1, 100 * mb, 0, list)
+        # Growth of profiler memory doesn't trigger census.
+        census.check(2, 150 * mb, 50 * mb, list)
+        count_mock.assert_not_called()
+        rss_mock.return_value = 200 * mb
+        census.check(3, 200 * mb, 50 * mb, list)
+        self.assertEqual(len(census.snapshots), 1)
+        census.check(4, 210 * mb, 50 * mb, list)
+        self.assertEqual(len(census.snapshots), 1)
+
+
+class MemoryProfilerUnittest(unittest.TestCase):
+    def setUp(self):
+        self._profiler = object.__new__(memory_profiler.MemoryProfiler)
+
+    @mock.patch('vprof.base_profiler.get_module_code')
+    @mock.patch('vprof.base_profiler.run_in_separate_process')
+    def testProfileModule(self, run_mock, get_code_mock):
+        self._profiler._run_object = 'foo.py'
+        self._profiler.profile_module()
+        get_code_mock.assert_called_with('foo.py')
+        run_mock.assert_called_with(
+            self._profiler._collect_isolated_stats,
+            self._profiler._profile_module, get_code_mock.return_value)
+
+    @mock.patch('vprof.base_profiler.run_in_separate_process')
+    def testProfilePackage(self, run_mock):
+        self._profiler.profile_package()
+        run_mock.assert_called_with(
+            self._profiler._collect_isolated_stats,
+            self._profiler._profile_package)
+
+    @mock.patch('vprof.memory_profiler._get_current_rss')
+    def testCollectIsolatedStats(self, rss_mock):
+        rss_mock.return_value = 42
+        self._profiler._collect_stats = mock.MagicMock()
+        profile = mock.MagicMock()
+        with mock.patch.object(memory_profiler.builtins, 'initial_rss_size',
+                               0, create=True):
+            self._profiler._collect_isolated_stats(profile, 'foo')
+            self.assertEqual(memory_profiler.builtins.initial_rss_size, 42)
+        self._profiler._collect_stats.assert_called_with(profile, 'foo')
+
 # pylint: enable=protected-access, missing-docstring, too-many-locals
@@ -0,0 +1,129 @@
+# pylint: disable=protected-access, missing-docstring
+import os
+import unittest
+
+from vprof import middleware
+from unittest import mock
+
+
+class ProfilingMiddlewareUnittest(unittest.TestCase):
+
+    def setUp(self):
+        self._uploader = mock.MagicMock()
+        self._app_calls = 0
+        self._middleware = None
+        random_patcher = mock.patch('random.random', return_value=0.0)
+        self._random = random_patcher.start()
+        self.addCleanup(random_patcher.stop)
+
+    def _create_middleware(self, **kwargs):
+        def app(environ, start_response):  # pylint: disable=unused-argument
+            self._app_calls += 1
+            self._middleware.sample()
+            return [b'foo']
+        self._middleware = middleware.ProfilingMiddleware(
+            app, uploader=self._uploader, **kwargs)
+        self._middleware._sampler = mock.MagicMock(interval=0.005)
+        return self._middleware
+
+    def _get_routes(self):
+        call_tree = self._uploader.submit.call_args[0][0]['c']['callStats']
+        self.assertEqual(call_tree['stack'], middleware._ROOT_FRAME)
+        return {child['stack'][0]: child['sampleCount']
+                for child in call_tree['children']}
+
+    def testCall_SampleRate(self):
+        self._random.side_effect = [0.1, 0.7, 0.49, 0.5]
+        mware = self._create_middleware(sample_rate=2)
+        for _ in range(4):
+            self.assertEqual(
+                mware({'PATH_INFO': '/foo'}, mock.MagicMock()), [b'foo'])
+        mware.flush()
+        self.assertEqual(self._app_calls, 4)
+        self.assertDictEqual(self._get_routes(), {'/foo': 2})
+        self.assertEqual(len(mware._requests), 0)
+
+    def testCall_NotSampled(self):
+        self._random.side_effect = [0.05, 0.5]
+        mware = self._create_middleware(sample_rate=10)
+        mware({'PATH_INFO': '/foo'}, mock.MagicMock())
+        mware({'PATH_INFO': '/bar'}, mock.MagicMock())
+        mware.flush()
+        self.assertDictEqual(self._get_routes(), {'/foo': 1})
+        mware._sampler.ensure_started.assert_called_once_with()
+
+    def testCall_RouteKey(self):
+        mware = self._create_middleware(
+            route_key=lambda environ: environ['PATH_INFO'].rsplit('/', 1)[0])
+        mware({'PATH_INFO': '/users/1'}, mock.MagicMock())
+        mware({'PATH_INFO': '/users/2'}, mock.MagicMock())
+        mware.flush()
+        self.assertDictEqual(self._get_routes(), {'/users': 2})
+
+    def testCall_MaxRoutes(self):
+        mware = self._create_middleware(max_routes=2)
+        for path in ('/foo', '/bar', '/baz', '/foo', '/qux'):
+            mware({'PATH_INFO': path}, mock.MagicMock())
+        mware.flush()
+        self.assertDictEqual(
+            self._get_routes(),
+            {'/foo': 2, '/bar': 1, middleware._OTHER_ROUTE: 2})
+
+    def testInit_BadSampleRate(self):
+        with self.assertRaises(ValueError):
+            middleware.ProfilingMiddleware(
+                mock.MagicMock(), sample_rate=0, uploader=self._uploader)
+
+    def testCall_LatencyThreshold(self):
+        self._random.side_effect = [0.05, 0.5, 0.5]
+        mware = self._create_middleware(sample_rate=10, latency_threshold=0)
+        mware({'PATH_INFO': '/foo'}, mock.MagicMock())
+        mware({'PATH_INFO': '/bar'}, mock.MagicMock())
+        mware({}, mock.MagicMock())
+        mware.flush()
+        self.assertDictEqual(
+            self._get_routes(), {'/foo': 1, '/bar': 1, '/': 1})
+
+    def testCall_BelowLatencyThreshold(self):
+        self._random.side_effect = [0.05, 0.5]
+        mware = self._create_middleware(sample_rate=10, latency_threshold=60)
+        mware({'PATH_INFO': '/foo'}, mock.MagicMock())
+        mware({'PATH_INFO': '/bar'}, mock.MagicMock())
+        mware.flush()
+        self.assertDictEqual(self._get_routes(), {'/foo': 1})
+
+    def testFlush_NoSamples(self):
+        mware = self._create_middleware()
+        mware.flush()
+        self._uploader.submit.assert_not_called()
+
+    def testFlush(self):
+        mware = self._create_middleware()
+        mware._sampler.interval = 0.01
+        mware({'PATH_INFO': '/foo'}, mock.MagicMock())
+        mware.flush()
+        stats = self._uploader.submit.call_args[0][0]['c']
+        self.assertEqual(stats['totalSamples'], 1)
+        self.assertEqual(stats['sampleInterval'], 0.01)
+        self.assertEqual(stats['runTime'], 0.01)
+
+    def testFlush_SendsNewSamples(self):
+        mware = self._create_middleware(sample_rate=1)
+        mware({'PATH_INFO': '/foo'}, mock.MagicMock())
+        mware.flush()
+        mware.flush()
+        self.assertEqual(self._uploader.submit.call_count, 1)
+        mware({'PATH_INFO': '/bar'}, mock.MagicMock())
+        mware.flush()
+        self.assertDictEqual(self._get_routes(), {'/bar': 1})
+
+    def testClose(self):
+        mware = middleware.ProfilingMiddleware(
+            mock.MagicMock(), uploader=self._uploader, sample_interval=0.001,
+            flush_interval=0)
+        mware._sampler.ensure_started()
+        thread = mware._sampler._threads[os.getpid()]
+        mware.close()
+        self.assertFalse(thread.is_alive())
+
+# pylint: enable=protected-access, missing-docstring
@@ -0,0 +1,137 @@
+# pylint: disable=protected-access, missing-docstring
+import json
+import os
+import tempfile
+import unittest
+
+from vprof import flame_graph
+from vprof import profile_file
+from unittest import mock
+
+
+def _to_json(value):
+    return json.loads(json.dumps(value))
+
+
+class ProfileFileUnittest(unittest.TestCase):
+
+    def setUp(self):
+        prof = flame_graph._StatProfiler()
+        prof.add_stack((('foo', 'a.py', 1), ('bar', 'b.py', 2),
+                        ('all', '', 0)), 3)
+        prof.add_stack((('baz', 'a.py', 5), ('bar', 'b.py', 2),
+                        ('all', '', 0)), 2)
+        self._call_tree = prof.call_tree
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._filename = os.path.join(self._tmp_dir.name, 'profile.vprof')
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def testEncodeSection(self):
+        stats = {
+            'objectName': 'foo.py',
+            'runTime': 0.5,
+            'missing': None,
+            'flags': [True, False],
+            'numbers': [0, -1, 2 ** 70],
+            'events': [[1, 10, 1.5, 'foo', 'a.py'],
+                       [2, 12, 2.5, 'bar', 'a.py'],
+                       [3, 9, 2.0, 'foo', 'b.py']],
+            'mixed': [[1, 2 ** 70, 'foo'], [None, -5, 1.5]],
+            'rows': [[1, 2], [3]],
+            'empty': [[], []],
+            'keys': {1: 'foo', 2.5: 'bar', None: 'baz', False: 'qux'},
+            'tuples': (('foo', 1), ('bar', 2)),
+        }
+        payload = profile_file.encode_section(stats)
+        self.assertEqual(
+            profile_file.decode_section(payload), _to_json(stats))
+
+    def testEncodeSection_CallTree(self):
+        stats = {'callStats': self._call_tree}
+        encoder = profile_file._Encoder()
+        encoder._write_value(self._call_tree)
+        self.assertEqual(encoder.getvalue()[0], profile_file._TREE_TAG)
+        self.assertEqual(
+            profile_file.decode_section(profile_file.encode_section(stats)),
+            _to_json(stats))
+
+    def testEncodeSection_ModifiedCallTree(self):
+        self._call_tree['children'][0]['samplePercentage'] = 1
+        encoder = profile_file._Encoder()
+        encoder._write_value(self._call_tree)
+        self.assertEqual(encoder.getvalue()[0], profile_file._DICT_TAG)
+        self.assertEqual(
+            profile_file.decode_section(
+                profile_file.encode_section(self._call_tree)),
+            _to_json(self._call_tree))
+
+    def testEncodeSection_UnsupportedType(self):
+        with self.assertRaises(TypeError):
+            profile_file.encode_section({'foo': object()})
+
+    def testDecodeSection_Corrupted(self):
+        payload = profile_file.encode_section({'foo': [1, 2, 3]})
+        with self.assertRaises(profile_file.FormatError):
+            profile_file.decode_section(payload[:-3])
+        with self.assertRaises(profile_file.FormatError):
+            profile_file.decode_section(
+                profile_file.zlib.compress(b'\x00\x07\x05'))
+
+    def testWriteRead(self):
+        with profile_file.ProfileWriter(self._filename, '0.38') as writer:
+            writer.write_section('c', {'callStats': self._call_tree})
+            writer.write_section('p', {'callStats': [[1, 'foo'], [2, 'bar']]})
+        self.assertTrue(profile_file.is_profile_file(self._filename))
+        with profile_file.ProfileReader(self._filename) as reader:
+            self.assertEqual(reader.version, '0.38')
+            self.assertListEqual(reader.sections, ['c', 'p'])
+            self.assertEqual(reader.read_section('p'),
+                             {'callStats': [[1, 'foo'], [2, 'bar']]})
+            self.assertEqual(reader.read_all(), {
+                'c': _to_json({'callStats': self._call_tree}),
+                'p': {'callStats': [[1, 'foo'], [2, 'bar']]}})
+
+    def testRead_NotProfileFile(self):
+        with open(self._filename, 'w') as outfile:
+            outfile.write('{"foo": "bar"}')
+        self.assertFalse(profile_file.is_profile_file(self._filename))
+        with self.assertRaises(profile_file.FormatError):
+            profile_file.ProfileReader(self._filename)
+
+    def testRead_EmptyFile(self):
+        open(self._filename, 'w').close()
+        with self.assertRaises(profile_file.FormatError):
+            profile_file.ProfileReader(self._filename)
+
+    def testLazyStats(self):
+        with profile_file.ProfileWriter(self._filename, '0.38') as writer:
+            writer.write_section('c', {'foo': 'bar'})
+            writer.write_section('p', {'bar': 'baz'})
+        reader = profile_file.ProfileReader(self._filename)
+        stats = profile_file.LazyStats(reader)
+        with mock.patch.object(
+                reader, 'read_section', wraps=reader.read_section) as read_mock:
+            prof_stats = stats['p']
+            self.assertEqual(prof_stats, {'bar': 'baz'})
+            self.assertIs(stats['p'], prof_stats)
+            read_mock.assert_called_once_with('p')
+        stats['version'] = '0.38'
+        stats['c'] = {'baz': 'qux'}
+        self.assertEqual(dict(stats), {
+            'p': {'bar': 'baz'}, 'version': '0.38', 'c': {'baz': 'qux'}})
+        del stats['p']
+        self.assertListEqual(list(stats), ['version', 'c'])
+        with self.assertRaises(KeyError):
+            stats['p']  # pylint: disable=pointless-statement
+        reader.close()
+
+    def testRead_UnfinishedFile(self):
+        writer = profile_file.ProfileWriter(self._filename, '0.38')
+        writer.write_section('c', {'foo': 'bar'})
+        writer._file.close()
+        with self.assertRaises(profile_file.FormatError):
+            profile_file.ProfileReader(self._filename)
+
+# pylint: enable=protected-access, missing-docstring
@@ -2,11 +2,13 @@
 # pylint: disable=missing-docstring, blacklisted-name
 import functools
 import gzip
+import http.client
 import json
 import inspect
 import threading
 import time
 import unittest
+import urllib.error
 import urllib.request
 
 from vprof import profiler
@@ -15,6 +17,7 @@ from vprof import runner
 from vprof.tests import test_pkg # pylint: disable=unused-import
 
 _HOST, _PORT = 'localhost', 12345
+_GZIP_HEADERS = {'Accept-Encoding': 'gzip'}
 _MODULE_FILENAME = 'vprof/tests/test_pkg/dummy_module.py'
 _PACKAGE_PATH = 'vprof/tests/test_pkg/'
 _POLL_INTERVAL = 0.01
@@ -26,7 +29,7 @@ class ProfilerModuleEndToEndTest(unittest.TestCase):
         program_stats = profiler.Profiler(
             _MODULE_FILENAME).run()
         stats_handler = functools.partial(
-            stats_server.StatsHandler, program_stats)
+            stats_server.StatsHandler, {'p': program_stats})
         self.server = stats_server.StatsServer(
             (_HOST, _PORT), stats_handler)
         threading.Thread(
@@ -38,8 +41,8 @@ class ProfilerModuleEndToEndTest(unittest.TestCase):
         self.server.server_close()
 
     def testRequest(self):
-        response = urllib.request.urlopen(
-            'http://%s:%s/profile' % (_HOST, _PORT))
+        response = urllib.request.urlopen(urllib.request.Request(
+            'http://%s:%s/profile/p' % (_HOST, _PORT), headers=_GZIP_HEADERS))
         response_data = gzip.decompress(response.read())
         stats = json.loads(response_data.decode('utf-8'))
         self.assertEqual(stats['objectName'], '%s (module)' % _MODULE_FILENAME)
@@ -48,6 +51,27 @@ class ProfilerModuleEndToEndTest(unittest.TestCase):
         self.assertTrue(stats['primitiveCalls'] > 0)
         self.assertTrue(stats['totalCalls'] > 0)
 
+    def testRequest_StaticFiles(self):
+        url = 'http://%s:%s/' % (_HOST, _PORT)
+        response = urllib.request.urlopen(url)
+        self.assertEqual(response.getheader('Cache-Control'), 'no-cache')
+        html = response.read().decode('utf-8')
+        self.assertIn('css/vprof.css?v=', html)
+        css_url = url + html.split('href="')[1].split('"')[0]
+        response = urllib.request.urlopen(urllib.request.Request(
+            css_url, headers=_GZIP_HEADERS))
+        self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+        self.assertIn('max-age', response.getheader('Cache-Control'))
+        self.assertIn(b'@import', gzip.decompress(response.read()))
+        last_modified = response.getheader('Last-Modified')
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(urllib.request.Request(
+                css_url, headers={'If-Modified-Since': last_modified}))
+        self.assertEqual(context.exception.code, 304)
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(url + '../stats_server.py')
+        self.assertEqual(context.exception.code, 404)
+
 
 class ProfilerPackageEndToEndTest(unittest.TestCase):
 
@@ -55,7 +79,7 @@ class ProfilerPackageEndToEndTest(unittest.TestCase):
         program_stats = profiler.Profiler(
             _PACKAGE_PATH).run()
         stats_handler = functools.partial(
-            stats_server.StatsHandler, program_stats)
+            stats_server.StatsHandler, {'p': program_stats})
         self.server = stats_server.StatsServer(
             (_HOST, _PORT), stats_handler)
         threading.Thread(
@@ -67,8 +91,8 @@ class ProfilerPackageEndToEndTest(unittest.TestCase):
         self.server.server_close()
 
     def testRequest(self):
-        response = urllib.request.urlopen(
-            'http://%s:%s/profile' % (_HOST, _PORT))
+        response = urllib.request.urlopen(urllib.request.Request(
+            'http://%s:%s/profile/p' % (_HOST, _PORT), headers=_GZIP_HEADERS))
         response_data = gzip.decompress(response.read())
         stats = json.loads(response_data.decode('utf-8'))
         self.assertEqual(stats['objectName'], '%s (package)' % _PACKAGE_PATH)
@@ -105,15 +129,114 @@ class ProfilerFunctionEndToEndTest(unittest.TestCase):
             self._func, 'p', ('foo', 'bar'), host=_HOST, port=_PORT)
         response = urllib.request.urlopen(
             'http://%s:%s/profile' % (_HOST, _PORT))
+        manifest = json.loads(response.read().decode('utf-8'))
+        self.assertDictEqual(manifest, {'version': 1, 'profilers': ['p']})
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen('http://%s:%s/profile/c' % (_HOST, _PORT))
+        self.assertEqual(context.exception.code, 404)
+
+        response = urllib.request.urlopen(urllib.request.Request(
+            'http://%s:%s/profile/p' % (_HOST, _PORT), headers=_GZIP_HEADERS))
         response_data = gzip.decompress(response.read())
         stats = json.loads(response_data.decode('utf-8'))
         curr_filename = inspect.getabsfile(inspect.currentframe())
-        self.assertEqual(stats['p']['objectName'],
+        self.assertEqual(stats['objectName'],
                          '_func @ %s (function)' % curr_filename)
-        self.assertTrue(len(stats['p']['callStats']) > 0)
-        self.assertTrue(stats['p']['totalTime'] > 0)
-        self.assertTrue(stats['p']['primitiveCalls'] > 0)
+        self.assertTrue(len(stats['callStats']) > 0)
+        self.assertTrue(stats['totalTime'] > 0)
+        self.assertTrue(stats['primitiveCalls'] > 0)
+        self.assertTrue(stats['totalCalls'] > 0)
+        self.assertEqual(
+            stats['totalRecords'], len(stats['callStats']))
+
+        response = urllib.request.urlopen(urllib.request.Request(
+            'http://%s:%s/profile/p?sort=function&limit=1&filter=_func' % (
+                _HOST, _PORT), headers=_GZIP_HEADERS))
+        response_data = gzip.decompress(response.read())
+        page = json.loads(response_data.decode('utf-8'))
+        self.assertEqual(len(page['callStats']), 1)
+        self.assertEqual(page['callStats'][0][2], '_func')
+
+    def testRequest_AsyncUploader(self):
+        uploader = runner.AsyncUploader(host=_HOST, port=_PORT)
+        for _ in range(3):
+            runner.run(
+                self._func, 'p', ('foo', 'bar'), uploader=uploader)
+        uploader.flush()
+        self.assertEqual(uploader.dropped_count, 0)
+        response = urllib.request.urlopen(urllib.request.Request(
+            'http://%s:%s/profile/p' % (_HOST, _PORT), headers=_GZIP_HEADERS))
+        response_data = gzip.decompress(response.read())
+        stats = json.loads(response_data.decode('utf-8'))
+        self.assertTrue(stats['totalCalls'] > 0)
+
+    def testRequest_Cached(self):
+        runner.run(
+            self._func, 'p', ('foo', 'bar'), host=_HOST, port=_PORT)
+        url = 'http://%s:%s/profile/p' % (_HOST, _PORT)
+        response = urllib.request.urlopen(url)
+        self.assertIsNone(response.getheader('Content-Encoding'))
+        stats = json.loads(response.read().decode('utf-8'))
+        self.assertTrue(stats['totalCalls'] > 0)
+        etag = response.getheader('ETag')
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(urllib.request.Request(
+                url, headers={'If-None-Match': etag}))
+        self.assertEqual(context.exception.code, 304)
+
+        runner.run(
+            self._func, 'p', ('foo', 'bar'), host=_HOST, port=_PORT)
+        response = urllib.request.urlopen(urllib.request.Request(
+            url, headers={'If-None-Match': etag}))
+        self.assertNotEqual(response.getheader('ETag'), etag)
+
+    def testRequest_Sessions(self):
+        for session in ('worker-1', 'worker-2', 'worker-1', None):
+            runner.run(self._func, 'p', ('foo', 'bar'), host=_HOST,
+                       port=_PORT, session=session)
+        response = urllib.request.urlopen(
+            'http://%s:%s/sessions' % (_HOST, _PORT))
+        sessions = json.loads(response.read().decode('utf-8'))['sessions']
+        self.assertEqual(len(sessions), 3)
+        self.assertEqual(
+            [(info['id'], info['uploads']) for info in sessions[1:]],
+            [('worker-1', 2), ('worker-2', 1)])
+        self.assertEqual(sessions[1]['profilers'], ['p'])
+
+        response = urllib.request.urlopen(
+            'http://%s:%s/sessions/worker-2' % (_HOST, _PORT))
+        stats = json.loads(response.read().decode('utf-8'))
         self.assertTrue(stats['p']['totalCalls'] > 0)
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(
+                'http://%s:%s/sessions/worker-3' % (_HOST, _PORT))
+        self.assertEqual(context.exception.code, 404)
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            runner.run(self._func, 'p', ('foo', 'bar'), host=_HOST,
+                       port=_PORT, session='../foo')
+        self.assertEqual(context.exception.code, 400)
+
+    def testRequest_Events(self):
+        connection = http.client.HTTPConnection(_HOST, _PORT, timeout=10)
+        connection.request('GET', '/events')
+        response = connection.getresponse()
+        self.assertEqual(
+            response.getheader('Content-Type'), 'text/event-stream')
+        self.assertEqual(response.readline(), b'id: 0\n')
+        self.assertEqual(response.readline(), b'event: profile\n')
+        self.assertEqual(
+            json.loads(response.readline()[len('data: '):].decode('utf-8')),
+            {'version': 0, 'profilers': []})
+        self.assertEqual(response.readline(), b'\n')
+
+        runner.run(
+            self._func, 'p', ('foo', 'bar'), host=_HOST, port=_PORT)
+        self.assertEqual(response.readline(), b'id: 1\n')
+        self.assertEqual(response.readline(), b'event: profile\n')
+        self.assertEqual(
+            json.loads(response.readline()[len('data: '):].decode('utf-8')),
+            {'version': 1, 'profilers': ['p']})
+        connection.close()
 
 
 # pylint: enable=missing-docstring, blacklisted-name
@@ -1,4 +1,6 @@
 # pylint: disable=protected-access, missing-docstring
+import cProfile
+import pstats
 import unittest
 
 from vprof import profiler
@@ -30,4 +32,76 @@ class ProfilerUnittest(unittest.TestCase):
         self.assertListEqual(
             self._profiler._transform_stats(prof), expected_results)
 
+    def testTransformCallGraph(self):
+        prof = mock.MagicMock()
+        func1, func2 = ('fname1', 1, 'func1'), ('fname1', 5, 'func2')
+        func3 = ('fname2', 11, '<func3>')
+        # Caller stats are (number of calls, primitive calls, total time,
+        # cumulative time) in pstats.
+        prof.stats = {
+            func1: (5, 10, 0.001, 0.01, {}),
+            func2: (10, 15, 0.002, 0.02, {func1: (15, 10, 0.002, 0.02)}),
+            func3: (15, 20, 0.003, 0.045, {
+                func1: (5, 5, 0.001, 0.015),
+                func2: (15, 10, 0.00201, 0.03),
+                ('unknown', 1, 'func4'): (1, 1, 0.1, 0.1)}),
+        }
+        call_stats = [func3 + (0.045,), func2 + (0.02,), func1 + (0.01,)]
+        self.assertListEqual(
+            self._profiler._transform_call_graph(prof, call_stats),
+            [(1, 0, 10, 15, 0.002, 0.03),
+             (2, 0, 5, 5, 0.001, 0.015),
+             (2, 1, 10, 15, 0.002, 0.02)])
+
+    def testTransformCallGraph_Recursive(self):
+        def fact(n):
+            return 1 if n <= 1 else n * fact(n - 1)
+
+        prof = cProfile.Profile()
+        prof.runcall(fact, 5)
+        prof_stats = pstats.Stats(prof)
+        call_stats = self._profiler._transform_stats(prof_stats)
+        names = [record[2] for record in call_stats]
+        edges = {
+            (names[caller], names[callee]): (prim_calls, num_calls)
+            for caller, callee, prim_calls, num_calls, _, _ in (
+                self._profiler._transform_call_graph(prof_stats, call_stats))}
+        self.assertEqual(edges[('fact', 'fact')], (1, 4))
+
+    def testTransformRunStats(self):
+        call_stats = [('fname1', 1, 'func1', 0.3), ('fname1', 5, 'func2', 0.1)]
+        run_times = [
+            {('fname1', 1, 'func1'): 0.1, ('fname1', 5, 'func2'): 0.1},
+            {('fname1', 1, 'func1'): 0.2},
+        ]
+        self.assertListEqual(
+            self._profiler._transform_run_stats(run_times, call_stats),
+            [(0.15, 0.1, 0.05), (0.05, 0, 0.05)])
+
+    def testProfileRuns(self):
+        self._profiler._repeat, self._profiler._warmup = 3, 2
+        self._profiler._timer = 'default'
+        func = mock.MagicMock(side_effect=[1, 2, 3, 4, 5])
+        prof_stats, run_times, result = self._profiler._profile_runs(
+            func, 'foo', bar='baz')
+        self.assertEqual(func.call_count, 5)
+        func.assert_called_with('foo', bar='baz')
+        self.assertEqual(result, 5)
+        self.assertEqual(len(run_times), 3)
+        self.assertTrue(prof_stats.total_calls > 0)
+
+    def testCreateProfile(self):
+        for timer in profiler.TIMERS:
+            self._profiler._timer = timer
+            prof = self._profiler._create_profile()
+            prof.enable()
+            sum(range(1000))
+            prof.disable()
+            stats = profiler.pstats.Stats(prof)
+            self.assertTrue(0 <= stats.total_tt < 1)
+
+    def testInit_UnknownTimer(self):
+        with self.assertRaises(ValueError):
+            profiler.Profiler('foo.py', timer='foo')
+
 # pylint:  enable=protected-access, missing-docstring
@@ -0,0 +1,99 @@
+# pylint: disable=protected-access, missing-docstring
+import json
+import os
+import signal
+import tempfile
+import threading
+import unittest
+
+from vprof import profiling_window
+from unittest import mock
+
+
+class ProfilingWindowUnittest(unittest.TestCase):
+
+    def setUp(self):
+        self._uploader = mock.MagicMock()
+        self._window = profiling_window.ProfilingWindow(
+            sample_interval=0.001, uploader=self._uploader)
+
+    def testSample(self):
+        prof = mock.MagicMock()
+        sampler = threading.Thread(
+            target=profiling_window.ProfilingWindow._sample, args=(prof,))
+        sampler.start()
+        sampler.join()
+        stacks = [call[0][0] for call in prof.add_stack.call_args_list]
+        stack = next(stack for stack in stacks
+                     if 'testSample' in (frame[0] for frame in stack))
+        self.assertEqual(stack[-1], profiling_window._ROOT_FRAME)
+        self.assertEqual(prof.add_stack.call_args[0][1], 1)
+        self.assertNotIn('_sample', [stack[0][0] for stack in stacks])
+
+    def testStart_Duration(self):
+        self.assertTrue(self._window.start(duration=0.05))
+        self.assertTrue(self._window.active)
+        self.assertFalse(self._window.start())
+        self._window.join(5)
+        self.assertFalse(self._window.active)
+        stats = self._uploader.submit.call_args[0][0]['c']
+        self.assertEqual(stats['sampleInterval'], 0.001)
+        self.assertGreaterEqual(stats['runTime'], 0.05)
+        self.assertGreater(stats['totalSamples'], 0)
+        self.assertEqual(
+            stats['callStats']['stack'], profiling_window._ROOT_FRAME)
+
+    def testStop(self):
+        self._window.start()
+        self._window.stop()
+        self._window.join(5)
+        self.assertFalse(self._window.active)
+        self._uploader.submit.assert_called_once_with(mock.ANY)
+
+    def testStop_DuringDelay(self):
+        self._window.start(delay=60)
+        self._window.stop()
+        self._window.join(5)
+        self.assertFalse(self._window.active)
+        self._uploader.submit.assert_not_called()
+
+    def testToggle(self):
+        self._window.toggle()
+        self.assertTrue(self._window.active)
+        self._window.toggle()
+        self._window.join(5)
+        self.assertFalse(self._window.active)
+        self._uploader.submit.assert_called_once_with(mock.ANY)
+
+    def testSave_OutputFile(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            window = profiling_window.ProfilingWindow(
+                output_file=os.path.join(tmp_dir, 'window_{pid}.json'))
+            window.start(duration=0.01)
+            window.join(5)
+            filename = os.path.join(tmp_dir, 'window_%s.json' % os.getpid())
+            with open(filename) as infile:
+                run_stats = json.loads(infile.read())
+        self.assertIn('version', run_stats)
+        self.assertIn('Profiling window', run_stats['c']['objectName'])
+
+    @unittest.skipUnless(hasattr(signal, 'SIGUSR1'), 'SIGUSR1 required')
+    @unittest.skipUnless(
+        threading.current_thread() is threading.main_thread(),
+        'Signal handlers can be installed only from main thread')
+    def testInstallSignalHandlers(self):
+        handlers = (signal.getsignal(signal.SIGUSR1),
+                    signal.getsignal(signal.SIGUSR2))
+        try:
+            profiling_window.install_signal_handlers(self._window)
+            os.kill(os.getpid(), signal.SIGUSR1)
+            self.assertTrue(self._window.active)
+            os.kill(os.getpid(), signal.SIGUSR2)
+            self._window.join(5)
+            self.assertFalse(self._window.active)
+        finally:
+            signal.signal(signal.SIGUSR1, handlers[0])
+            signal.signal(signal.SIGUSR2, handlers[1])
+        self._uploader.submit.assert_called_once_with(mock.ANY)
+
+# pylint: enable=protected-access, missing-docstring
@@ -1,4 +1,6 @@
 # pylint: disable=protected-access, missing-docstring
+import http.client
+import socket
 import unittest
 
 from vprof import runner
@@ -37,4 +39,126 @@ class RunnerUnittest(unittest.TestCase):
             'p': {'total': 500}
         })
 
+    def testRunProfilers_BadRepeat(self):
+        with self.assertRaises(runner.BadOptionError):
+            runner.run_profilers('foo.py', 'p', repeat=0)
+        with self.assertRaises(runner.BadOptionError):
+            runner.run_profilers('foo.py', 'p', warmup=-1)
+        with self.assertRaises(runner.BadOptionError):
+            runner.run_profilers('foo.py', 'p', timer='foo')
+
+    @mock.patch('os.path.isdir')
+    def testRunProfilers_Parallel(self, isdir_mock):
+        isdir_mock.return_value = True
+        prof1, prof2 = mock.MagicMock(), mock.MagicMock()
+        prof1.return_value.run.return_value = {'foo': 'bar'}
+        prof2.return_value.run.return_value = {'bar': 'baz'}
+        with mock.patch.object(runner, 'load_profilers') as load_mock:
+            load_mock.return_value = [('c', prof1), ('p', prof2)]
+            result = runner.run_profilers('foo', 'pc', parallel=True)
+        self.assertEqual(list(result.items()),
+                         [('c', {'foo': 'bar'}), ('p', {'bar': 'baz'})])
+        prof2.assert_called_with(
+            'foo', repeat=1, warmup=0, timer='default')
+
+    @mock.patch('os.path.isdir')
+    def testRunProfilers_StatsCallback(self, isdir_mock):
+        isdir_mock.return_value = True
+        prof1, prof2 = mock.MagicMock(), mock.MagicMock()
+        prof1.return_value.run.return_value = {'foo': 'bar'}
+        prof2.return_value.run.return_value = {'bar': 'baz'}
+        callback = mock.MagicMock()
+        with mock.patch.object(runner, 'load_profilers') as load_mock:
+            load_mock.return_value = [('c', prof1), ('p', prof2)]
+            runner.run_profilers('foo', 'pc', stats_callback=callback)
+        callback.assert_has_calls(
+            [mock.call('c', {'foo': 'bar'}), mock.call('p', {'bar': 'baz'})])
+
+    @mock.patch('vprof.runner.run_profilers')
+    def testRun_Uploader(self, run_mock):
+        run_mock.return_value = {'p': {'result': 'foobar', 'total': 500}}
+        uploader = mock.MagicMock()
+        result = runner.run(lambda: 1, 'p', uploader=uploader)
+        self.assertEqual(result, 'foobar')
+        uploader.submit.assert_called_with({'p': {'total': 500}})
+
+
+class AsyncUploaderUnittest(unittest.TestCase):
+
+    def setUp(self):
+        self._uploader = object.__new__(runner.AsyncUploader)
+        self._uploader._connection = runner._UploadConnection(
+            'foo', 8000, 1, '/')
+        self._uploader._max_batch_size = 2
+        self._uploader._queue = runner.queue.Queue(maxsize=3)
+        self._uploader._dropped_count = 0
+        self._uploader._dropped_lock = runner.threading.Lock()
+
+    def testSubmit_Full(self):
+        for i in range(5):
+            self._uploader.submit({'p': i})
+        self.assertEqual(self._uploader._queue.qsize(), 3)
+        self.assertEqual(self._uploader.dropped_count, 2)
+
+    def testGetBatch(self):
+        for i in range(3):
+            self._uploader.submit({'p': i})
+        self.assertEqual(self._uploader._get_batch(), [{'p': 0}, {'p': 1}])
+        self.assertEqual(self._uploader._get_batch(), [{'p': 2}])
+
+    @mock.patch('http.client.HTTPConnection')
+    def testUpload(self, conn_mock):
+        conn_mock.return_value.getresponse.return_value.status = 200
+        self._uploader._upload([{'p': 1}])
+        self._uploader._upload([{'p': 2}])
+        conn_mock.assert_called_once_with('foo', 8000, timeout=1)
+        self.assertEqual(conn_mock.return_value.request.call_count, 2)
+
+    @mock.patch('http.client.HTTPConnection')
+    def testUpload_Session(self, conn_mock):
+        conn_mock.return_value.getresponse.return_value.status = 200
+        self._uploader._connection._upload_uri = runner._get_upload_uri(
+            'worker-1')
+        self._uploader._upload([{'p': 1}])
+        self.assertEqual(
+            conn_mock.return_value.request.call_args[0][:2],
+            ('POST', '/?session=worker-1'))
+
+    @mock.patch('http.client.HTTPConnection')
+    def testUpload_Reconnect(self, conn_mock):
+        conn_mock.return_value.getresponse.return_value.status = 200
+        conn_mock.return_value.request.side_effect = [
+            ConnectionResetError(), None]
+        self._uploader._upload([{'p': 1}])
+        self.assertEqual(conn_mock.call_count, 2)
+
+    @mock.patch('http.client.HTTPConnection')
+    def testUpload_Disconnected(self, conn_mock):
+        conn_mock.return_value.getresponse.side_effect = [
+            http.client.RemoteDisconnected(), mock.MagicMock(status=200)]
+        self._uploader._upload([{'p': 1}])
+        self.assertEqual(conn_mock.return_value.request.call_count, 2)
+
+    @mock.patch('http.client.HTTPConnection')
+    def testUpload_ErrorStatus(self, conn_mock):
+        conn_mock.return_value.getresponse.return_value.status = 500
+        with self.assertRaises(http.client.HTTPException):
+            self._uploader._upload([{'p': 1}])
+        conn_mock.return_value.request.assert_called_once()
+
+    @mock.patch('http.client.HTTPConnection')
+    def testUpload_Timeout(self, conn_mock):
+        conn_mock.return_value.getresponse.side_effect = socket.timeout()
+        with self.assertRaises(socket.timeout):
+            self._uploader._upload([{'p': 1}])
+        conn_mock.return_value.request.assert_called_once()
+        self.assertIsNone(self._uploader._connection._conn)
+
+    @mock.patch('http.client.HTTPConnection')
+    def testUpload_ServerDown(self, conn_mock):
+        conn_mock.return_value.request.side_effect = ConnectionRefusedError()
+        with self.assertRaises(ConnectionRefusedError):
+            self._uploader._upload([{'p': 1}])
+        self.assertIsNone(self._uploader._connection._conn)
+
 # pylint:  enable=protected-access, missing-docstring
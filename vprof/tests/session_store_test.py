@@ -0,0 +1,151 @@
+# pylint: disable=protected-access, missing-docstring
+import os
+import tempfile
+import threading
+import unittest
+
+from vprof import profile_file
+from vprof import session_store
+from unittest import mock
+
+
+class SessionStoreUnittest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._store = session_store.SessionStore(
+            directory=self._tmp_dir.name, max_memory_size=100,
+            max_disk_size=10 ** 6)
+
+    def tearDown(self):
+        self._store.close()
+        self._tmp_dir.cleanup()
+
+    def testIsValidSessionId(self):
+        self.assertTrue(session_store.is_valid_session_id('worker-1.a_b'))
+        self.assertFalse(session_store.is_valid_session_id(''))
+        self.assertFalse(session_store.is_valid_session_id('../foo'))
+        self.assertFalse(session_store.is_valid_session_id('foo bar'))
+        self.assertFalse(session_store.is_valid_session_id('a' * 129))
+
+    def testAdd(self):
+        self._store.add('foo', {'c': {'foo': 1}, 'p': {'bar': 2}}, 20)
+        self._store.add('foo', {'p': {'bar': 3}}, 30)
+        self._store.add('bar', {'m': {'baz': 4}}, 10)
+        self.assertEqual(
+            self._store.get('foo'), {'c': {'foo': 1}, 'p': {'bar': 3}})
+        self.assertEqual(self._store.get('bar'), {'m': {'baz': 4}})
+        self.assertIsNone(self._store.get('baz'))
+        self.assertEqual(self._store._memory_size, 50)
+        sessions = self._store.list_sessions()
+        self.assertEqual([info['id'] for info in sessions], ['bar', 'foo'])
+        self.assertEqual(sessions[1]['profilers'], ['c', 'p'])
+        self.assertEqual(sessions[1]['uploads'], 2)
+        self.assertEqual(sessions[1]['size'], 40)
+        self.assertFalse(sessions[1]['spilled'])
+
+    def testGet_ReturnsCopy(self):
+        self._store.add('foo', {'c': {'foo': 1}}, 10)
+        stats = self._store.get('foo')
+        self._store.add('foo', {'p': {'bar': 2}}, 10)
+        self.assertEqual(stats, {'c': {'foo': 1}})
+
+    def testAdd_BadSessionId(self):
+        with self.assertRaises(session_store.BadSessionIdError):
+            self._store.add('../foo', {'c': {}}, 10)
+
+    def testSpill(self):
+        self._store.add('foo', {'c': {'foo': [1, 2, 3]}}, 60)
+        self._store.add('bar', {'c': {'bar': 'baz'}}, 60)
+        self.assertEqual(self._store._memory_size, 60)
+        sessions = {info['id']: info for info in self._store.list_sessions()}
+        self.assertTrue(sessions['foo']['spilled'])
+        self.assertFalse(sessions['bar']['spilled'])
+        self.assertEqual(len(os.listdir(self._tmp_dir.name)), 1)
+
+        self.assertEqual(self._store.get('foo'), {'c': {'foo': [1, 2, 3]}})
+        sessions = {info['id']: info for info in self._store.list_sessions()}
+        self.assertFalse(sessions['foo']['spilled'])
+        self.assertTrue(sessions['bar']['spilled'])
+        self.assertEqual(self._store._memory_size, 60)
+
+    def testLoad_DoesNotBlockOtherSessions(self):
+        self._store.add('foo', {'c': {'foo': 1}}, 60)
+        self._store.add('bar', {'c': {'bar': 2}}, 60)
+        reading, release = threading.Event(), threading.Event()
+        results = {}
+        read_all = profile_file.ProfileReader.read_all
+
+        def slow_read_all(reader):
+            reading.set()
+            release.wait(5)
+            return read_all(reader)
+
+        def get(session_id):
+            results.setdefault(session_id, []).append(
+                self._store.get(session_id))
+
+        threads = [threading.Thread(target=get, args=('foo',))
+                   for _ in range(2)]
+        with mock.patch.object(profile_file.ProfileReader,
+                               'read_all', slow_read_all):
+            threads[0].start()
+            self.assertTrue(reading.wait(5))
+            threads[1].start()
+            self.assertEqual(self._store.get('bar'), {'c': {'bar': 2}})
+            self.assertIn('foo', self._store._loading)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+        self.assertEqual(results['foo'], [{'c': {'foo': 1}}] * 2)
+        self.assertEqual(self._store._loading, set())
+
+    def testLoad_UnreadableFile(self):
+        self._store.add('foo', {'c': {'foo': 1}}, 60)
+        self._store.add('bar', {'c': {'bar': 2}}, 60)
+        filename = self._store._sessions['foo'].filename
+        with open(filename, 'wb'):
+            pass
+        self.assertIsNone(self._store.get('foo'))
+        self.assertNotIn('foo', self._store)
+        self.assertFalse(os.path.exists(filename))
+        self.assertEqual(self._store._spill_dir.size, 0)
+
+    def testSpill_CanceledByUpload(self):
+        with mock.patch.object(self._store, '_write_spills') as write_spills:
+            self._store.add('foo', {'c': {'foo': 1}}, 60)
+            self._store.add('bar', {'c': {'bar': 2}}, 60)
+        spills = write_spills.call_args[0][0]
+        self.assertEqual(
+            [spill.session.session_id for spill in spills], ['foo'])
+        self.assertEqual(self._store._memory_size, 60)
+        # Session is updated while it's written to disk.
+        self._store.add('foo', {'c': {'foo': 3}}, 30)
+        self._store._write_spills(spills)
+        sessions = {info['id']: info for info in self._store.list_sessions()}
+        self.assertFalse(sessions['foo']['spilled'])
+        self.assertEqual(self._store.get('foo'), {'c': {'foo': 3}})
+        self.assertEqual(self._store._memory_size, 90)
+        self.assertEqual(os.listdir(self._tmp_dir.name), [])
+
+    def testSpill_DiskLimit(self):
+        self._store._spill_dir.max_size = 0
+        self._store.add('foo', {'c': {'foo': 1}}, 60)
+        self._store.add('bar', {'c': {'bar': 2}}, 60)
+        self.assertNotIn('foo', self._store)
+        self.assertEqual(len(self._store), 1)
+        self.assertEqual(os.listdir(self._tmp_dir.name), [])
+        self.assertEqual(self._store._spill_dir.size, 0)
+
+    def testClose_TemporaryDirectory(self):
+        store = session_store.SessionStore(max_memory_size=0)
+        store.add('foo', {'c': {'foo': 1}}, 10)
+        store.add('bar', {'c': {'bar': 2}}, 10)
+        directory = store._spill_dir.path
+        self.assertTrue(os.path.isdir(directory))
+        store.close()
+        self.assertFalse(os.path.exists(directory))
+        self.assertEqual(
+            [info['id'] for info in store.list_sessions()], ['bar'])
+
+# pylint: enable=protected-access, missing-docstring
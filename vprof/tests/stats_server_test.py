@@ -0,0 +1,211 @@
+# pylint: disable=protected-access, missing-docstring
+import gzip
+import os
+import tempfile
+import unittest
+
+from vprof import stats_server
+
+
+class CallStatsIndexUnittest(unittest.TestCase):
+
+    def setUp(self):
+        self._stats = {
+            'callStats': [
+                ['fname2', 11, '<func3>', 0.045, 60.0, 20],
+                ['fname1', 5, 'func2', 0.02, 26.6667, 15],
+                ['fname1', 1, 'func1', 0.01, 13.3333, 10],
+            ],
+            'callGraph': [
+                [1, 0, 10, 15, 0.002, 0.03],
+                [2, 0, 5, 5, 0.001, 0.015],
+                [2, 1, 10, 15, 0.002, 0.02],
+                [2, 2, 1, 4, 0.0005, 0.008],
+            ],
+            'runStats': [[0.045, 0.04, 0.001], [0.02, 0.01, 0.001],
+                         [0.01, 0.01, 0]],
+        }
+        self._index = stats_server.CallStatsIndex(self._stats)
+
+    def testGetPage_Default(self):
+        page = self._index.get_page(limit=2)
+        self.assertEqual(page['funcIds'], [0, 1])
+        self.assertEqual(page['totalRecords'], 3)
+        self.assertEqual(page['callStats'], self._stats['callStats'][:2])
+        self.assertEqual(page['runStats'], self._stats['runStats'][:2])
+        self.assertEqual(
+            page['callers'],
+            [[['func2', 5, 15, 0.03], ['func1', 1, 5, 0.015]],
+             [['func1', 1, 15, 0.02]]])
+
+    def testGetPage_Sort(self):
+        page = self._index.get_page(sort='function', offset=1, limit=5)
+        self.assertEqual(page['funcIds'], [2, 1])
+        self.assertEqual(page['offset'], 1)
+        page = self._index.get_page(sort='-line')
+        self.assertEqual(page['funcIds'], [0, 1, 2])
+        self.assertEqual(page['callers'][2], [['func1', 1, 4, 0.008]])
+
+    def testGetPage_Filter(self):
+        page = self._index.get_page(name_filter='FNAME1')
+        self.assertEqual(page['funcIds'], [1, 2])
+        self.assertEqual(page['totalRecords'], 2)
+        page = self._index.get_page(name_filter='func3')
+        self.assertEqual(page['funcIds'], [0])
+
+
+class StatsServerUnittest(unittest.TestCase):
+
+    def testAcceptsGzip(self):
+        self.assertTrue(stats_server._accepts_gzip(None))
+        self.assertTrue(stats_server._accepts_gzip('gzip, deflate, br'))
+        self.assertTrue(stats_server._accepts_gzip('deflate, *'))
+        self.assertTrue(stats_server._accepts_gzip('GZIP;q=0.5'))
+        self.assertFalse(stats_server._accepts_gzip('identity'))
+        self.assertFalse(stats_server._accepts_gzip(''))
+        self.assertFalse(stats_server._accepts_gzip('gzip;q=0'))
+        self.assertFalse(stats_server._accepts_gzip('gzip;q=foo'))
+
+    def testResponse(self):
+        response = stats_server._Response(b'foo', 'text/json')
+        self.assertEqual(
+            response.etag, stats_server._Response(b'foo', 'text/json').etag)
+        self.assertNotEqual(
+            response.etag, stats_server._Response(b'bar', 'text/json').etag)
+        self.assertIsNone(response.compressed_content)
+        response = stats_server._Response(b'foo' * 100, 'text/json')
+        compressed_content = response.compressed_content
+        self.assertEqual(gzip.decompress(compressed_content), b'foo' * 100)
+        self.assertIs(response.compressed_content, compressed_content)
+
+    def testResponseCache(self):
+        cache = stats_server._ResponseCache(max_count=2, max_size=250)
+        responses = [stats_server._Response(b'x' * 100, 'text/json')
+                     for _ in range(3)]
+        cache.put('/a', responses[0])
+        cache.put('/b', responses[1])
+        self.assertIs(cache.get('/a'), responses[0])
+        cache.put('/c', responses[2])
+        self.assertIsNone(cache.get('/b'))
+        self.assertEqual(cache.size, 200)
+        cache.put('/d', stats_server._Response(b'x' * 300, 'text/json'))
+        self.assertIsNone(cache.get('/d'))
+        self.assertEqual(len(cache), 2)
+
+    def testResponseCache_MaxSize(self):
+        cache = stats_server._ResponseCache(max_count=10, max_size=250)
+        for path in ('/a', '/b', '/c'):
+            cache.put(path, stats_server._Response(b'x' * 100, 'text/json'))
+        self.assertIsNone(cache.get('/a'))
+        self.assertIsNotNone(cache.get('/c'))
+        self.assertEqual(cache.size, 200)
+        cache.clear()
+        self.assertEqual((len(cache), cache.size), (0, 0))
+
+    def testLoadStaticFiles(self):
+        with tempfile.TemporaryDirectory() as static_dir:
+            for path, content in (
+                    ('profile.html', b'<script src="main.js"></script>'
+                                     b'<link href="css/main.css">'
+                                     b'<a href="http://foo/bar.js"></a>'),
+                    ('main.js', b'foo();' * 100),
+                    ('main.js.gz', gzip.compress(b'bar();')),
+                    ('css/main.css', b'body {}'),
+                    ('__tests__/main_test.js', b'test();')):
+                path = os.path.join(static_dir, path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as res_file:
+                    res_file.write(content)
+            static_files = stats_server.load_static_files(static_dir)
+
+        self.assertListEqual(
+            sorted(static_files),
+            ['/css/main.css', '/main.js', '/profile.html'])
+        main_js = static_files['/main.js']
+        self.assertTrue(main_js.content_type.endswith('javascript'))
+        self.assertEqual(main_js.content, b'foo();' * 100)
+        self.assertEqual(
+            gzip.decompress(main_js.compressed_content), b'bar();')
+        self.assertIsNotNone(main_js.last_modified)
+        self.assertEqual(static_files['/css/main.css'].content_type,
+                         'text/css')
+        html = static_files['/profile.html']
+        self.assertEqual(html.content_type, 'text/html')
+        self.assertEqual(
+            html.content.decode(),
+            '<script src="main.js?v=%s"></script>'
+            '<link href="css/main.css?v=%s">'
+            '<a href="http://foo/bar.js"></a>' % (
+                main_js.fingerprint,
+                static_files['/css/main.css'].fingerprint))
+
+
+class ProfileStateMixInUnittest(unittest.TestCase):
+
+    def setUp(self):
+        self._state = stats_server.ProfileStateMixIn()
+        self._state.init_profile_state()
+
+    def tearDown(self):
+        self._state.close_profile_state()
+
+    @staticmethod
+    def _get_upload(object_name, sample_count):
+        return {'c': {
+            'objectName': object_name, 'runTime': 1.0,
+            'callStats': {'stack': ['main', 'foo.py', 1],
+                          'sampleCount': sample_count, 'children': []}}}
+
+    def testAddUploads_AggregatesCallTrees(self):
+        profile_json = {}
+        uploads = [self._get_upload('foo', 2), self._get_upload('bar', 5)]
+        self._state.add_uploads(profile_json, uploads, 'session', 100)
+        self._state.add_uploads(
+            profile_json, [self._get_upload('foo', 3)], 'session', 100)
+        self.assertListEqual(
+            self._state.call_tree_aggregates.list_aggregates(),
+            [{'name': 'foo', 'uploads': 2}, {'name': 'bar', 'uploads': 1}])
+        self.assertEqual(
+            profile_json['c'].get_stats()['totalSamples'], 5)
+        self.assertEqual(
+            self._state.get_aggregate_stats('bar')['totalSamples'], 5)
+        self.assertIsNone(self._state.get_aggregate_stats('baz'))
+        self.assertEqual(self._state.profile_version, 2)
+        # Sessions keep uploaded stats.
+        self.assertEqual(
+            self._state.session_store.get('session')['c']['callStats'][
+                'sampleCount'], 3)
+
+    def testAddUploads_MalformedCallTree(self):
+        profile_json = {}
+        upload = {'c': {'objectName': 'foo', 'callStats': {'stack': 'x'}}}
+        with self.assertRaises(ValueError):
+            self._state.add_uploads(profile_json, [upload], 'session', 100)
+        self.assertDictEqual(profile_json, {})
+        self.assertEqual(self._state.profile_version, 1)
+
+    def testAddUploads_EmptyCallTree(self):
+        profile_json = {}
+        empty_upload = {'c': {'objectName': 'foo', 'callStats': {}}}
+        self._state.add_uploads(
+            profile_json, [self._get_upload('foo', 2), empty_upload],
+            'session', 100)
+        self._state.add_uploads(profile_json, [empty_upload], 'session', 100)
+        stats = profile_json['c'].get_stats()
+        self.assertEqual(stats['totalSamples'], 2)
+        self.assertEqual(stats['uploads'], 3)
+        self.assertListEqual(
+            self._state.call_tree_aggregates.list_aggregates(),
+            [{'name': 'foo', 'uploads': 3}])
+        self.assertEqual(
+            self._state.get_aggregate_stats('foo')['totalSamples'], 2)
+
+    def testAddUploads_NoCallTree(self):
+        profile_json = {}
+        upload = {'h': {'foo': 1}}
+        self._state.add_uploads(profile_json, [upload], 'session', 100)
+        self.assertDictEqual(profile_json, upload)
+        self.assertListEqual(
+            self._state.call_tree_aggregates.list_aggregates(), [])
+
+# pylint: enable=protected-access, missing-docstring
@@ -0,0 +1,102 @@
+# pylint: disable=protected-access, missing-docstring
+import os
+import socket
+import stat
+import tempfile
+import unittest
+
+from vprof import worker
+from unittest import mock
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'Unix sockets required')
+class WorkerUnittest(unittest.TestCase):
+
+    def setUp(self):
+        self._server_conn, self._client_conn = socket.socketpair()
+
+    def tearDown(self):
+        self._server_conn.close()
+        self._client_conn.close()
+
+    @mock.patch('os.chdir')
+    @mock.patch('vprof.runner.run_profilers')
+    def testHandleRequest(self, run_mock, chdir_mock):
+        run_mock.return_value = {'p': {'totalCalls': 10}}
+        self._client_conn.sendall(worker._encode({
+            'source': 'foo.py --bar', 'config': 'p', 'cwd': '/baz',
+            'options': {'repeat': 2}}))
+        self._client_conn.shutdown(socket.SHUT_WR)
+        worker._handle_request(self._server_conn)
+        self._server_conn.close()
+        response = worker._decode(worker._read_all(self._client_conn))
+        self.assertDictEqual(response, {'stats': {'p': {'totalCalls': 10}}})
+        chdir_mock.assert_called_with('/baz')
+        run_mock.assert_called_with('foo.py --bar', 'p', verbose=True,
+                                    repeat=2)
+
+    @mock.patch('os.chdir')
+    @mock.patch('vprof.runner.run_profilers')
+    def testHandleRequest_Error(self, run_mock, _):
+        run_mock.side_effect = ValueError('foo')
+        self._client_conn.sendall(worker._encode({
+            'source': 'foo.py', 'config': 'p', 'cwd': '/', 'options': {}}))
+        self._client_conn.shutdown(socket.SHUT_WR)
+        worker._handle_request(self._server_conn)
+        self._server_conn.close()
+        response = worker._decode(worker._read_all(self._client_conn))
+        self.assertDictEqual(response, {'error': 'ValueError: foo'})
+
+    def testListen(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            socket_path = os.path.join(tmp_dir, 'worker.sock')
+            server = worker._listen(socket_path)
+            try:
+                self.assertEqual(
+                    stat.S_IMODE(os.stat(socket_path).st_mode), 0o600)
+            finally:
+                server.close()
+            # Stale socket is replaced.
+            worker._prepare_socket_path(socket_path)
+            self.assertFalse(os.path.exists(socket_path))
+
+    def testPrepareSocketPath_NotSocket(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            socket_path = os.path.join(tmp_dir, 'worker.sock')
+            with open(socket_path, 'w'):
+                pass
+            with self.assertRaises(worker.WorkerError):
+                worker._prepare_socket_path(socket_path)
+            self.assertTrue(os.path.exists(socket_path))
+
+    @mock.patch('os.getuid')
+    def testPrepareSocketPath_OtherOwner(self, getuid_mock):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            socket_path = os.path.join(tmp_dir, 'worker.sock')
+            worker._listen(socket_path).close()
+            getuid_mock.return_value = os.stat(socket_path).st_uid + 1
+            with self.assertRaises(worker.WorkerError):
+                worker._prepare_socket_path(socket_path)
+            self.assertTrue(os.path.exists(socket_path))
+            with self.assertRaises(worker.WorkerError):
+                worker.request_profile('foo.py', 'p', socket_path=socket_path)
+
+    def testPrepareSocketPath_DefaultDir(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            socket_dir = os.path.join(tmp_dir, 'vprof')
+            with mock.patch.dict(os.environ, {'XDG_RUNTIME_DIR': socket_dir}):
+                worker._prepare_socket_path(
+                    os.path.join(socket_dir, 'worker.sock'))
+                self.assertEqual(
+                    stat.S_IMODE(os.stat(socket_dir).st_mode), 0o700)
+                os.chmod(socket_dir, 0o755)
+                with self.assertRaises(worker.WorkerError):
+                    worker._prepare_socket_path(
+                        os.path.join(socket_dir, 'worker.sock'))
+
+    def testRequestProfile_NoWorker(self):
+        with self.assertRaises(worker.WorkerError):
+            worker.request_profile(
+                'foo.py', 'p', socket_path=os.path.join('nonexistent', 'foo'))
+
+# pylint: enable=protected-access, missing-docstring
@@ -15,4 +15,17 @@ describe('Memory stats test suite', () => {
     expect(memoryStatsModule.MemoryChart.generateTooltipText_(stats)).toBe(
       expectedResult);
   });
+
+  it('Check formatCensusTitle_', () => {
+    let snapshot = [16, 51.234, [['class str', 350000]]];
+    let codeEvents = [
+      [1, 10, 20.0, 'main', 'foo.py'],
+      [12, 42, 30.0, 'allocate', 'foo.py'],
+      [17, 11, 51.3, 'main', 'foo.py']];
+    expect(memoryStatsModule.MemoryChart.formatCensusTitle_(
+      snapshot, codeEvents)).toBe(
+      'New objects at line 42 of allocate (51.2 MB)');
+    expect(memoryStatsModule.MemoryChart.formatCensusTitle_(
+      snapshot, [])).toBe('New objects at event 16 (51.2 MB)');
+  });
 });
@@ -221,13 +221,17 @@ class FlameGraph {
   /** Renders flame graph legend. */
   renderLegend_() {
     let launchTime = common.formatTimestamp(this.data_.timestamp);
+    // Run time and sample interval are unknown for imported stacks.
+    let runTime = (this.data_.runTime === null) ?
+      'unknown' : this.data_.runTime + ' s';
+    let sampleInterval = (this.data_.sampleInterval === null) ?
+      'unknown' : this.data_.sampleInterval + ' s';
     this.parent_.append('div')
       .attr('class', 'content-legend')
       .html('<p><b>Object name:</b> ' + this.data_.objectName + '</p>' +
-            '<p><b>Run time:</b> ' + this.data_.runTime + ' s</p>' +
+            '<p><b>Run time:</b> ' + runTime + '</p>' +
             '<p><b>Total samples:</b> ' + this.data_.totalSamples + '</p>' +
-            '<p><b>Sample interval:</b> ' + this.data_.sampleInterval +
-            ' s</p>' +
+            '<p><b>Sample interval:</b> ' + sampleInterval + '</p>' +
             '<p><b>Timestamp:</b> ' + launchTime +'</p>')
       .style('left', this.LEGEND_X)
       .style('top', this.LEGEND_Y);
@@ -10,8 +10,12 @@ const memoryStatsModule = require('./memory_stats.js');
 const profilerModule = require('./profiler.js');
 
 const JSON_URI = 'profile';
+const EVENTS_URI = 'events';
 const POLL_INTERVAL = 100;  // msec
 
+// Tab loaders by tab ID. Tab data is requested when tab is shown first time.
+let tabLoaders_ = {};
+
 /**
  * Creates empty div with specified ID.
  * @param {string} id - div ID.
@@ -100,10 +104,41 @@ function createProfilerTab_(parent, status) {
 }
 
 /**
- * Renders stats page.
- * @param {Object} data - Data for page rendering.
+ * Registers loader that requests profiler data and renders it into tab.
+ * @param {string} tabId - Tab ID.
+ * @param {string} option - Profiler option.
+ * @param {Object} parent - Tab content element.
+ * @param {Function} render - Function that renders profiler data.
+ */
+function registerTab_(tabId, option, parent, render) {
+  tabLoaders_[tabId] = () => {
+    delete tabLoaders_[tabId];
+    let progressIndicator = parent.append('div')
+      .attr('class', 'tab-progress-indicator');
+    d3.json(JSON_URI + '/' + option, (data) => {
+      progressIndicator.remove();
+      if (data) {
+        render(data, parent);
+      }
+    });
+  };
+}
+
+/**
+ * Loads tab content if it hasn't been loaded yet.
+ * @param {string} tabId - Tab ID.
+ */
+function loadTab_(tabId) {
+  if (tabLoaders_[tabId]) {
+    tabLoaders_[tabId]();
+  }
+}
+
+/**
+ * Renders stats page. Only selected tab content is loaded right away.
+ * @param {Object} manifest - Profile manifest with profiler options.
  */
-function renderPage(data) {
+function renderPage(manifest) {
   // Remove all existing tabs and their content
   // in case if user is refreshing main page.
   d3.select('body').selectAll('*').remove();
@@ -112,8 +147,9 @@ function renderPage(data) {
     .append('ul')
     .attr('class', 'main-tab-header');
 
-  let props = Object.keys(data);
-  props.sort();
+  tabLoaders_ = {};
+  let props = manifest.profilers.slice().sort();
+  let firstTabId = null;
   for (let i = 0; i < props.length; i++) {
     let status = (i === 0) ? 'main-tab-selected' : 'main-tab-not-selected';
     let displayClass = (i === 0) ? 'active-tab' : 'inactive-tab';
@@ -121,30 +157,42 @@ function renderPage(data) {
     case 'c':
       createFlameGraphTab_(tabHeader, status);
       let flameGraph = createTabContent_('flame-graph-tab');
-      flameGraphModule.renderFlameGraph(data.c, flameGraph);
+      registerTab_('flame-graph-tab', 'c', flameGraph,
+                   flameGraphModule.renderFlameGraph);
+      firstTabId = firstTabId || 'flame-graph-tab';
       flameGraph.classed(displayClass, true);
       break;
     case 'm':
       createMemoryChartTab_(tabHeader, status);
       let memoryChart = createTabContent_('memory-chart-tab');
-      memoryStatsModule.renderMemoryStats(data.m, memoryChart);
+      registerTab_('memory-chart-tab', 'm', memoryChart,
+                   memoryStatsModule.renderMemoryStats);
+      firstTabId = firstTabId || 'memory-chart-tab';
       memoryChart.classed(displayClass, true);
       break;
     case 'h':
       createCodeHeatmapTab_(tabHeader, status);
       let codeHeatmap = createTabContent_('code-heatmap-tab');
-      codeHeatmapModule.renderCodeHeatmap(data.h, codeHeatmap);
+      registerTab_('code-heatmap-tab', 'h', codeHeatmap,
+                   codeHeatmapModule.renderCodeHeatmap);
+      firstTabId = firstTabId || 'code-heatmap-tab';
       codeHeatmap.classed(displayClass, true);
       break;
     case 'p':
       createProfilerTab_(tabHeader, status);
       let profilerOutput = createTabContent_('profiler-tab');
-      profilerModule.renderProfilerOutput(data.p, profilerOutput);
+      registerTab_('profiler-tab', 'p', profilerOutput,
+                   profilerModule.renderProfilerOutput);
+      firstTabId = firstTabId || 'profiler-tab';
       profilerOutput.classed(displayClass, true);
       break;
     }
   }
 
+  if (firstTabId) {
+    loadTab_(firstTabId);
+  }
+
   let helpButton = tabHeader.append('div')
     .attr('class', 'help-button')
     .text('?');
@@ -177,23 +225,44 @@ function showTab_(tabId) {
   d3.select('#' + tabId)
     .classed('active-tab', true)
     .classed('inactive-tab', false);
+  loadTab_(tabId);
+}
+
+/**
+ * Renders page if profile manifest lists any profilers.
+ * @param {Object} manifest - Profile manifest.
+ * @param {Object} progressIndicator - Element to remove before rendering.
+ * @param {Function} onRender - Called before page is rendered.
+ */
+function renderManifest_(manifest, progressIndicator, onRender) {
+  if (manifest && manifest.profilers.length !== 0) {
+    progressIndicator.remove();
+    onRender();
+    renderPage(manifest);
+  }
 }
 
-/** Makes request to server and renders page with received data. */
+/**
+ * Renders page once server notifies that profile data is available.
+ * Falls back to polling in browsers without server-sent events support.
+ */
 function main() {
   let progressIndicator = d3.select('body')
     .append('div')
     .attr('id', 'main-progress-indicator');
 
-  let timerId = setInterval(() => {
-    d3.json(JSON_URI, (data) => {
-      if (Object.keys(data).length !== 0) {
-        progressIndicator.remove();
-        clearInterval(timerId);
-        renderPage(data);
-      }
-    });
-  }, POLL_INTERVAL);
+  if (typeof EventSource === 'undefined') {
+    let timerId = setInterval(() => {
+      d3.json(JSON_URI, (manifest) => renderManifest_(
+        manifest, progressIndicator, () => clearInterval(timerId)));
+    }, POLL_INTERVAL);
+    return;
+  }
+  // Server sends current profile manifest right after connecting,
+  // so data uploaded before subscription isn't missed.
+  let events = new EventSource(EVENTS_URI);
+  events.addEventListener('profile', (event) => renderManifest_(
+    JSON.parse(event.data), progressIndicator, () => events.close()));
 }
 
 main();
@@ -289,6 +289,59 @@ class MemoryChart {
       .text((d) => d[0]);
     countRows.append('td')
       .text((d) => d[1]);
+
+    for (let snapshot of this.data_.objectsCensus || []) {
+      this.renderCensusTable_(snapshot);
+    }
+  }
+
+  /**
+   * Renders objects created since the start at the time of memory growth.
+   * @param {Object[]} snapshot - Object census snapshot.
+   */
+  renderCensusTable_(snapshot) {
+    let tableName = this.objectsTable_.append('tr')
+      .attr('class', 'memory-table-name');
+    tableName.append('td')
+      .text(MemoryChart.formatCensusTitle_(
+        snapshot, this.data_.codeEvents));
+    tableName.append('td')
+      .text('');
+
+    let censusRows = this.objectsTable_.selectAll(null)
+      .data(snapshot[2])
+      .enter()
+      .append('tr')
+      .attr('class', 'memory-table-row');
+    censusRows.append('td')
+      .text((d) => d[0]);
+    censusRows.append('td')
+      .text((d) => '+' + d[1]);
+  }
+
+  /**
+   * Generates title of object census table.
+   * Snapshot refers to code event number, consecutive events of the same
+   * line are merged, so line is taken from the last event that starts
+   * at or before the snapshot.
+   * @static
+   * @param {Object[]} snapshot - Object census snapshot.
+   * @param {Object[]} codeEvents - Code events of memory chart.
+   * @returns {string}
+   */
+  static formatCensusTitle_(snapshot, codeEvents) {
+    let codeEvent = null;
+    for (let event of codeEvents) {
+      if (event[0] > snapshot[0]) {
+        break;
+      }
+      codeEvent = event;
+    }
+    let location = codeEvent ?
+      'line ' + codeEvent[1] + ' of ' + codeEvent[3] :
+      'event ' + snapshot[0];
+    return ('New objects at ' + location + ' (' +
+            snapshot[1].toFixed(1) + ' MB)');
   }
 }
 
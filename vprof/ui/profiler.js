@@ -16,12 +16,59 @@ const d3 = require('d3');
 class Profiler {
   constructor(parent, data) {
     this.PATH_CHAR_COUNT = 70;
+    this.PAGE_SIZE = 100;
+    this.SCROLL_THRESHOLD = 50;  // px
+    this.STATS_URI = 'profile/p';
     this.HELP_MESSAGE = (
-      '<p>&#8226 Hover over record to see detailed stats</p>');
+      '<p>&#8226 Hover over record to see detailed stats</p>' +
+      '<p>&#8226 Click on column header to sort records</p>' +
+      '<p>&#8226 Scroll down to load more records</p>');
+    // Column headers and names of the columns on the server.
+    this.COLUMNS = [
+      ['Color', null], ['%', 'percentage'], ['Function name', 'function'],
+      ['Filename', 'filename'], ['Line', 'line'], ['Time', 'time']];
 
     this.data_ = data;
     this.parent_ = parent;
     this.color_ = color.createColorScale();
+    this.records_ = [];
+    this.totalRecords_ = data.totalRecords;
+    this.sort_ = '-percentage';
+    this.filter_ = '';
+    this.loading_ = false;
+    this.requestId_ = 0;
+  }
+
+  /**
+   * Returns HTML description of the function time across profiled runs.
+   * @param {Object} item - Profiler record info.
+   * @returns {string}
+   */
+  formatRunStats_(item) {
+    if (!item.runStats || this.data_.repeat < 2) {
+      return '';
+    }
+    return ('<p><b>Time per run (mean/min/std):</b> ' + item.runStats[0] +
+            's / ' + item.runStats[1] + 's / ' + item.runStats[2] + 's</p>');
+  }
+
+  /**
+   * Returns HTML description of the top callers of the function.
+   * @param {Object} item - Profiler record info.
+   * @returns {string}
+   */
+  formatCallers_(item) {
+    if (!item.callers || item.callers.length === 0) {
+      return '';
+    }
+    let result = '<p><b>Top callers:</b></p>';
+    for (let i = 0; i < item.callers.length; i++) {
+      let caller = item.callers[i];
+      let funcName = caller[0].replace(/</g, "&lt;").replace(/>/g, "&gt;");
+      result += ('<p>&#8226 ' + funcName + ':' + caller[1] + ' - ' +
+                 caller[2] + ' calls, ' + caller[3] + 's</p>');
+    }
+    return result;
   }
 
   /** Renders profiler output */
@@ -29,77 +76,150 @@ class Profiler {
     let content = this.parent_.append('div')
       .attr('class', 'profiler-content');
 
-    let tooltip = this.parent_.append('div')
+    this.tooltip_ = this.parent_.append('div')
       .attr('class', 'content-tooltip content-tooltip-invisible');
 
-    let recordsTable = content.append('div')
+    let tableWrapper = content.append('div')
       .attr('class', 'profiler-record-table-wrapper')
-      .append('div')
+      .on('scroll', () => {
+        let node = tableWrapper.node();
+        if (node.scrollTop + node.clientHeight + this.SCROLL_THRESHOLD >=
+            node.scrollHeight) {
+          this.loadPage_();
+        }
+      });
+
+    let filterInput = tableWrapper.append('input')
+      .attr('class', 'profiler-filter')
+      .attr('placeholder', 'Filter by function name or filename')
+      .on('input', () => {
+        this.filter_ = filterInput.node().value;
+        this.reload_();
+      });
+
+    this.recordsTable_ = tableWrapper.append('div')
       .attr('class', 'profiler-record-table');
 
-    recordsTable.append('tr')
+    this.recordsTable_.append('tr')
       .attr('class', 'profiler-record-table-header')
-      .html(
-        '<td>Color</td>' +
-        '<td>%</td>' +
-        '<td>Function name</td>' +
-        '<td>Filename</td>' +
-        '<td>Line</td>' +
-        '<td>Time</td>');
+      .selectAll('td')
+      .data(this.COLUMNS)
+      .enter()
+      .append('td')
+      .text((d) => d[0])
+      .on('click', (d) => {
+        if (d[1] !== null) {
+          this.sort_ = (this.sort_ === '-' + d[1]) ? d[1] : '-' + d[1];
+          this.reload_();
+        }
+      });
 
     this.renderLegend_(content);
     this.renderHelp_();
+    this.appendPage_(this.data_);
+  }
+
+  /**
+   * Adds page of records received from server to the table.
+   * @param {Object} page - Page of profiler records.
+   */
+  appendPage_(page) {
+    for (let i = 0; i < page.callStats.length; i++) {
+      this.records_.push({
+        'record': page.callStats[i],
+        'runStats': page.runStats ? page.runStats[i] : null,
+        'callers': page.callers ? page.callers[i] : null,
+      });
+    }
+    this.totalRecords_ = page.totalRecords;
 
-    let records = recordsTable.selectAll('.profiler-record-normal')
-      .data(this.data_.callStats)
+    let records = this.recordsTable_.selectAll('.profiler-record')
+      .data(this.records_)
       .enter()
       .append('tr')
-      .attr('class', 'profiler-record-normal')
-      .on('mouseover', (d, i, n) => this.showTooltip_(n[i], tooltip, d))
-      .on('mouseout', (d, i, n) => this.hideTooltip_(n[i], tooltip));
+      .attr('class', 'profiler-record profiler-record-normal')
+      .on('mouseover', (d, i, n) => this.showTooltip_(n[i], d))
+      .on('mouseout', (d, i, n) => this.hideTooltip_(n[i]));
 
     records.append('td')
       .attr('class', 'profiler-record-color')
-      .style('background', (d) => this.color_(d[9]));
+      .style('background', (d) => this.color_(d.record[9]));
 
     records.append('td')
       .attr('class', 'profiler-record-percentage')
-      .html((d) => d[4] + '%');
+      .html((d) => d.record[4] + '%');
 
     records.append('td')
       .attr('class', 'profiler-record-funcname')
-      .html((d) => d[2].replace(/</g, "&lt;").replace(/>/g, "&gt;"));
+      .html((d) => d.record[2].replace(/</g, "&lt;").replace(/>/g, "&gt;"));
 
     records.append('td')
       .attr('class', 'profiler-record-filename')
-      .html((d) => common.shortenString(d[0], 70, false));
+      .html((d) => common.shortenString(
+        d.record[0], this.PATH_CHAR_COUNT, false));
 
     records.append('td')
       .attr('class', 'profiler-record-lineno')
-      .html((d) => d[1]);
+      .html((d) => d.record[1]);
 
     records.append('td')
       .attr('class', 'profiler-record-cumtime')
-      .html((d) => d[3] + 's');
+      .html((d) => d.record[3] + 's');
+  }
+
+  /** Requests next page of records from server. */
+  loadPage_() {
+    if (this.loading_ || this.records_.length >= this.totalRecords_) {
+      return;
+    }
+    this.loading_ = true;
+    let requestId = this.requestId_;
+    let uri = (this.STATS_URI +
+               '?sort=' + encodeURIComponent(this.sort_) +
+               '&offset=' + this.records_.length +
+               '&limit=' + this.PAGE_SIZE +
+               '&filter=' + encodeURIComponent(this.filter_));
+    d3.json(uri, (page) => {
+      // Sorting or filter have changed while request was in flight.
+      if (requestId !== this.requestId_) {
+        return;
+      }
+      this.loading_ = false;
+      if (page) {
+        this.appendPage_(page);
+      }
+    });
+  }
+
+  /** Drops loaded records and loads them with current sort and filter. */
+  reload_() {
+    this.requestId_++;
+    this.loading_ = false;
+    this.records_ = [];
+    this.totalRecords_ = Infinity;
+    this.recordsTable_.selectAll('.profiler-record').remove();
+    this.loadPage_();
   }
 
   /**
    * Shows record tooltip.
    * @param {Object} element - Profiler record element.
-   * @param {Object} tooltip - Tooltip element.
-   * @param {Object} node - Profiler record info
+   * @param {Object} item - Profiler record info.
    */
-  showTooltip_(element, tooltip, node) {
-    d3.select(element).attr('class', 'profiler-record-highlight');
+  showTooltip_(element, item) {
+    d3.select(element).classed('profiler-record-highlight', true);
+    let node = item.record;
     let funcName = node[2].replace(/</g, "&lt;").replace(/>/g, "&gt;");
-    tooltip.attr('class', 'content-tooltip content-tooltip-visible')
+    this.tooltip_.attr('class', 'content-tooltip content-tooltip-visible')
       .html('<p><b>Function name:</b> ' + funcName + '</p>' +
             '<p><b>Line number:</b> ' + node[1] +'</p>' +
             '<p><b>Filename:</b> ' + node[0] +'</p>' +
             '<p><b>Cumulative time:</b> ' + node[3] +'s</p>' +
             '<p><b>Number of calls:</b> ' + node[5] +'</p>' +
             '<p><b>Cumulative calls:</b> ' + node[6] +'</p>' +
-            '<p><b>Time per call:</b> ' + node[7] +'s</p>')
+            '<p><b>Time per call:</b> ' + node[7] +'s</p>' +
+            this.formatRunStats_(item) +
+            this.formatCallers_(item))
       .style('left', d3.event.pageX)
       .style('top', d3.event.pageY);
   }
@@ -107,11 +227,10 @@ class Profiler {
   /**
    * Hides record tooltip.
    * @param {Object} element - Profiler record element.
-   * @param {Object} tooltip - Tooltip element.
    */
-  hideTooltip_(element, tooltip) {
-    d3.select(element).attr('class', 'profiler-record-normal');
-    tooltip.attr('class', 'content-tooltip content-tooltip-invisible');
+  hideTooltip_(element) {
+    d3.select(element).classed('profiler-record-highlight', false);
+    this.tooltip_.attr('class', 'content-tooltip content-tooltip-invisible');
   }
 
   /** Renders profiler tab legend. */
@@ -126,6 +245,9 @@ class Profiler {
             '<p><b>Total time:</b> ' + this.data_.totalTime + 's</p>' +
             '<p><b>Primitive calls:</b> ' + this.data_.primitiveCalls + '</p>' +
             '<p><b>Total calls:</b> ' + this.data_.totalCalls + '</p>' +
+            '<p><b>Functions:</b> ' + this.data_.totalRecords + '</p>' +
+            '<p><b>Profiled runs:</b> ' + (this.data_.repeat || 1) + '</p>' +
+            '<p><b>Timer:</b> ' + (this.data_.timer || 'default') + '</p>' +
             '<p><b>Timestamp:</b> ' + launchTime +'</p>');
   }
 
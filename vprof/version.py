@@ -0,0 +1,2 @@
+"""Version of vprof shared by CLI, profile files and agents."""
+__version__ = '0.38'
@@ -0,0 +1,232 @@
+"""Worker that profiles programs in processes forked from a warm parent.
+
+Worker imports profilers and specified modules once at start and then forks
+a child process for every profiling request received over a Unix socket,
+so requests don't pay for interpreter startup and imports. Anyone who can
+connect to the socket can run code as the worker's user, so the socket is
+accessible only by its owner and is kept in a private directory by default.
+"""
+import gzip
+import importlib
+import json
+import os
+import socket
+import stat
+import sys
+import tempfile
+
+from collections import OrderedDict
+
+
+def _get_default_socket_dir():
+    """Returns directory of default socket that only current user can use.
+
+    XDG runtime directory is private by specification, otherwise a
+    directory in temporary directory is created for every user.
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return runtime_dir
+    uid = os.getuid() if hasattr(os, 'getuid') else 0
+    return os.path.join(tempfile.gettempdir(), 'vprof-%d' % uid)
+
+
+DEFAULT_SOCKET_PATH = os.path.join(
+    _get_default_socket_dir(), 'vprof_worker.sock')
+_SOCKET_DIR_MODE = 0o700
+_SOCKET_MODE = 0o600
+_BACKLOG = 16
+_CHUNK_SIZE = 64 * 1024
+
+
+class Error(Exception):
+    """Base exception for current module."""
+    pass  # pylint: disable=unnecessary-pass
+
+
+class WorkerError(Error):
+    """Raised when worker is unavailable or unable to profile a program."""
+    pass  # pylint: disable=unnecessary-pass
+
+
+def _check_platform():
+    """Checks whether worker is supported by current platform."""
+    if not hasattr(socket, 'AF_UNIX') or not hasattr(os, 'fork'):
+        raise WorkerError('Worker requires fork and Unix sockets support')
+
+
+def _check_owner(path):
+    """Checks that path is owned by current user.
+
+    Raises:
+        WorkerError: If path is owned by another user.
+    """
+    if os.lstat(path).st_uid != os.getuid():
+        raise WorkerError('%s is owned by another user' % path)
+
+
+def _prepare_socket_path(socket_path):
+    """Creates private socket directory and removes stale socket.
+
+    Raises:
+        WorkerError: If socket directory is accessible by other users or
+            socket path is taken by a file that isn't own socket.
+    """
+    socket_dir = os.path.dirname(socket_path)
+    if socket_dir == _get_default_socket_dir():
+        os.makedirs(socket_dir, mode=_SOCKET_DIR_MODE, exist_ok=True)
+        _check_owner(socket_dir)
+        if os.lstat(socket_dir).st_mode & 0o077:
+            raise WorkerError(
+                '%s is accessible by other users' % socket_dir)
+    if not os.path.lexists(socket_path):
+        return
+    _check_owner(socket_path)
+    if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+        raise WorkerError('%s exists and is not a socket' % socket_path)
+    os.remove(socket_path)
+
+
+def _listen(socket_path):
+    """Returns socket listening on path that only current user can use."""
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Socket file is created by bind, umask keeps it private from the start.
+    old_umask = os.umask(0o177)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    os.chmod(socket_path, _SOCKET_MODE)
+    server.listen(_BACKLOG)
+    return server
+
+
+def _read_all(conn):
+    """Reads data from connection until the other side stops sending."""
+    chunks = []
+    while True:
+        chunk = conn.recv(_CHUNK_SIZE)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def _encode(message):
+    """Serializes message for sending over socket."""
+    return gzip.compress(json.dumps(message).encode('utf-8'))
+
+
+def _decode(data):
+    """Deserializes message received over socket."""
+    return json.loads(
+        gzip.decompress(data).decode('utf-8'), object_pairs_hook=OrderedDict)
+
+
+def preload_modules(module_names):
+    """Imports modules, so processes forked from worker don't have to."""
+    for module_name in module_names:
+        try:
+            importlib.import_module(module_name)
+        except Exception as exc:  # pylint: disable=broad-except
+            print('Unable to preload %s: %s' % (module_name, exc))
+
+
+def _handle_request(conn):
+    """Runs profilers requested via conn and sends back collected stats."""
+    from vprof import runner  # pylint: disable=import-outside-toplevel
+    try:
+        request = _decode(_read_all(conn))
+        os.chdir(request['cwd'])
+        program_stats = runner.run_profilers(
+            request['source'], request['config'], verbose=True,
+            **request['options'])
+        response = {'stats': program_stats}
+    except Exception as exc:  # pylint: disable=broad-except
+        response = {'error': '%s: %s' % (exc.__class__.__name__, exc)}
+    conn.sendall(_encode(response))
+
+
+def _reap_children():
+    """Collects exit statuses of finished child processes."""
+    try:
+        while os.waitpid(-1, os.WNOHANG)[0]:
+            pass
+    except ChildProcessError:
+        pass
+
+
+def serve(socket_path=DEFAULT_SOCKET_PATH, preload=()):
+    """Starts worker that serves profiling requests.
+
+    Args:
+        socket_path: Path to Unix socket to listen on.
+        preload: Names of modules to import before serving requests.
+    Raises:
+        WorkerError: If socket can't be created safely.
+    """
+    _check_platform()
+    _prepare_socket_path(socket_path)
+    from vprof import runner  # pylint: disable=import-outside-toplevel
+    runner.load_profilers()
+    preload_modules(preload)
+    server = _listen(socket_path)
+    print('Worker is listening on %s...' % socket_path)
+    try:
+        while True:
+            conn, _ = server.accept()
+            _reap_children()
+            if os.fork() == 0:
+                server.close()
+                try:
+                    _handle_request(conn)
+                finally:
+                    conn.close()
+                    sys.stdout.flush()
+                    os._exit(0)  # pylint: disable=protected-access
+            conn.close()
+    except KeyboardInterrupt:
+        print('Stopping...')
+    finally:
+        server.close()
+        os.remove(socket_path)
+
+
+def request_profile(source, config, socket_path=DEFAULT_SOCKET_PATH,
+                    **options):
+    """Profiles program in process forked by worker.
+
+    Args:
+        source: Program to profile (module or package path with arguments).
+        config: A string with profilers configuration.
+        socket_path: Path to Unix socket of the worker.
+        options: Other arguments of runner.run_profilers.
+    Returns:
+        An ordered dictionary with collected stats.
+    Raises:
+        WorkerError: when worker is unavailable or profiling failed.
+    """
+    _check_platform()
+    request = {
+        'source': source,
+        'config': config,
+        'cwd': os.getcwd(),
+        'options': options,
+    }
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        # Programs and their arguments aren't sent to other users.
+        _check_owner(socket_path)
+        client.connect(socket_path)
+        client.sendall(_encode(request))
+        client.shutdown(socket.SHUT_WR)
+        response = _decode(_read_all(client))
+    except (OSError, ValueError) as exc:
+        raise WorkerError(
+            'Unable to communicate with worker at %s: %s' % (
+                socket_path, exc)) from exc
+    finally:
+        client.close()
+    if 'error' in response:
+        raise WorkerError(response['error'])
+    return response['stats']